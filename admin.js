@@ -5,10 +5,27 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Load initial data
     loadGameState();
+    loadPlayers();
     
     // Set up event listeners
     document.getElementById('refreshPlayers').addEventListener('click', function() {
-        loadGameState();
+        loadPlayers();
+    });
+    
+    document.getElementById('playerFilters').addEventListener('submit', function(event) {
+        event.preventDefault();
+        playerPages = [null];
+        loadPlayers();
+    });
+    
+    document.getElementById('prevPlayers').addEventListener('click', function() {
+        playerPages.pop();
+        loadPlayers();
+    });
+    
+    document.getElementById('nextPlayers').addEventListener('click', function() {
+        playerPages.push(nextPlayerCursor);
+        loadPlayers();
     });
     
     document.getElementById('refreshBattles').addEventListener('click', function() {
@@ -18,10 +35,24 @@ document.addEventListener('DOMContentLoaded', function() {
     document.getElementById('createDeityBtn').addEventListener('click', createDeity);
 });
 
-// Function to load game state
+// Cursors of the player pages visited so far, the last one is the page shown
+let playerPages = [null];
+let nextPlayerCursor = null;
+
+// Filter inputs of the players table, by /api/players parameter
+const playerFilterInputs = {
+    race: 'filterRace',
+    class: 'filterClass',
+    element: 'filterElement',
+    rank: 'filterRank',
+    in_battle: 'filterInBattle',
+    is_deity: 'filterIsDeity'
+};
+
+// Function to load game state (without players, which are paged through separately)
 async function loadGameState() {
     try {
-        const response = await fetch('/api/game_state');
+        const response = await fetch('/api/game_state?players=0');
         
         if (!response.ok) {
             throw new Error('Failed to load game state');
@@ -30,29 +61,69 @@ async function loadGameState() {
         const gameState = await response.json();
         
         // Update UI with game state data
-        updatePlayersTable(gameState.players);
-        updateBattlesTable(gameState.active_battles, gameState.players);
-        updateDeitiesTable(gameState.deities, gameState.players);
-        updatePlayerSelect(gameState.players);
+        updateBattlesTable(gameState.active_battles, gameState.player_names);
+        updateDeitiesTable(gameState.deities, gameState.player_names);
+        loadPlayerSelect();
     } catch (error) {
         console.error('Error loading game state:', error);
         alert('Failed to load game state. Please try again.');
     }
 }
 
+// Function to load the current page of players with the selected sort and filters
+async function loadPlayers() {
+    const params = new URLSearchParams({
+        sort: document.getElementById('playerSort').value,
+        order: document.getElementById('playerOrder').value
+    });
+    
+    for (const [param, inputId] of Object.entries(playerFilterInputs)) {
+        const value = document.getElementById(inputId).value.trim();
+        if (value) {
+            params.set(param, value);
+        }
+    }
+    
+    const cursor = playerPages[playerPages.length - 1];
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    
+    try {
+        const response = await fetch(`/api/players?${params}`);
+        
+        if (!response.ok) {
+            throw new Error('Failed to load players');
+        }
+        
+        const page = await response.json();
+        nextPlayerCursor = page.next_cursor;
+        
+        updatePlayersTable(page.players);
+        document.getElementById('prevPlayers').disabled = playerPages.length <= 1;
+        document.getElementById('nextPlayers').disabled = !nextPlayerCursor;
+        document.getElementById('playerPageInfo').textContent =
+            `Page ${playerPages.length}` + (page.total !== null ? ` of ${page.total} players` : '');
+    } catch (error) {
+        console.error('Error loading players:', error);
+        alert('Failed to load players. Please try again.');
+    }
+}
+
 // Function to update the players table
 function updatePlayersTable(players) {
     const tableBody = document.getElementById('playerTableBody');
     tableBody.innerHTML = '';
     
-    if (!players || Object.keys(players).length === 0) {
+    if (!players || players.length === 0) {
         const row = document.createElement('tr');
-        row.innerHTML = '<td colspan="7" class="text-center">No players registered</td>';
+        row.innerHTML = '<td colspan="7" class="text-center">No players found</td>';
         tableBody.appendChild(row);
         return;
     }
     
-    for (const [phoneNumber, player] of Object.entries(players)) {
+    for (const player of players) {
+        const phoneNumber = player.phone;
         const row = document.createElement('tr');
         
         row.innerHTML = `
@@ -100,7 +171,7 @@ function updatePlayersTable(players) {
 }
 
 // Function to update the battles table
-function updateBattlesTable(battles, players) {
+function updateBattlesTable(battles, playerNames) {
     const tableBody = document.getElementById('battleTableBody');
     tableBody.innerHTML = '';
     
@@ -115,11 +186,11 @@ function updateBattlesTable(battles, players) {
         const row = document.createElement('tr');
         
         // Get player names for display
-        const player1 = players[battle.players[0]] ? players[battle.players[0]].username : 'Unknown';
-        const player2 = players[battle.players[1]] ? players[battle.players[1]].username : 'Unknown';
+        const player1 = playerNames[battle.players[0]] || 'Unknown';
+        const player2 = playerNames[battle.players[1]] || 'Unknown';
         
         // Get current turn player name
-        const currentTurn = players[battle.current_turn] ? players[battle.current_turn].username : 'Unknown';
+        const currentTurn = playerNames[battle.current_turn] || 'Unknown';
         
         row.innerHTML = `
             <td>${player1} vs ${player2}</td>
@@ -155,7 +226,7 @@ function updateBattlesTable(battles, players) {
 }
 
 // Function to update the deities table
-function updateDeitiesTable(deities, players) {
+function updateDeitiesTable(deities, playerNames) {
     const tableBody = document.getElementById('deityTableBody');
     tableBody.innerHTML = '';
     
@@ -170,7 +241,7 @@ function updateDeitiesTable(deities, players) {
         const row = document.createElement('tr');
         
         // Get player name for display
-        const playerName = players[deity.player_phone] ? players[deity.player_phone].username : 'Unknown';
+        const playerName = playerNames[deity.player_phone] || 'Unknown';
         
         row.innerHTML = `
             <td>${deity.name}</td>
@@ -213,23 +284,20 @@ function updateDeitiesTable(deities, players) {
     });
 }
 
-// Function to update the player select dropdown
-function updatePlayerSelect(players) {
+// Function to fill the player select dropdown with the highest level players who are not deities
+async function loadPlayerSelect() {
     const playerSelect = document.getElementById('playerSelect');
     playerSelect.innerHTML = '<option value="">-- Select Player --</option>';
     
-    if (!players || Object.keys(players).length === 0) {
-        return;
+    const response = await fetch('/api/players?is_deity=false&sort=level&order=desc&limit=200');
+    if (!response.ok) {
+        throw new Error('Failed to load players');
     }
     
-    for (const [phoneNumber, player] of Object.entries(players)) {
-        // Skip players who are already deities
-        if (player.is_deity) {
-            continue;
-        }
-        
+    const page = await response.json();
+    for (const player of page.players) {
         const option = document.createElement('option');
-        option.value = phoneNumber;
+        option.value = player.phone;
         option.textContent = `${player.username} (Level ${player.level} ${player.race} ${player.class})`;
         playerSelect.appendChild(option);
     }
@@ -391,6 +459,7 @@ async function createDeity() {
         
         // Reload game state
         loadGameState();
+        loadPlayers();
         
         // Show success message
         alert('Deity created successfully');
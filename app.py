@@ -7,9 +7,22 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from twilio_integration import process_incoming_message
-from game_logic import process_game_command
-from utils import save_game_state, load_game_state
+from twilio_integration import process_incoming_message, broadcast, start_outbound_spool, outbound_spool
+from twilio_integration import send_whatsapp_message
+from game_events import start_turn_notifier, turn_notifier
+from twiml import EMPTY_RESPONSE
+from game_logic import reap_stale_battles
+from battle_archive import find_battles, write_archived
+from utils import save_game_state, stage_changes, complete_save, load_game_state, new_game_state, detach_section, state_as_dict, start_background_flusher
+from utils import PERSISTENCE_MODE
+from state_flusher import FLUSH_INTERVAL
+from state_tracking import track_sections, reset_tracking, collect_changes
+from locking import state_lock, player_locks
+from idempotency import LEGACY_SECTION
+from indexes import username_index, battle_index, player_versions, find_player_by_username
+from indexes import player_listing, encode_cursor, decode_cursor, PLAYER_SORTS, PLAYER_FILTERS
+from catalog import reload_catalog
+from rendering import player_views
 
 # Initialize logging
 logger = logging.getLogger(__name__)
@@ -26,6 +39,30 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
+# Player storage: "memory" keeps players in the game state files, "sql" in the Player table,
+# "indexed" in an append-only data file whose records are loaded on first access
+PLAYER_STORE = os.environ.get("GAME_PLAYER_STORE", "memory")
+
+# Async webhook: acknowledge messages at once, run them on worker threads and reply
+# through the Twilio API, so commands are not bound by Twilio's request timeout
+ASYNC_WEBHOOK = os.environ.get("GAME_ASYNC_WEBHOOK", "0") == "1"
+
+# Outbound spool: messages sent through the Twilio API are written to disk and delivered
+# in the background with retries, instead of being sent (or lost) on the caller's thread
+OUTBOUND_SPOOL = os.environ.get("GAME_OUTBOUND_SPOOL", "1") == "1"
+
+# Turn notifications: tell players when a duel starts, when it is their turn and when it
+# ends, so they do not have to poll with 'attack'
+TURN_NOTIFICATIONS = os.environ.get("GAME_TURN_NOTIFICATIONS", "1") == "1"
+
+# Players per page of /api/players by default and at most
+PLAYER_PAGE_SIZE = int(os.environ.get("GAME_PLAYER_PAGE_SIZE", "50"))
+PLAYER_PAGE_MAX = int(os.environ.get("GAME_PLAYER_PAGE_MAX", "200"))
+
+# Player fields returned by /api/players, the full record is at /api/player/<phone>
+PLAYER_SUMMARY_FIELDS = ("username", "race", "class", "element", "level", "rank", "gold",
+                         "in_battle", "is_deity", "created_at")
+
 # Configure database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///rpg_game.db")
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
@@ -40,19 +77,61 @@ try:
     logger.info("Game state loaded successfully")
 except Exception as e:
     logger.error(f"Failed to load game state: {e}")
-    game_state = {
-        "players": {},
-        "active_battles": {},
-        "zones": {},
-        "items": {},
-        "deities": {}
-    }
+    game_state = track_sections(new_game_state())
     save_game_state(game_state)
 
+# Replies to processed messages moved to their own table, drop the section older versions kept
+if game_state.pop(LEGACY_SECTION, None) is not None:
+    detach_section(game_state, LEGACY_SECTION)
+
 # Import models after DB initialization
 with app.app_context():
     from models import User, Player, Admin
     db.create_all()
+    # create_all never alters existing tables, add the Player columns newer versions need
+    from sql_player_store import migrate_schema
+    migrate_schema(db.engine)
+    
+    if PLAYER_STORE in ("sql", "indexed") and PERSISTENCE_MODE == "shared":
+        # Player stores cache entries per process, the shared store keeps workers consistent
+        logger.warning(f"GAME_PLAYER_STORE={PLAYER_STORE} is ignored in shared persistence mode")
+    elif PLAYER_STORE in ("sql", "indexed"):
+        file_players = game_state.get("players", {})
+        if PLAYER_STORE == "sql":
+            from sql_player_store import SqlPlayerStore
+            game_state["players"] = SqlPlayerStore.from_game_state(db.engine, file_players)
+        else:
+            from player_store import PlayerStore
+            game_state["players"] = PlayerStore.from_game_state(file_players)
+        if file_players:
+            detach_section(game_state, "players")
+
+# Build the indexes now rather than on the first registration, duel or attack
+username_index(game_state)
+battle_index(game_state)
+player_versions(game_state)
+
+# Free players stuck in battles that were abandoned while the server was down
+reap_stale_battles(game_state)
+save_game_state(game_state)
+write_archived()
+
+# Coalesce saves in a background thread when a durability window is configured
+if FLUSH_INTERVAL > 0:
+    start_background_flusher(game_state)
+
+if OUTBOUND_SPOOL:
+    start_outbound_spool()
+
+if TURN_NOTIFICATIONS:
+    start_turn_notifier(send_whatsapp_message)
+
+command_queue = None
+if ASYNC_WEBHOOK:
+    from async_webhook import CommandQueue
+    command_queue = CommandQueue(game_state).start()
+    command_queue.install_shutdown_hooks()
+    logger.info("Async webhook mode enabled")
 
 # Routes
 
@@ -107,14 +186,20 @@ def webhook():
         # Extract message data from Twilio
         message_body = request.values.get("Body", "").strip()
         sender_phone = request.values.get("From", "").strip()
+        message_sid = request.values.get("MessageSid")
         
-        # Process the message
-        response = process_incoming_message(message_body, sender_phone, game_state)
+        if not sender_phone:
+            return "Missing sender", 400
         
-        # Save game state after processing
-        save_game_state(game_state)
+        if command_queue is not None:
+            # Acknowledge now, the reply is sent through the Twilio API once the command ran
+            if not command_queue.submit(message_body, sender_phone, message_sid):
+                return "Too many pending messages", 503
+            return EMPTY_RESPONSE
         
-        return str(response)
+        # Process the message (the command's changes are saved, or queued for the
+        # background flusher, before it returns)
+        return process_incoming_message(message_body, sender_phone, game_state, message_sid)
     
     except Exception as e:
         logger.error(f"Error processing webhook: {e}")
@@ -126,7 +211,61 @@ def get_game_state():
     if not session.get("admin_logged_in"):
         return jsonify({"error": "Unauthorized"}), 401
     
-    return jsonify(game_state)
+    if request.args.get("players") != "0":
+        return jsonify(state_as_dict(game_state))
+    
+    # The dashboard pages through /api/players, it only needs the names of players in battles and deities
+    state = state_as_dict(game_state, exclude=("players",))
+    phones = {phone for battle in state.get("active_battles", {}).values() for phone in battle.get("players", [])}
+    phones.update(deity["player_phone"] for deity in state.get("deities", {}).values())
+    players = game_state["players"]
+    state["player_names"] = {}
+    for phone in phones:
+        player = players.peek(phone)
+        if player is not None:
+            state["player_names"][phone] = player["username"]
+    
+    return jsonify(state)
+
+@app.route("/api/players", methods=["GET"])
+def list_players():
+    """API endpoint to page through players, sorted and filtered server-side (admin only)."""
+    if not session.get("admin_logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    sort = request.args.get("sort", "created")
+    if sort not in PLAYER_SORTS:
+        return jsonify({"error": f"Sort by one of: {', '.join(PLAYER_SORTS)}"}), 400
+    order = request.args.get("order", "asc")
+    if order not in ("asc", "desc"):
+        return jsonify({"error": "Order must be asc or desc"}), 400
+    limit = min(max(request.args.get("limit", PLAYER_PAGE_SIZE, type=int), 1), PLAYER_PAGE_MAX)
+    filters = {field: request.args[field] for field in PLAYER_FILTERS if request.args.get(field)}
+    
+    after = None
+    if request.args.get("cursor"):
+        try:
+            after = decode_cursor(request.args["cursor"])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    
+    # Built on the first listing request rather than at startup, from the listed fields only
+    phones, cursor, total = player_listing(game_state).page(sort, order == "desc", filters, after, limit)
+    players = game_state["players"]
+    page = []
+    for phone in phones:
+        player = players.peek(phone)
+        if player is None:
+            continue
+        summary = {field: player.get(field) for field in PLAYER_SUMMARY_FIELDS}
+        summary["phone"] = phone
+        page.append(summary)
+    
+    return jsonify({
+        "players": page,
+        "next_cursor": encode_cursor(cursor) if cursor else None,
+        "total": total
+    })
 
 @app.route("/api/player/<phone>", methods=["GET"])
 def get_player(phone):
@@ -140,6 +279,130 @@ def get_player(phone):
     
     return jsonify(player)
 
+@app.route("/api/player_lookup", methods=["GET"])
+def lookup_player():
+    """API endpoint to find a player by username, case-insensitively (admin only)."""
+    if not session.get("admin_logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    username = request.args.get("username", "").strip()
+    if not username:
+        return jsonify({"error": "Specify a username"}), 400
+    
+    phone = find_player_by_username(username, game_state)
+    player = game_state["players"].get(phone) if phone else None
+    if not player:
+        return jsonify({"error": "Player not found"}), 404
+    
+    return jsonify({"phone": phone, "player": player})
+
+@app.route("/api/battle_history", methods=["GET"])
+def get_battle_history():
+    """API endpoint to query archived battles by player and/or battle id (admin only)."""
+    if not session.get("admin_logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    player = request.args.get("player")
+    battle_id = request.args.get("battle_id")
+    if not player and not battle_id:
+        return jsonify({"error": "Specify a player or a battle_id"}), 400
+    
+    limit = request.args.get("limit", 50, type=int)
+    return jsonify(find_battles(player=player, battle_id=battle_id, limit=limit))
+
+@app.route("/api/cache_stats", methods=["GET"])
+def get_cache_stats():
+    """API endpoint to get the hit and miss counters of the player view cache (admin only)."""
+    if not session.get("admin_logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    return jsonify({"player_views": player_views.stats()})
+
+@app.route("/api/reload_catalog", methods=["POST"])
+def reload_game_catalog():
+    """API endpoint to reload shop, skill and quest content from game_data.py (admin only).
+    
+    Only this process picks up the change, other workers keep their catalog until restarted.
+    """
+    if not session.get("admin_logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    try:
+        catalog = reload_catalog()
+    except Exception as e:
+        logger.error(f"Error reloading game catalog: {e}")
+        return jsonify({"error": f"Failed to reload catalog: {e}"}), 500
+    
+    return jsonify({
+        "success": True,
+        "shop_items": len(catalog.shop_items),
+        "skills": len(catalog.skills),
+        "quests": len(catalog.quests)
+    })
+
+@app.route("/api/broadcast", methods=["POST"])
+def broadcast_message():
+    """API endpoint to send an announcement to the given players, or to all of them (admin only).
+    
+    With "queue": true the messages go through the outbound spool instead of being sent before replying.
+    """
+    if not session.get("admin_logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    data = request.json or {}
+    message = data.get("message", "").strip()
+    if not message:
+        return jsonify({"error": "Specify a message"}), 400
+    
+    phones = data.get("phones") or list(game_state["players"].keys())
+    if data.get("queue") and outbound_spool() is not None:
+        # Hand the announcement to the spool and answer at once
+        return jsonify({"queued": outbound_spool().enqueue_many(phones, message)})
+    
+    results = broadcast(phones, message)
+    
+    return jsonify({
+        "sent": sum(1 for result in results if result.sid),
+        "failed": sum(1 for result in results if result.error),
+        "results": [result._asdict() for result in results]
+    })
+
+@app.route("/api/outbound", methods=["GET"])
+def get_outbound_metrics():
+    """API endpoint to get the outbound spool depth, delivery latency and dead letters (admin only)."""
+    if not session.get("admin_logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    spool = outbound_spool()
+    if spool is None:
+        return jsonify({"error": "Outbound spool disabled"}), 404
+    
+    return jsonify({"metrics": spool.metrics(), "dead_letters": spool.dead_letters(limit=20)})
+
+@app.route("/api/notifications", methods=["GET"])
+def get_notification_metrics():
+    """API endpoint to get turn notification counters, including attack polls avoided (admin only)."""
+    if not session.get("admin_logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    notifier = turn_notifier()
+    if notifier is None:
+        return jsonify({"error": "Turn notifications disabled"}), 404
+    
+    return jsonify(notifier.metrics())
+
+@app.route("/api/outbound/requeue", methods=["POST"])
+def requeue_outbound():
+    """API endpoint to retry every dead-lettered message (admin only)."""
+    if not session.get("admin_logged_in"):
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    spool = outbound_spool()
+    if spool is None:
+        return jsonify({"error": "Outbound spool disabled"}), 404
+    
+    return jsonify({"requeued": spool.requeue_dead_letters()})
+
 @app.route("/api/create_deity", methods=["POST"])
 def create_deity():
     """API endpoint to create a deity (admin only)."""
@@ -153,19 +416,30 @@ def create_deity():
     if not deity_name or not phone or phone not in game_state["players"]:
         return jsonify({"error": "Invalid deity data"}), 400
     
-    player = game_state["players"][phone]
-    player["is_deity"] = True
-    
-    if "deities" not in game_state:
-        game_state["deities"] = {}
-    
-    game_state["deities"][phone] = {
-        "name": deity_name,
-        "player_phone": phone,
-        "chosen": []
-    }
+    # Same locking as game commands, so the player is not modified concurrently
+    with state_lock.shared(), player_locks.hold([phone]):
+        reset_tracking(game_state)
+        
+        player = game_state["players"][phone]
+        player["is_deity"] = True
+        
+        if "deities" not in game_state:
+            game_state["deities"] = {}
+            track_sections(game_state)
+        
+        game_state["deities"][phone] = {
+            "name": deity_name,
+            "player_phone": phone,
+            "chosen": []
+        }
+        
+        changes = collect_changes(game_state)
+        # Handed over under the player lock, so a concurrent command's older payload cannot be written last
+        staged = stage_changes(game_state, changes)
     
-    save_game_state(game_state)
+    # Admin changes wait for durability unless the caller opts out
+    if not complete_save(game_state, staged, sync=data.get("sync", True)):
+        return jsonify({"error": "Failed to save game state"}), 500
     
     return jsonify({"success": True})
 
@@ -0,0 +1,114 @@
+import os
+import zlib
+import queue
+import atexit
+import logging
+import threading
+from typing import Callable, Dict, List, Set
+
+from command_runner import run_game_command
+from twilio_integration import send_whatsapp_message, strip_whatsapp_prefix
+from idempotency import cached_reply
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Number of worker threads running queued commands
+ASYNC_WORKERS = int(os.environ.get("GAME_ASYNC_WORKERS", "4"))
+
+# Messages waiting per worker before the webhook starts refusing new ones
+ASYNC_QUEUE_SIZE = int(os.environ.get("GAME_ASYNC_QUEUE_SIZE", "1000"))
+
+ERROR_REPLY = "Sorry, an error occurred. Please try again later."
+
+# Queue item that tells a worker to exit
+_STOP = None
+
+
+class CommandQueue:
+    """Runs incoming commands on worker threads and replies through the outbound API
+
+    Every sender is hashed to one worker, so messages from the same player run
+    in the order they arrived while different players are served in parallel.
+    """
+
+    def __init__(self, game_state: Dict, send: Callable[[str, str], None] = send_whatsapp_message,
+                 workers: int = ASYNC_WORKERS, queue_size: int = ASYNC_QUEUE_SIZE):
+        self._game_state = game_state
+        self._send = send
+        # MessageSids queued or running, so a Twilio retry is not queued twice
+        self._pending_sids: Set[str] = set()
+        self._pending_lock = threading.Lock()
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._run, args=(q,), name=f"command-worker-{index}", daemon=True)
+            for index, q in enumerate(self._queues)
+        ]
+
+    def start(self) -> "CommandQueue":
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def submit(self, message_body: str, sender_phone: str, message_sid: str = None) -> bool:
+        """Queue a message for its sender's worker; False if that worker is saturated
+
+        Retries of a message that is queued or was already answered are dropped.
+        """
+        sender_phone = strip_whatsapp_prefix(sender_phone)
+        if message_sid:
+            with self._pending_lock:
+                if message_sid in self._pending_sids or cached_reply(message_sid) is not None:
+                    logger.info(f"Dropping duplicate message {message_sid}")
+                    return True
+                self._pending_sids.add(message_sid)
+
+        worker_queue = self._queues[zlib.crc32(sender_phone.encode("utf-8")) % len(self._queues)]
+        try:
+            worker_queue.put_nowait((message_body, sender_phone, message_sid))
+            return True
+        except queue.Full:
+            logger.warning(f"Command queue full, refusing message from {sender_phone}")
+            self._release(message_sid)
+            return False
+
+    def _release(self, message_sid: str) -> None:
+        if message_sid:
+            with self._pending_lock:
+                self._pending_sids.discard(message_sid)
+
+    def pending(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def stop(self, timeout: float = None) -> None:
+        """Run the messages already queued, then stop the workers"""
+        for worker_queue in self._queues:
+            worker_queue.put(_STOP)
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join(timeout)
+
+    def install_shutdown_hooks(self) -> None:
+        """Drain the queues on interpreter exit"""
+        atexit.register(self.stop)
+
+    def _run(self, worker_queue: queue.Queue) -> None:
+        while True:
+            item = worker_queue.get()
+            if item is _STOP:
+                return
+            message_body, sender_phone, message_sid = item
+            try:
+                reply = run_game_command(message_body, sender_phone, self._game_state, message_sid=message_sid)
+            except Exception as e:
+                logger.error(f"Error processing queued message from {sender_phone}: {e}")
+                reply = ERROR_REPLY
+            finally:
+                self._release(message_sid)
+            if reply is None:
+                # A retry of a message that was already answered
+                continue
+            try:
+                self._send(sender_phone, reply)
+            except Exception as e:
+                logger.error(f"Error replying to {sender_phone}: {e}")
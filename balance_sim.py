@@ -0,0 +1,216 @@
+"""
+Monte Carlo balance simulation for the RPG WhatsApp Bot
+Run with: python balance_sim.py <simulation> [options]   (requires NumPy)
+"""
+import sys
+import time
+import random
+import argparse
+from typing import Dict, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Optional dependency
+    np = None
+
+from game_logic import (RACES, CLASSES, ELEMENTS, ZONES, SKILLS, SKILL_KINDS, DEFAULT_SKILL_KIND,
+                        ATTACKER_FACTORS, MATCHUP_FACTORS, calculate_damage)
+
+# Skills a player can have: the starter and class skills plus the one sold as a skill book
+SIM_SKILLS = SKILLS + ["Fireball"]
+
+# Rounds after which process_attack ends a duel; the challenger attacks first
+DUEL_ROUNDS = 5
+
+
+def require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("The balance simulator requires NumPy (pip install numpy)")
+
+
+def _padded(factors: Tuple[float, ...], length: int = 2) -> List[float]:
+    # Multiplying by 1.0 is exact, so padding keeps results identical to the scalar loop
+    return list(factors) + [1.0] * (length - len(factors))
+
+
+def compile_arrays(strength: int, intelligence: int) -> Dict[str, "np.ndarray"]:
+    """Turn the compiled damage tables into arrays indexed by position in RACES, CLASSES, ..."""
+    require_numpy()
+    skill_kinds = [SKILL_KINDS.get(skill, DEFAULT_SKILL_KIND) for skill in SIM_SKILLS]
+    attributes = {"strength": strength, "intelligence": intelligence}
+    return {
+        # (race, class, skill, 2)
+        "attacker": np.array([[[_padded(ATTACKER_FACTORS[(race, char_class, kind[1])])
+                                for kind in skill_kinds]
+                               for char_class in CLASSES]
+                              for race in RACES]),
+        # (attacker element, defender element, zone, 2)
+        "matchup": np.array([[[_padded(MATCHUP_FACTORS[(attacker_element, defender_element, zone)])
+                               for zone in ZONES]
+                              for defender_element in ELEMENTS]
+                             for attacker_element in ELEMENTS]),
+        # (skill,)
+        "base": np.array([5 + attributes[kind[0]] * 2 for kind in skill_kinds])
+    }
+
+
+def vector_damage(arrays, race, char_class, attacker_element, defender_element, zone, skill, uniform):
+    """calculate_damage on index arrays; uniform holds the random() draws behind the variance"""
+    attacker = arrays["attacker"][race, char_class, skill]
+    matchup = arrays["matchup"][attacker_element, defender_element, zone]
+    damage = arrays["base"][skill] * attacker[..., 0] * attacker[..., 1] * matchup[..., 0] * matchup[..., 1]
+    # random.uniform(0.9, 1.1) computes 0.9 + (1.1 - 0.9) * random()
+    variance = 0.9 + (1.1 - 0.9) * uniform
+    # Both round half to even, like round()
+    return np.rint(damage * variance)
+
+
+def damage_distribution(samples: int, strength: int, intelligence: int, seed: int) -> Dict[str, "np.ndarray"]:
+    """Damage statistics for every race, class, attacker element, defender element, zone and skill
+
+    Every combination is evaluated on the same variance draws, so differences
+    between combinations are not blurred by sampling noise.
+    """
+    arrays = compile_arrays(strength, intelligence)
+    uniform = np.random.default_rng(seed).random(samples)
+    shape = (len(RACES), len(CLASSES), len(ELEMENTS), len(ELEMENTS), len(ZONES), len(SIM_SKILLS))
+    race, char_class, attacker_element, defender_element = np.indices(shape[:4]).reshape(4, -1)
+
+    stats = {name: np.empty(shape) for name in ("mean", "std", "p05", "p50", "p95")}
+    for zone in range(len(ZONES)):
+        for skill in range(len(SIM_SKILLS)):
+            damage = vector_damage(arrays, race[:, None], char_class[:, None], attacker_element[:, None],
+                                   defender_element[:, None], zone, skill, uniform[None, :])
+            stats["mean"][..., zone, skill] = damage.mean(axis=1).reshape(shape[:4])
+            stats["std"][..., zone, skill] = damage.std(axis=1).reshape(shape[:4])
+            percentiles = np.percentile(damage, [5, 50, 95], axis=1)
+            for name, values in zip(("p05", "p50", "p95"), percentiles):
+                stats[name][..., zone, skill] = values.reshape(shape[:4])
+    return stats
+
+
+def duel_win_rates(samples: int, strength: int, intelligence: int, seed: int) -> Dict[str, "np.ndarray"]:
+    """Win rates of every (race, class) challenger against every (race, class) defender
+
+    process_attack ends a duel after five rounds and always declares the player
+    who made the fifth attack (the challenger) the winner, so this reports who
+    dealt more total damage instead, with ties counted as half a win. Elements,
+    zone and the skill each player uses are drawn at random for every duel.
+    """
+    arrays = compile_arrays(strength, intelligence)
+    rng = np.random.default_rng(seed)
+    profiles = len(RACES) * len(CLASSES)
+    challenger_attacks = (DUEL_ROUNDS + 1) // 2
+    defender_attacks = DUEL_ROUNDS // 2
+
+    win_rate = np.empty((profiles, profiles))
+    challenger_damage = np.empty((profiles, profiles))
+    defender_damage = np.empty((profiles, profiles))
+    defender_race, defender_class = np.divmod(np.arange(profiles), len(CLASSES))
+    defender_race, defender_class = defender_race[:, None], defender_class[:, None]
+
+    for challenger in range(profiles):
+        race, char_class = divmod(challenger, len(CLASSES))
+        draw = (profiles, samples)
+        elements = rng.integers(len(ELEMENTS), size=(2,) + draw)
+        zone = rng.integers(len(ZONES), size=draw)
+        skills = rng.integers(len(SIM_SKILLS), size=(2,) + draw)
+
+        dealt = np.zeros(draw)
+        for _ in range(challenger_attacks):
+            dealt += vector_damage(arrays, race, char_class, elements[0], elements[1], zone, skills[0],
+                                   rng.random(draw))
+        taken = np.zeros(draw)
+        for _ in range(defender_attacks):
+            taken += vector_damage(arrays, defender_race, defender_class, elements[1], elements[0], zone,
+                                   skills[1], rng.random(draw))
+
+        win_rate[challenger] = ((dealt > taken) + 0.5 * (dealt == taken)).mean(axis=1)
+        challenger_damage[challenger] = dealt.mean(axis=1)
+        defender_damage[challenger] = taken.mean(axis=1)
+
+    return {"win_rate": win_rate, "challenger_damage": challenger_damage, "defender_damage": defender_damage}
+
+
+def verify(samples: int, strength: int, intelligence: int, seed: int) -> int:
+    """Compare vector_damage with calculate_damage on random attacks, result by result"""
+    arrays = compile_arrays(strength, intelligence)
+    rng = random.Random(seed)
+    picks = [[rng.randrange(len(values)) for values in (RACES, CLASSES, ELEMENTS, ELEMENTS, ZONES, SIM_SKILLS)]
+             for _ in range(samples)]
+
+    # calculate_damage draws one random() per call for its variance
+    random.seed(seed)
+    scalar = []
+    for race, char_class, attacker_element, defender_element, zone, skill in picks:
+        attacker = {"race": RACES[race], "class": CLASSES[char_class], "element": ELEMENTS[attacker_element],
+                    "attributes": {"strength": strength, "intelligence": intelligence}}
+        defender = {"element": ELEMENTS[defender_element]}
+        scalar.append(calculate_damage(attacker, defender, SIM_SKILLS[skill], ZONES[zone]))
+    variance_rng = random.Random(seed)
+    uniform = np.array([variance_rng.random() for _ in range(samples)])
+
+    vector = vector_damage(arrays, *np.array(picks).T, uniform)
+    mismatches = int((vector != np.array(scalar)).sum())
+    print(f"{samples} sampled attacks, {mismatches} mismatches against calculate_damage")
+    return 1 if mismatches else 0
+
+
+def print_damage_summary(stats: Dict[str, "np.ndarray"]) -> None:
+    mean_by_class = stats["mean"].mean(axis=(0, 2, 3, 4))
+    print(f"\nMEAN DAMAGE BY CLASS AND SKILL ({', '.join(SIM_SKILLS)}):")
+    for char_class, row in zip(CLASSES, mean_by_class):
+        print(f"- {char_class:<13} " + " ".join(f"{value:6.1f}" for value in row))
+
+
+def print_duel_summary(results: Dict[str, "np.ndarray"], top: int) -> None:
+    labels = [f"{race} {char_class}" for race in RACES for char_class in CLASSES]
+    # Average over both sides, so the challenger's extra attack cancels out
+    strength = (results["win_rate"].mean(axis=1) + (1 - results["win_rate"]).mean(axis=0)) / 2
+    order = np.argsort(strength)[::-1]
+    print(f"\nSTRONGEST (top {top}):")
+    for index in order[:top]:
+        print(f"- {labels[index]:<22} {strength[index]:.3f}")
+    print(f"\nWEAKEST (bottom {top}):")
+    for index in order[::-1][:top]:
+        print(f"- {labels[index]:<22} {strength[index]:.3f}")
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(description="Monte Carlo balance simulation (requires NumPy)")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--strength", type=int, default=5)
+    parser.add_argument("--intelligence", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the matrices to this .npz file")
+    subparsers = parser.add_subparsers(dest="simulation", required=True)
+    subparsers.add_parser("damage", help="damage distribution of every combination")
+    duels_parser = subparsers.add_parser("duels", help="win-rate matrix of every race/class pairing")
+    duels_parser.add_argument("--top", type=int, default=5)
+    subparsers.add_parser("verify", help="check the vectorized formula against calculate_damage")
+    args = parser.parse_args(argv)
+
+    require_numpy()
+    start = time.perf_counter()
+    if args.simulation == "verify":
+        return verify(args.samples, args.strength, args.intelligence, args.seed)
+
+    if args.simulation == "damage":
+        results = damage_distribution(args.samples, args.strength, args.intelligence, args.seed)
+        print_damage_summary(results)
+        axes = {"skills": SIM_SKILLS}
+    else:
+        results = duel_win_rates(args.samples, args.strength, args.intelligence, args.seed)
+        print_duel_summary(results, args.top)
+        axes = {"profiles": [f"{race}/{char_class}" for race in RACES for char_class in CLASSES]}
+    print(f"\nSimulated in {time.perf_counter() - start:.1f}s")
+
+    if args.output:
+        labels = {"races": RACES, "classes": CLASSES, "elements": ELEMENTS, "zones": ZONES, **axes}
+        np.savez_compressed(args.output, **results, **{name: np.array(values) for name, values in labels.items()})
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# SQLite archive of finished and abandoned battles, shared by every worker process
+BATTLE_ARCHIVE_DB = os.environ.get("GAME_BATTLE_ARCHIVE_DB", "battle_archive.db")
+
+# Append-only archive written by earlier versions, imported into the database on first use
+BATTLE_ARCHIVE_FILE = os.environ.get("GAME_BATTLE_ARCHIVE_FILE", "battle_archive.jsonl")
+
+# A battle id is reused when the same players duel again, its start time tells the battles apart
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS battles (
+        battle_id TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        ended_at REAL NOT NULL,
+        record TEXT NOT NULL,
+        PRIMARY KEY (battle_id, started_at)
+    );
+    CREATE TABLE IF NOT EXISTS battle_players (
+        phone TEXT NOT NULL,
+        battle_id TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        ended_at REAL NOT NULL,
+        PRIMARY KEY (phone, battle_id, started_at)
+    );
+    CREATE INDEX IF NOT EXISTS battle_players_by_time ON battle_players (phone, ended_at);
+    CREATE TABLE IF NOT EXISTS battle_log_lines (
+        battle_id TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        line_number INTEGER NOT NULL,
+        line TEXT NOT NULL,
+        PRIMARY KEY (battle_id, started_at, line_number)
+    );
+"""
+
+# Battles archived and log lines trimmed by the command running on this thread, written once it is persisted
+_pending = threading.local()
+
+
+class BattleArchive:
+    """Archived battles in SQLite, keyed by (battle_id, started_at) so a repeated write is a no-op"""
+
+    def __init__(self, path: str, legacy_path: Optional[str] = None):
+        self.path = path
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        if legacy_path and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection (sqlite3 connections are not shared between threads)"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def _import_legacy(self, legacy_path: str) -> None:
+        records = []
+        with open(legacy_path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Ignoring unreadable battle archive record in {legacy_path}")
+                    continue
+                record["started_at"] = record.get("started_at") or record["ended_at"]
+                records.append(record)
+        self.write(records)
+        try:
+            os.replace(legacy_path, legacy_path + ".imported")
+        except FileNotFoundError:
+            # Another worker imported it at the same time
+            pass
+        logger.info(f"Imported {len(records)} battles from {legacy_path}")
+
+    def write(self, records: List[Dict[str, Any]], lines: List[Tuple[str, float, int, str]] = ()) -> int:
+        """Store battles that are not archived yet, returning how many were new
+
+        lines are (battle_id, started_at, line_number, line) log lines trimmed from
+        running battles. A battle's record gets them back in front of its logs.
+        """
+        connection = self._connection()
+        written = 0
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR IGNORE INTO battle_log_lines (battle_id, started_at, line_number, line) VALUES (?, ?, ?, ?)",
+                lines
+            )
+            for record in records:
+                key = (record["battle_id"], record["started_at"])
+                if connection.execute("SELECT 1 FROM battles WHERE battle_id = ? AND started_at = ?", key).fetchone():
+                    continue
+                trimmed = [line for line, in connection.execute(
+                    "SELECT line FROM battle_log_lines WHERE battle_id = ? AND started_at = ? ORDER BY line_number", key
+                )]
+                if trimmed:
+                    record = dict(record, logs=trimmed + record["logs"])
+                    connection.execute("DELETE FROM battle_log_lines WHERE battle_id = ? AND started_at = ?", key)
+                connection.execute(
+                    "INSERT INTO battles (battle_id, started_at, ended_at, record) VALUES (?, ?, ?, ?)",
+                    key + (record["ended_at"], json.dumps(record, separators=(",", ":")))
+                )
+                connection.executemany(
+                    "INSERT OR IGNORE INTO battle_players (phone, battle_id, started_at, ended_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(phone,) + key + (record["ended_at"],) for phone in record.get("players", [])]
+                )
+                written += 1
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return written
+
+    def find(self, player: Optional[str] = None, battle_id: Optional[str] = None,
+             limit: int = 50) -> List[Dict[str, Any]]:
+        if player is not None:
+            query = ("SELECT battles.record FROM battle_players JOIN battles USING (battle_id, started_at) "
+                     "WHERE battle_players.phone = ?")
+            args = [player]
+            if battle_id is not None:
+                query += " AND battle_players.battle_id = ?"
+                args.append(battle_id)
+            query += " ORDER BY battle_players.ended_at DESC LIMIT ?"
+        elif battle_id is not None:
+            query = "SELECT record FROM battles WHERE battle_id = ? ORDER BY ended_at DESC LIMIT ?"
+            args = [battle_id]
+        else:
+            return []
+        rows = self._connection().execute(query, args + [limit]).fetchall()
+        return [json.loads(record) for record, in rows]
+
+
+# Open archives by absolute path
+_archives: Dict[str, BattleArchive] = {}
+_archives_lock = threading.Lock()
+
+
+def open_archive(path: str = None) -> BattleArchive:
+    """Return the archive stored at path, opening it (and importing a legacy archive) on first use"""
+    path = os.path.abspath(path or BATTLE_ARCHIVE_DB)
+    archive = _archives.get(path)
+    if archive is None:
+        with _archives_lock:
+            archive = _archives.get(path)
+            if archive is None:
+                legacy_path = os.path.join(os.path.dirname(path), os.path.basename(BATTLE_ARCHIVE_FILE))
+                archive = _archives[path] = BattleArchive(path, legacy_path)
+    return archive
+
+
+def archive_battle(battle_id: str, battle: Dict[str, Any], outcome: str, winner: Optional[str] = None) -> None:
+    """Queue a finished or abandoned battle; it is only archived if the command's changes are saved"""
+    records = getattr(_pending, "records", None)
+    if records is None:
+        records = _pending.records = []
+    records.append({
+        "battle_id": battle_id,
+        "players": battle.get("players", []),
+        "zone": battle.get("zone"),
+        "rounds": battle.get("rounds", 0),
+        "outcome": outcome,
+        "winner": winner,
+        "started_at": battle.get("started_at") or battle.get("updated_at") or 0,
+        "ended_at": time.time(),
+        "logs": battle.get("logs", [])
+    })
+
+
+def archive_log_lines(battle_id: str, battle: Dict[str, Any], first_number: int, lines: List[str]) -> None:
+    """Queue log lines trimmed from a running battle; they rejoin its logs when it is archived"""
+    pending = getattr(_pending, "lines", None)
+    if pending is None:
+        pending = _pending.lines = []
+    started_at = battle.get("started_at") or battle.get("updated_at") or 0
+    pending.extend((battle_id, started_at, first_number + offset, line) for offset, line in enumerate(lines))
+
+
+def discard_archived() -> None:
+    """Drop the battles and log lines queued by a command that failed or will be retried"""
+    _pending.records = []
+    _pending.lines = []
+
+
+def write_archived(path: str = None) -> int:
+    """Archive the battles and log lines queued by the command that just finished"""
+    records = getattr(_pending, "records", None) or []
+    lines = getattr(_pending, "lines", None) or []
+    _pending.records = []
+    _pending.lines = []
+    if not records and not lines:
+        return 0
+    try:
+        return open_archive(path).write(records, lines)
+    except Exception as e:
+        logger.error(f"Error archiving battles {[record['battle_id'] for record in records]}: {e}")
+        return 0
+
+
+def find_battles(player: Optional[str] = None, battle_id: Optional[str] = None, limit: int = 50,
+                 path: str = None) -> List[Dict[str, Any]]:
+    """Return archived battles of a player and/or with a battle id, newest first"""
+    return open_archive(path).find(player=player, battle_id=battle_id, limit=limit)
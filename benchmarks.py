@@ -0,0 +1,890 @@
+"""
+Local benchmarks for the RPG WhatsApp Bot
+Run with: python benchmarks.py <benchmark> [options]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import queue
+import multiprocessing
+import tempfile
+import threading
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from typing import Any, Dict
+
+from game_logic import RACES, CLASSES, ELEMENTS, SKILLS, ZONES, CLASS_ITEMS, initiate_duel, process_attack
+from game_logic import RACE_TRAITS, CLASS_BONUSES, ELEMENT_ADVANTAGES, ZONE_EFFECTS, calculate_damage
+from game_logic import RANKS, get_help_text, show_shop_items, show_rank_info, process_game_command
+from game_logic import _build_help_text, _build_shop_text, _build_rank_text
+from rendering import Template, player_views
+import twilio_integration
+from twilio.twiml.messaging_response import MessagingResponse
+from twiml import message_twiml
+from snapshot_codecs import CODECS
+from player_store import PlayerStore
+from state_tracking import track_sections, reset_tracking, collect_changes
+from command_runner import run_game_command
+import shared_store
+from indexes import username_index, battle_index, player_listing, filter_value, PLAYER_SORTS
+import utils
+
+def make_player(index: int, rng: random.Random) -> Dict[str, Any]:
+    """Create a synthetic player shaped like the ones register_player creates"""
+    char_class = rng.choice(CLASSES)
+    return {
+        "username": f"player{index}",
+        "race": rng.choice(RACES),
+        "class": char_class,
+        "element": rng.choice(ELEMENTS),
+        "level": rng.randint(1, 60),
+        "experience": rng.randint(0, 99),
+        "gold": rng.randint(0, 5000),
+        "karma": rng.randint(0, 100),
+        "rank": "G",
+        "attributes": {
+            "strength": rng.randint(0, 10),
+            "agility": rng.randint(0, 10),
+            "intelligence": rng.randint(0, 10),
+            "endurance": rng.randint(0, 10)
+        },
+        "skills": rng.sample(SKILLS, rng.randint(1, len(SKILLS))),
+        "inventory": list(CLASS_ITEMS[char_class]) + ["Health Potion"] * rng.randint(0, 3),
+        "equipped": {},
+        "is_deity": False,
+        "in_battle": False
+    }
+
+def make_game_state(player_count: int, seed: int = 42) -> Dict[str, Any]:
+    """Create a game state with player_count synthetic players"""
+    rng = random.Random(seed)
+    game_state = utils.new_game_state()
+    game_state["players"] = {f"+1555{index:07d}": make_player(index, rng) for index in range(player_count)}
+    return game_state
+
+def bench_snapshot_load(player_counts, repeats: int = 3) -> None:
+    """Compare snapshot size, write time and cold-start load time per codec"""
+    print(f"{'codec':<8} {'players':>8} {'size (KB)':>10} {'write (ms)':>11} {'load (ms)':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for player_count in player_counts:
+            game_state = make_game_state(player_count)
+            for name in CODECS:
+                path = os.path.join(directory, f"snapshot.{name}")
+
+                start = time.perf_counter()
+                utils.write_snapshot(game_state, path=path, codec=name)
+                write_ms = (time.perf_counter() - start) * 1000
+
+                load_ms = float("inf")
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    track_sections(utils.read_snapshot(path))
+                    load_ms = min(load_ms, (time.perf_counter() - start) * 1000)
+
+                size_kb = os.path.getsize(path) / 1024
+                print(f"{name:<8} {player_count:>8} {size_kb:>10.0f} {write_ms:>11.1f} {load_ms:>10.1f}")
+
+def bench_player_store_open(player_counts) -> None:
+    """Compare opening the indexed player store with loading a full JSON snapshot"""
+    print(f"{'players':>8} {'snapshot (ms)':>14} {'indexed open (ms)':>18} {'first access (ms)':>18} "
+          f"{'username index (ms)':>20} {'decoded':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for player_count in player_counts:
+            game_state = make_game_state(player_count)
+            snapshot_path = os.path.join(directory, f"snapshot-{player_count}.json")
+            utils.write_snapshot(game_state, path=snapshot_path, codec="json")
+            store_dir = os.path.join(directory, f"players-{player_count}")
+            PlayerStore.from_game_state(game_state["players"], directory=store_dir)
+
+            start = time.perf_counter()
+            utils.read_snapshot(snapshot_path)
+            snapshot_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            store = PlayerStore(directory=store_dir)
+            open_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            store[next(iter(game_state["players"]))]
+            access_ms = (time.perf_counter() - start) * 1000
+
+            # Startup builds the username index: it must not read the data file
+            decoded = 0
+            decode = store._decode
+
+            def counting_decode(phone):
+                nonlocal decoded
+                decoded += 1
+                return decode(phone)
+
+            store._decode = counting_decode
+            start = time.perf_counter()
+            username_index({"players": store})
+            index_ms = (time.perf_counter() - start) * 1000
+
+            print(f"{player_count:>8} {snapshot_ms:>14.1f} {open_ms:>18.1f} {access_ms:>18.3f} "
+                  f"{index_ms:>20.1f} {decoded:>8}")
+
+def lifetime_experience(player: Dict[str, Any]) -> int:
+    """Total XP a player has earned, including the XP spent on level ups"""
+    return sum(100 * level for level in range(1, player["level"])) + player["experience"]
+
+def stress_commands(player_count: int, threads: int, commands_per_thread: int, seed: int = 42) -> int:
+    """Fire concurrent commands at shared players and check that no gold or XP was lost"""
+    rng = random.Random(seed)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # Saves and the battle archive go to the temp directory
+        os.chdir(directory)
+        utils.GAME_STATE_FILE = os.path.join(directory, "game_state.json")
+        try:
+            game_state = track_sections(utils.new_game_state())
+            phones = [f"+1555{index:07d}" for index in range(player_count)]
+            for index, phone in enumerate(phones):
+                run_game_command(f"register player{index} human warrior fire", phone, game_state)
+
+            counters = {"quests": {}, "purchases": {}, "wins": {}}
+            counters_lock = threading.Lock()
+
+            def count(kind: str, phone: str) -> None:
+                with counters_lock:
+                    counters[kind][phone] = counters[kind].get(phone, 0) + 1
+
+            def worker(worker_rng: random.Random) -> None:
+                for _ in range(commands_per_thread):
+                    phone = worker_rng.choice(phones)
+                    roll = worker_rng.random()
+                    if roll < 0.4:
+                        if "completed" in run_game_command("quest 1", phone, game_state):
+                            count("quests", phone)
+                    elif roll < 0.6:
+                        if "You bought" in run_game_command("buy health potion", phone, game_state):
+                            count("purchases", phone)
+                    elif roll < 0.7:
+                        target = worker_rng.randrange(player_count)
+                        run_game_command(f"duel player{target}", phone, game_state)
+                    else:
+                        if "You won the duel" in run_game_command("attack", phone, game_state):
+                            count("wins", phone)
+
+            workers = [threading.Thread(target=worker, args=(random.Random(rng.random()),))
+                       for _ in range(threads)]
+            start = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            utils.save_game_state(game_state, sync=True)
+        finally:
+            os.chdir(cwd)
+
+    errors = 0
+    for phone in phones:
+        player = game_state["players"][phone]
+        quests = counters["quests"].get(phone, 0)
+        purchases = counters["purchases"].get(phone, 0)
+        wins = counters["wins"].get(phone, 0)
+        expected_gold = 100 + 50 * quests + 10 * wins - 50 * purchases
+        expected_experience = 100 * quests + 50 * wins
+        if player["gold"] != expected_gold or lifetime_experience(player) != expected_experience:
+            errors += 1
+            print(f"MISMATCH {phone}: gold {player['gold']} != {expected_gold} or "
+                  f"xp {lifetime_experience(player)} != {expected_experience}")
+        # Quest 1 rewards a Health Potion too
+        if player["inventory"].count("Health Potion") != purchases + quests:
+            errors += 1
+            print(f"MISMATCH {phone}: {player['inventory'].count('Health Potion')} potions != {purchases + quests}")
+
+    battling = {phone for battle in game_state["active_battles"].values() for phone in battle["players"]}
+    for phone in phones:
+        if game_state["players"][phone]["in_battle"] != (phone in battling):
+            errors += 1
+            print(f"MISMATCH {phone}: in_battle flag disagrees with the active battles")
+
+    total = threads * commands_per_thread
+    print(f"{total} commands from {threads} threads on {player_count} players in {elapsed:.2f}s "
+          f"({total / elapsed:.0f} commands/s), {errors} inconsistencies")
+    return 1 if errors else 0
+
+def shared_worker(db_path: str, directory: str, player_count: int, commands: int, seed: int,
+                  ready, start, results) -> None:
+    """Run quests on random players against the shared store (runs in its own process)"""
+    os.chdir(directory)
+    utils.PERSISTENCE_MODE = "shared"
+    shared_store.SHARED_STATE_DB = db_path
+    game_state = utils.load_game_state()
+    rng = random.Random(seed)
+    phones = [f"+1555{index:07d}" for index in range(player_count)]
+
+    ready.release()
+    start.wait()
+    began = time.perf_counter()
+    completed = 0
+    for _ in range(commands):
+        if "completed" in run_game_command("quest 1", rng.choice(phones), game_state):
+            completed += 1
+    results.put((completed, time.perf_counter() - began, utils._shared_store.conflicts))
+
+def bench_shared_workers(worker_counts, player_count: int, commands: int) -> int:
+    """Throughput of the shared SQLite store from 1 to N worker processes"""
+    context = multiprocessing.get_context("spawn")
+    errors = 0
+    print(f"{'workers':>8} {'commands/s':>11} {'conflicts':>10} {'gold check':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for worker_count in worker_counts:
+            db_path = os.path.join(directory, f"shared-{worker_count}.db")
+            store = shared_store.SharedStore(db_path)
+            game_state = utils.new_game_state()
+            game_state["players"] = {
+                f"+1555{index:07d}": dict(make_player(index, random.Random(index)), gold=100, level=1, experience=0)
+                for index in range(player_count)
+            }
+            store.seed(game_state)
+
+            ready, start, results = context.Semaphore(0), context.Event(), context.Queue()
+            workers = [
+                context.Process(target=shared_worker, args=(db_path, directory, player_count, commands,
+                                                            index, ready, start, results))
+                for index in range(worker_count)
+            ]
+            for worker in workers:
+                worker.start()
+            for _ in workers:
+                ready.acquire()
+            start.set()
+            outcomes = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+
+            completed = sum(outcome[0] for outcome in outcomes)
+            elapsed = max(outcome[1] for outcome in outcomes)
+            conflicts = sum(outcome[2] for outcome in outcomes)
+            gold = sum(player["gold"] for player in shared_store.SharedStore(db_path).load()["players"].values())
+            consistent = gold == 100 * player_count + 50 * completed
+            errors += not consistent
+            print(f"{worker_count:>8} {completed / elapsed:>11.0f} {conflicts:>10} "
+                  f"{'ok' if consistent else 'MISMATCH':>11}")
+    return 1 if errors else 0
+
+def bench_username_index(player_counts, duels: int = 200) -> None:
+    """Duel setup and registration checks with the username index versus a full scan"""
+    print(f"{'players':>8} {'index build (ms)':>17} {'duel setup (ms)':>16} {'lookup (us)':>12} {'scan (ms)':>10}")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        utils.GAME_STATE_FILE = os.path.join(directory, "game_state.json")
+        try:
+            for player_count in player_counts:
+                game_state = track_sections(make_game_state(player_count))
+                phones = list(game_state["players"])
+
+                start = time.perf_counter()
+                index = username_index(game_state)
+                build_ms = (time.perf_counter() - start) * 1000
+
+                # Disjoint pairs, so every duel is a fresh setup
+                pairs = [(phones[2 * i], phones[2 * i + 1]) for i in range(min(duels, player_count // 2))]
+                start = time.perf_counter()
+                for challenger, target in pairs:
+                    reset_tracking(game_state)
+                    initiate_duel(["duel", game_state["players"][target]["username"]],
+                                  game_state["players"][challenger], challenger, game_state)
+                    collect_changes(game_state)
+                duel_ms = (time.perf_counter() - start) * 1000 / len(pairs)
+
+                names = [f"PLAYER{i}" for i in range(0, player_count, max(1, player_count // 1000))]
+                start = time.perf_counter()
+                for name in names:
+                    index.lookup(name)
+                lookup_us = (time.perf_counter() - start) * 1e6 / len(names)
+
+                # What every registration and duel used to cost
+                start = time.perf_counter()
+                wanted = names[-1].lower()
+                next((phone for phone, p in game_state["players"].items() if p["username"].lower() == wanted), None)
+                scan_ms = (time.perf_counter() - start) * 1000
+
+                print(f"{player_count:>8} {build_ms:>17.1f} {duel_ms:>16.3f} {lookup_us:>12.2f} {scan_ms:>10.2f}")
+        finally:
+            os.chdir(cwd)
+
+def bench_battle_index(battle_counts, attacks: int = 500) -> None:
+    """Attack latency with the battle index versus the number of running duels"""
+    print(f"{'battles':>8} {'index build (ms)':>17} {'attack (ms)':>12}")
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            for battle_count in battle_counts:
+                game_state = track_sections(make_game_state(2 * battle_count))
+                phones = list(game_state["players"])
+                for i in range(battle_count):
+                    challenger, target = phones[2 * i], phones[2 * i + 1]
+                    initiate_duel(["duel", game_state["players"][target]["username"]],
+                                  game_state["players"][challenger], challenger, game_state)
+                collect_changes(game_state)
+
+                # Built at startup by the app
+                start = time.perf_counter()
+                battle_index(game_state)
+                build_ms = (time.perf_counter() - start) * 1000
+
+                # Attack back and forth in one duel; it stays below the 5 rounds that end it
+                start = time.perf_counter()
+                for i in range(attacks):
+                    phone = phones[i % 2]
+                    reset_tracking(game_state)
+                    battle = game_state["active_battles"][f"{phones[0]}_{phones[1]}"]
+                    battle["rounds"] = 0
+                    process_attack(["attack"], game_state["players"][phone], phone, game_state)
+                    collect_changes(game_state)
+                attack_ms = (time.perf_counter() - start) * 1000 / attacks
+                print(f"{battle_count:>8} {build_ms:>17.1f} {attack_ms:>12.3f}")
+        finally:
+            os.chdir(cwd)
+
+def reference_damage(attacker: Dict, defender: Dict, skill: str, zone: str) -> int:
+    """calculate_damage as it was before the rules were compiled into lookup tables"""
+    # Base damage based on strength or intelligence depending on skill
+    if skill in ["Punch", "Precision Shot"]:
+        base_damage = 5 + (attacker["attributes"]["strength"] * 2)
+    else:
+        base_damage = 5 + (attacker["attributes"]["intelligence"] * 2)
+    
+    # Apply racial bonuses
+    if attacker["race"] in RACE_TRAITS:
+        traits = RACE_TRAITS[attacker["race"]]
+        if "melee_damage" in traits and skill == "Punch":
+            base_damage *= (1 + traits["melee_damage"])
+    
+    # Apply class bonuses
+    if attacker["class"] in CLASS_BONUSES:
+        bonuses = CLASS_BONUSES[attacker["class"]]
+        if "melee_damage" in bonuses and skill == "Punch":
+            base_damage *= (1 + bonuses["melee_damage"])
+        elif "magic_power" in bonuses and skill in ["Mind Shuffle", "Magic Shield"]:
+            base_damage *= (1 + bonuses["magic_power"])
+    
+    # Apply element advantages
+    if attacker["element"] in ELEMENT_ADVANTAGES and defender["element"] == ELEMENT_ADVANTAGES[attacker["element"]]["advantage"]:
+        base_damage *= 1.1  # 10% more damage
+    
+    # Apply zone effects
+    if zone in ZONE_EFFECTS and attacker["element"] in ZONE_EFFECTS[zone]:
+        element_effects = ZONE_EFFECTS[zone][attacker["element"]]
+        if "damage" in element_effects:
+            base_damage *= (1 + element_effects["damage"])
+    
+    # Random variance (±10%)
+    variance = random.uniform(0.9, 1.1)
+    
+    return round(base_damage * variance)
+
+def bench_damage(attacks: int = 200000, repeats: int = 5, seed: int = 42) -> int:
+    """Compare the compiled calculate_damage with the rule-walking version, result by result"""
+    rng = random.Random(seed)
+    players = [make_player(index, rng) for index in range(500)]
+    skills = SKILLS + ["Fireball"]
+    cases = [(rng.choice(players), rng.choice(players), rng.choice(skills), rng.choice(ZONES)) for _ in range(attacks)]
+
+    timings = {"reference": float("inf"), "compiled": float("inf")}
+    results = {}
+    for _ in range(repeats):
+        for name, function in (("reference", reference_damage), ("compiled", calculate_damage)):
+            random.seed(seed)
+            start = time.perf_counter()
+            results[name] = [function(attacker, defender, skill, zone) for attacker, defender, skill, zone in cases]
+            timings[name] = min(timings[name], (time.perf_counter() - start) * 1e6 / attacks)
+
+    mismatches = sum(a != b for a, b in zip(results["reference"], results["compiled"]))
+    print(f"reference {timings['reference']:.2f} us/attack, compiled {timings['compiled']:.2f} us/attack "
+          f"({timings['reference'] / timings['compiled']:.1f}x), {mismatches} mismatches in {attacks} attacks")
+    return 1 if mismatches else 0
+
+def bench_rendering(calls: int = 100000, repeats: int = 5, seed: int = 42) -> None:
+    """Cached help, shop and rank responses versus rendering them on every call"""
+    rng = random.Random(seed)
+    players = [make_player(index, rng) for index in range(500)]
+    for player in players:
+        player["rank"] = rng.choice(RANKS)
+    sample = [rng.choice(players) for _ in range(calls)]
+    lookup = {player["rank"]: player["level"] for player in players}
+
+    commands = {
+        "help": (lambda player: get_help_text(),
+                 lambda player: Template.compile(_build_help_text()).render()),
+        "shop": (show_shop_items,
+                 lambda player: Template.compile(_build_shop_text()).render(player["gold"])),
+        "rank": (show_rank_info,
+                 lambda player: Template.compile(_build_rank_text(player["rank"])).render(player["level"]))
+    }
+    baseline = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for player in sample:
+            lookup.get(player["rank"])
+        baseline = min(baseline, (time.perf_counter() - start) * 1e6 / calls)
+    print(f"dict lookup baseline: {baseline:.3f} us/call")
+
+    for name, (cached, uncached) in commands.items():
+        timings = {"uncached": float("inf"), "cached": float("inf")}
+        for _ in range(repeats):
+            for label, function in (("uncached", uncached), ("cached", cached)):
+                start = time.perf_counter()
+                for player in sample:
+                    function(player)
+                timings[label] = min(timings[label], (time.perf_counter() - start) * 1e6 / calls)
+        print(f"{name:<5} uncached {timings['uncached']:.3f} us/call, cached {timings['cached']:.3f} us/call "
+              f"({timings['uncached'] / timings['cached']:.1f}x)")
+
+def bench_player_views(player_count: int = 1000, commands: int = 100000, write_ratio: float = 0.05,
+                       seed: int = 42) -> None:
+    """Read-only status/inventory/skills latency and view cache hit rate with some purchases mixed in"""
+    rng = random.Random(seed)
+    game_state = track_sections(make_game_state(player_count, seed))
+    for player in game_state["players"].values():
+        player["gold"] = 10 ** 9
+    phones = list(game_state["players"])
+    workload = [(rng.choice(["status", "inventory", "skills"]) if rng.random() >= write_ratio else "buy mana potion",
+                 rng.choice(phones)) for _ in range(commands)]
+
+    player_views.clear()
+    hits, misses = player_views.hits, player_views.misses
+    reads = 0
+    read_time = 0.0
+    for command, phone in workload:
+        if command.startswith("buy"):
+            # Purchases change the player without being saved, collecting the changes bumps its version
+            reset_tracking(game_state)
+            process_game_command(command, phone, game_state)
+            collect_changes(game_state)
+            continue
+        start = time.perf_counter()
+        run_game_command(command, phone, game_state)
+        reads += 1
+        read_time += time.perf_counter() - start
+    hits, misses = player_views.hits - hits, player_views.misses - misses
+    print(f"{player_count} players, {write_ratio:.0%} purchases: {read_time * 1e6 / reads:.2f} us per view, "
+          f"hit rate {hits / max(hits + misses, 1):.1%} ({hits} hits, {misses} misses)")
+
+class TwilioStandIn(ThreadingHTTPServer):
+    """Local HTTP server answering the Messages API like Twilio, after a fixed latency"""
+    daemon_threads = True
+
+    def __init__(self, latency: float, failure_rate: float = 0.0):
+        self.latency = latency
+        # Share of requests answered with 503; recipients starting with +1999 always get a 400
+        self.failure_rate = failure_rate
+        self.failures = 0
+        self.connections = 0
+        self.messages = 0
+        # Accepted message bodies per recipient, in the order they arrived
+        self.received: Dict[str, list] = {}
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), TwilioStandInHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+class TwilioStandInHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so pooled connections are reused
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self) -> None:
+        form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+        time.sleep(self.server.latency)
+        to = form.get("To", [""])[0]
+        if to.startswith("whatsapp:+1999") or random.random() < self.server.failure_rate:
+            with self.server.lock:
+                self.server.failures += 1
+            status = 400 if to.startswith("whatsapp:+1999") else 503
+            self.send_error_json(status, {"code": 21211 if status == 400 else 20503, "message": "Stand-in failure",
+                                          "status": status})
+            return
+        with self.server.lock:
+            self.server.messages += 1
+            self.server.received.setdefault(to, []).append(form.get("Body", [""])[0])
+            sid = f"SM{self.server.messages:032x}"
+        body = json.dumps({"sid": sid, "status": "queued", "to": form.get("To", [""])[0],
+                           "from": form.get("From", [""])[0], "body": form.get("Body", [""])[0]}).encode("utf-8")
+        self.send_response(201)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+def configure_stand_in(server: TwilioStandIn) -> None:
+    """Point twilio_integration at the stand-in, without a rate limit"""
+    twilio_integration.TWILIO_ACCOUNT_SID = "AC" + "0" * 32
+    twilio_integration.TWILIO_AUTH_TOKEN = "token"
+    twilio_integration.TWILIO_PHONE_NUMBER = "+15550000000"
+    twilio_integration.TWILIO_API_BASE_URL = server.url
+    twilio_integration.TWILIO_SEND_RATE = twilio_integration.TWILIO_SEND_BURST = 10 ** 6
+    twilio_integration._client = None
+
+def bench_broadcast(recipients: int = 1000, latency: float = 0.05, baseline: int = 50) -> int:
+    """Broadcast through the pooled client against a local Twilio stand-in, versus a client per message"""
+    server = TwilioStandIn(latency)
+    configure_stand_in(server)
+    phones = [f"+1555{index:07d}" for index in range(recipients)]
+    try:
+        # What send_whatsapp_message used to do: a new client, session and connection per message
+        start = time.perf_counter()
+        for phone in phones[:baseline]:
+            client = twilio_integration.Client("AC" + "0" * 32, "token",
+                                               http_client=twilio_integration.PooledHttpClient(server.url))
+            client.messages.create(body="Server announcement", from_="whatsapp:+15550000000", to=f"whatsapp:{phone}")
+        per_message = (time.perf_counter() - start) / baseline
+        print(f"client per message: {1 / per_message:.0f} messages/s, "
+              f"{recipients * per_message:.1f}s projected for {recipients} players")
+
+        connections = server.connections
+        start = time.perf_counter()
+        results = twilio_integration.broadcast(phones, "Server announcement")
+        elapsed = time.perf_counter() - start
+        failed = sum(1 for result in results if result.error)
+        print(f"broadcast ({twilio_integration.BROADCAST_WORKERS} workers): {recipients} players in {elapsed:.2f}s "
+              f"({recipients / elapsed:.0f} messages/s), {server.connections - connections} connections opened, "
+              f"{failed} failed")
+        return 1 if failed else 0
+    finally:
+        server.shutdown()
+
+def bench_outbound_spool(messages: int = 2000, latency: float = 0.05, failure_rate: float = 0.2,
+                         invalid: int = 10, per_phone: int = 5) -> int:
+    """Spool messages against a flaky Twilio stand-in: enqueue cost, drain time, retries and dead letters
+
+    Every valid recipient gets per_phone numbered messages, which must arrive in order despite the retries.
+    """
+    import outbound_spool
+    server = TwilioStandIn(latency, failure_rate)
+    configure_stand_in(server)
+    # Retry quickly so the benchmark does not wait minutes for backoff
+    outbound_spool.OUTBOUND_BACKOFF_BASE = 0.05
+    outbound_spool.OUTBOUND_BACKOFF_MAX = 0.5
+    recipients = max(1, (messages - invalid) // per_phone)
+    phones = [f"+1999{index:07d}" if index < invalid else f"+1555{index % recipients:07d}" for index in range(messages)]
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            spool = twilio_integration.start_outbound_spool(os.path.join(directory, "outbound_spool.db"))
+            start = time.perf_counter()
+            for number, phone in enumerate(phones):
+                twilio_integration.send_whatsapp_message(phone, f"Message {number}")
+            enqueue = (time.perf_counter() - start) * 1e6 / messages
+
+            while True:
+                metrics = spool.metrics()
+                if metrics["depth"] == 0:
+                    break
+                time.sleep(0.05)
+            elapsed = time.perf_counter() - start
+            spool.stop()
+            twilio_integration._spool = None
+
+        print(f"enqueue {enqueue:.0f} us/message; {messages} messages drained in {elapsed:.2f}s "
+              f"({messages / elapsed:.0f} messages/s) with {server.failures} failed API calls")
+        print(f"delivered {metrics['delivered']}, retried {metrics['retried']}, dead letters {metrics['dead_letters']}, "
+              f"latency p50 {metrics['latency_p50']:.2f}s p95 {metrics['latency_p95']:.2f}s "
+              f"max {metrics['latency_max']:.2f}s")
+        lost = messages - metrics["delivered"] - metrics["dead_letters"]
+        reordered = sum(1 for bodies in server.received.values()
+                        if bodies != sorted(bodies, key=lambda body: int(body.split()[1])))
+        print(f"{len(server.received)} recipients, {reordered} received their messages out of order")
+        if lost or reordered or metrics["dead_letters"] != invalid or server.messages != metrics["delivered"]:
+            print(f"MISMATCH: {lost} messages lost, {metrics['dead_letters']} dead letters for {invalid} invalid "
+                  f"numbers, {server.messages} accepted by the API for {metrics['delivered']} delivered")
+            return 1
+        return 0
+    finally:
+        server.shutdown()
+
+def bench_turn_notifications(duels: int = 200, send_latency: float = 0.05) -> int:
+    """Duels where players only attack when told it is their turn, with a slow sender
+
+    Reports attack latency (which must not include the send), the notifications
+    sent and the polls they saved: without them every turn costs at least one
+    extra 'attack' that answers "It's not your turn".
+    """
+    import game_events
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        utils.GAME_STATE_FILE = os.path.join(directory, "game_state.json")
+        inbox = queue.Queue()
+
+        def send(phone: str, message: str) -> None:
+            time.sleep(send_latency)
+            inbox.put((phone, message))
+
+        notifier = game_events.start_turn_notifier(send)
+        try:
+            game_state = track_sections(utils.new_game_state())
+            for index in range(duels * 2):
+                run_game_command(f"register player{index} human warrior fire", f"+1555{index:07d}", game_state)
+
+            attack_time = 0.0
+            attacks = 0
+            for index in range(0, duels * 2, 2):
+                run_game_command(f"duel player{index + 1}", f"+1555{index:07d}", game_state)
+            # Challengers move first, everyone else waits for a turn notification
+            ready = [f"+1555{index:07d}" for index in range(0, duels * 2, 2)]
+            finished = 0
+            while finished < duels:
+                for phone in ready:
+                    start = time.perf_counter()
+                    reply = run_game_command("attack", phone, game_state)
+                    attack_time += time.perf_counter() - start
+                    attacks += 1
+                    if "won the duel" in reply:
+                        finished += 1
+                ready = []
+                while finished < duels and not ready:
+                    phone, message = inbox.get()
+                    if "It's your turn" in message:
+                        ready.append(phone)
+                    while not inbox.empty():
+                        phone, message = inbox.get()
+                        if "It's your turn" in message:
+                            ready.append(phone)
+            notifier.stop()
+            metrics = notifier.metrics()
+        finally:
+            game_events._notifier = None
+            os.chdir(cwd)
+
+    print(f"{duels} duels, {attacks} attacks at {attack_time * 1e3 / attacks:.2f} ms each "
+          f"(sender takes {send_latency * 1e3:.0f} ms per message)")
+    print(f"{metrics['sent']} notifications sent, {metrics['polls_avoided']} polls avoided, "
+          f"{metrics['wasted_polls']} wasted polls")
+    return 0 if metrics["wasted_polls"] == 0 and metrics["polls_avoided"] == attacks - duels else 1
+
+def library_twiml(body: str) -> str:
+    response = MessagingResponse()
+    response.message(body)
+    return str(response)
+
+def bench_twiml(samples: int = 20000, repeats: int = 5, seed: int = 42) -> int:
+    """Check the TwiML fast path byte for byte against MessagingResponse, then time both"""
+    rng = random.Random(seed)
+    alphabet = "ab &<>\"'\n\r\t]]>;#éü🎮⚔️\x00\x1f" + "".join(chr(rng.randrange(0x20, 0x3000)) for _ in range(50))
+    corpus = ["", " ", "&", "<Message>", "]]>", "&amp;", get_help_text(), show_shop_items({"gold": 100})]
+    corpus += [show_rank_info({"rank": rank, "level": 10}) for rank in RANKS]
+    corpus += ["".join(rng.choice(alphabet) for _ in range(rng.randrange(1, 300))) for _ in range(samples)]
+
+    mismatches = [body for body in corpus if message_twiml(body) != library_twiml(body)]
+    for body in mismatches[:5]:
+        print(f"MISMATCH for {body!r}:\n  {message_twiml(body)!r}\n  {library_twiml(body)!r}")
+
+    # Typical replies: the game's own responses
+    replies = corpus[:8 + len(RANKS)] * 200
+    timings = {"MessagingResponse": float("inf"), "fast path": float("inf")}
+    for _ in range(repeats):
+        for name, function in (("MessagingResponse", library_twiml), ("fast path", message_twiml)):
+            start = time.perf_counter()
+            for body in replies:
+                function(body)
+            timings[name] = min(timings[name], (time.perf_counter() - start) * 1e6 / len(replies))
+    print(f"{len(corpus)} bodies compared, {len(mismatches)} mismatches")
+    print(f"MessagingResponse {timings['MessagingResponse']:.2f} us/reply, fast path {timings['fast path']:.2f} us/reply "
+          f"({timings['MessagingResponse'] / timings['fast path']:.0f}x)")
+    return 1 if mismatches else 0
+
+def brute_force_listing(players, sort: str, descending: bool, filters: Dict[str, str]):
+    """Sort and filter every player, the way a listing without the index would"""
+    matching = [(PLAYER_SORTS[sort](player), phone) for phone, player in players.items()
+                if all(filter_value(player.get(field)) == filter_value(value) for field, value in filters.items())]
+    matching.sort(reverse=descending)
+    return [phone for _, phone in matching]
+
+def bench_player_listing(player_counts, queries: int = 200, page_size: int = 50, seed: int = 42) -> int:
+    """Player listing pages against a brute-force sort, checked for equal results after updates"""
+    print(f"{'players':>8} {'build (ms)':>11} {'page (us)':>10} {'deep page (us)':>15} {'update (us)':>12} "
+          f"{'brute force (ms)':>17} {'mismatches':>11}")
+    failures = 0
+    for player_count in player_counts:
+        rng = random.Random(seed)
+        game_state = track_sections(make_game_state(player_count, seed))
+        players = game_state["players"]
+        ranks = list(RANKS)
+        for player in players.values():
+            player["rank"] = rng.choice(ranks)
+            player["in_battle"] = rng.random() < 0.05
+            player["is_deity"] = rng.random() < 0.01
+            player["created_at"] = rng.choice([0, rng.uniform(1.6e9, 1.7e9)])
+
+        start = time.perf_counter()
+        index = player_listing(game_state)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        def random_query():
+            filters = {}
+            for field, values in (("race", RACES), ("class", CLASSES), ("element", ELEMENTS), ("rank", ranks),
+                                  ("in_battle", ["true", "false"]), ("is_deity", ["true", "false"])):
+                if rng.random() < 0.25:
+                    filters[field] = rng.choice(values).upper()
+            return rng.choice(list(PLAYER_SORTS)), rng.random() < 0.5, filters
+
+        # Mutations go through the section, like commands, so the index follows them
+        start = time.perf_counter()
+        phones = list(players)
+        for phone in rng.sample(phones, min(1000, player_count)):
+            reset_tracking(game_state)
+            player = players[phone]
+            player["gold"] = rng.randint(0, 5000)
+            if rng.random() < 0.2:
+                player["level"] += 1
+                player["rank"] = rng.choice(ranks)
+            collect_changes(game_state)
+        update_us = (time.perf_counter() - start) * 1e6 / min(1000, player_count)
+
+        mismatches = 0
+        for _ in range(queries // 10):
+            sort, descending, filters = random_query()
+            expected = brute_force_listing(players, sort, descending, filters)
+            listed, cursor = [], None
+            while True:
+                page, cursor, _ = index.page(sort, descending, filters, cursor, page_size)
+                listed.extend(page)
+                if cursor is None or len(listed) > 5 * page_size:
+                    break
+            mismatches += listed != expected[:len(listed)] or (cursor is None and listed != expected)
+
+        page_times, deep_times = [], []
+        for _ in range(queries):
+            sort, descending, filters = random_query()
+            start = time.perf_counter()
+            page, cursor, _ = index.page(sort, descending, filters, None, page_size)
+            page_times.append(time.perf_counter() - start)
+            if cursor is not None:
+                # Resume from the middle of the order, as a deep page would
+                entries = index._orders_of(None)[sort]
+                middle = entries[len(entries) // 2]
+                start = time.perf_counter()
+                index.page(sort, descending, filters, middle, page_size)
+                deep_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(5):
+            sort, descending, filters = random_query()
+            brute_force_listing(players, sort, descending, filters)[:page_size]
+        brute_ms = (time.perf_counter() - start) * 1000 / 5
+
+        page_times.sort()
+        deep_times.sort()
+        print(f"{player_count:>8} {build_ms:>11.1f} {page_times[len(page_times) // 2] * 1e6:>10.1f} "
+              f"{(deep_times[len(deep_times) // 2] * 1e6 if deep_times else 0):>15.1f} {update_us:>12.1f} "
+              f"{brute_ms:>17.2f} {mismatches:>11}")
+        failures += mismatches
+    return 1 if failures else 0
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(description="Local benchmarks for the RPG WhatsApp Bot")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    snapshot = subparsers.add_parser("snapshot", help="Cold-start load time versus player count per codec")
+    snapshot.add_argument("counts", nargs="*", type=int, default=[1000, 10000, 100000])
+
+    player_store = subparsers.add_parser("player-store", help="Indexed player store open time versus a full load")
+    player_store.add_argument("counts", nargs="*", type=int, default=[1000, 10000, 100000])
+
+    stress = subparsers.add_parser("stress", help="Concurrent commands on shared players, checking for lost updates")
+    stress.add_argument("--players", type=int, default=20)
+    stress.add_argument("--threads", type=int, default=16)
+    stress.add_argument("--commands", type=int, default=500, help="commands per thread")
+
+    shared = subparsers.add_parser("shared", help="Shared SQLite store throughput from 1 to N worker processes")
+    shared.add_argument("workers", nargs="*", type=int, default=sorted({1, 2, 4, os.cpu_count() or 4}))
+    shared.add_argument("--players", type=int, default=1000)
+    shared.add_argument("--commands", type=int, default=2000, help="commands per worker")
+
+    usernames = subparsers.add_parser("usernames", help="Duel setup cost with the username index versus player count")
+    usernames.add_argument("counts", nargs="*", type=int, default=[1000, 10000, 100000])
+
+    battles = subparsers.add_parser("battles", help="Attack latency versus the number of running duels")
+    battles.add_argument("counts", nargs="*", type=int, default=[10, 1000, 50000])
+
+    damage = subparsers.add_parser("damage", help="Compiled damage table versus walking the rules")
+    damage.add_argument("--attacks", type=int, default=200000)
+
+    rendering = subparsers.add_parser("rendering", help="Cached help, shop and rank responses versus re-rendering")
+    rendering.add_argument("--calls", type=int, default=100000)
+
+    views = subparsers.add_parser("views", help="Memoized status/inventory/skills views under a read-mostly load")
+    views.add_argument("--players", type=int, default=1000)
+    views.add_argument("--commands", type=int, default=100000)
+    views.add_argument("--write-ratio", type=float, default=0.05)
+
+    broadcast = subparsers.add_parser("broadcast", help="Pooled broadcast versus a Twilio client per message")
+    broadcast.add_argument("--recipients", type=int, default=1000)
+    broadcast.add_argument("--latency", type=float, default=0.05, help="stand-in API latency in seconds")
+
+    spool = subparsers.add_parser("spool", help="Outbound spool against a Twilio stand-in that fails some requests")
+    spool.add_argument("--messages", type=int, default=2000)
+    spool.add_argument("--latency", type=float, default=0.05, help="stand-in API latency in seconds")
+    spool.add_argument("--failure-rate", type=float, default=0.2)
+
+    turns = subparsers.add_parser("turns", help="Duels driven by turn notifications instead of polling")
+    turns.add_argument("--duels", type=int, default=200)
+
+    twiml = subparsers.add_parser("twiml", help="TwiML fast path versus MessagingResponse, checked byte for byte")
+    twiml.add_argument("--samples", type=int, default=20000)
+
+    players = subparsers.add_parser("players", help="Paginated player listing versus sorting every player")
+    players.add_argument("counts", nargs="*", type=int, default=[1000, 10000, 100000])
+    players.add_argument("--queries", type=int, default=200)
+
+    args = parser.parse_args(argv)
+    if args.benchmark == "snapshot":
+        bench_snapshot_load(args.counts)
+    elif args.benchmark == "player-store":
+        bench_player_store_open(args.counts)
+    elif args.benchmark == "stress":
+        return stress_commands(args.players, args.threads, args.commands)
+    elif args.benchmark == "usernames":
+        bench_username_index(args.counts)
+    elif args.benchmark == "battles":
+        bench_battle_index(args.counts)
+    elif args.benchmark == "damage":
+        return bench_damage(args.attacks)
+    elif args.benchmark == "rendering":
+        bench_rendering(args.calls)
+    elif args.benchmark == "views":
+        bench_player_views(args.players, args.commands, args.write_ratio)
+    elif args.benchmark == "broadcast":
+        return bench_broadcast(args.recipients, args.latency)
+    elif args.benchmark == "spool":
+        return bench_outbound_spool(args.messages, args.latency, args.failure_rate)
+    elif args.benchmark == "turns":
+        return bench_turn_notifications(args.duels)
+    elif args.benchmark == "twiml":
+        return bench_twiml(args.samples)
+    elif args.benchmark == "players":
+        return bench_player_listing(args.counts, args.queries)
+    elif args.benchmark == "shared":
+        return bench_shared_workers(args.workers, args.players, args.commands)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
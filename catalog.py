@@ -0,0 +1,148 @@
+import importlib
+import logging
+import threading
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Tuple
+
+import game_data
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+
+class ShopItem(NamedTuple):
+    name: str
+    cost: int
+    description: str
+    type: str
+    # Skill learned by reading the item, for skill books
+    teaches: Optional[str]
+
+
+class Skill(NamedTuple):
+    name: str
+    description: str
+    attribute: str
+    cooldown: int
+
+
+class Quest(NamedTuple):
+    id: int
+    name: str
+    description: str
+    level_req: int
+    zone: str
+    exp: int
+    gold: int
+    karma: int
+    items: Tuple[str, ...]
+
+
+class Catalog(NamedTuple):
+    """Immutable view of the shop, skill and quest content of game_data
+
+    Lookups by name are case-insensitive, the listings shown to players are
+    rendered once when the catalog is built.
+    """
+    shop_items: Tuple[ShopItem, ...]
+    skills: Tuple[Skill, ...]
+    quests: Tuple[Quest, ...]
+    # Case-folded name -> item / skill, quest id -> quest
+    shop_index: Mapping[str, ShopItem]
+    skill_index: Mapping[str, Skill]
+    quest_index: Mapping[int, Quest]
+    shop_listing: str
+    quest_listing: str
+    # Incremented by every reload, so caches of rendered content can tell it changed
+    version: int
+
+    def shop_item(self, name: str) -> Optional[ShopItem]:
+        return self.shop_index.get(name.casefold())
+
+    def skill(self, name: str) -> Optional[Skill]:
+        return self.skill_index.get(name.casefold())
+
+    def quest(self, quest_id: int) -> Optional[Quest]:
+        return self.quest_index.get(quest_id)
+
+
+def build_catalog(data=game_data, version: int = 1) -> Catalog:
+    """Compile the content of a game_data module into a Catalog"""
+    shop_items = tuple(
+        ShopItem(name, item["cost"], item["description"], item["type"], item.get("teaches"))
+        for name, item in data.SHOP_ITEMS.items()
+    )
+    skills = tuple(
+        Skill(name, skill["description"], skill["attribute"], skill.get("cooldown", 0))
+        for name, skill in data.SKILLS.items()
+    )
+    quests = tuple(
+        Quest(quest["id"], quest["name"], quest["description"], quest.get("level_req", 1), quest.get("zone"),
+              quest["rewards"].get("exp", 0), quest["rewards"].get("gold", 0), quest["rewards"].get("karma", 0),
+              tuple(quest["rewards"].get("items", ())))
+        for quest in data.QUESTS
+    )
+
+    shop_listing = "🛒 SHOP ITEMS 🛒\n\n"
+    for item in shop_items:
+        shop_listing += f"- {item.name} ({item.cost} gold): {item.description}\n"
+
+    quest_listing = "📜 AVAILABLE QUESTS 📜\n\n"
+    for quest in quests:
+        quest_listing += (
+            f"#{quest.id}: {quest.name}\n"
+            f"- {quest.description}\n"
+            f"- Level required: {quest.level_req}\n"
+            f"- Rewards: {format_rewards(quest)}\n\n"
+        )
+    quest_listing += "To start a quest, type 'quest [id]'"
+
+    return Catalog(
+        shop_items=shop_items,
+        skills=skills,
+        quests=quests,
+        shop_index=MappingProxyType({item.name.casefold(): item for item in shop_items}),
+        skill_index=MappingProxyType({skill.name.casefold(): skill for skill in skills}),
+        quest_index=MappingProxyType({quest.id: quest for quest in quests}),
+        shop_listing=shop_listing,
+        quest_listing=quest_listing,
+        version=version
+    )
+
+
+def format_rewards(quest: Quest) -> str:
+    """Describe the rewards of a quest, e.g. '100 XP, 50 gold, Health Potion'"""
+    rewards = [f"{quest.exp} XP", f"{quest.gold} gold"]
+    if quest.karma:
+        rewards.append(f"{quest.karma} karma")
+    rewards.extend(quest.items)
+    return ", ".join(rewards)
+
+
+_reload_lock = threading.Lock()
+_catalog = build_catalog()
+logger.info(f"Game catalog loaded: {len(_catalog.shop_items)} shop items, "
+            f"{len(_catalog.skills)} skills, {len(_catalog.quests)} quests")
+
+
+def get_catalog() -> Catalog:
+    """Return the current catalog
+
+    Commands should fetch it once and use that object throughout, so a reload
+    never mixes old and new content within one command.
+    """
+    return _catalog
+
+
+def reload_catalog() -> Catalog:
+    """Re-read game_data.py and swap in the new catalog
+
+    The old catalog stays in place if the module fails to load or compile.
+    """
+    global _catalog
+    with _reload_lock:
+        catalog = build_catalog(importlib.reload(game_data), _catalog.version + 1)
+        _catalog = catalog
+    logger.info(f"Game catalog reloaded: {len(catalog.shop_items)} shop items, "
+                f"{len(catalog.skills)} skills, {len(catalog.quests)} quests")
+    return catalog
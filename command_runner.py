@@ -0,0 +1,153 @@
+import logging
+from typing import Dict, List, Optional
+
+from game_logic import process_game_command, command_spec
+from locking import state_lock, player_locks
+from state_tracking import reset_tracking, collect_changes, rollback_changes
+from utils import stage_changes, complete_save, refresh_shared_state, commit_shared_changes, shared_state_enabled
+from shared_store import ConflictError
+from idempotency import cached_reply, remember_reply
+from indexes import find_player_by_username, find_battle_id
+from game_events import discard_events, publish_events
+from battle_archive import discard_archived, write_archived
+from twiml import render_twiml
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Lock key serializing registrations in this process, so two players cannot claim the same
+# username (across workers the shared store refuses a username already held by another phone)
+REGISTRATION_LOCK = "register:"
+
+# Times a command is retried after conflicting with another worker (shared persistence mode)
+MAX_CONFLICT_RETRIES = 10
+
+
+def find_opponent(player_phone: str, game_state: Dict) -> str:
+    """Return the phone of the player's current opponent, or None"""
+    battle_id = find_battle_id(player_phone, game_state)
+    # Read without touching the battle, resolving locks must not mark it as modified
+    battle = dict.get(game_state["active_battles"], battle_id) if battle_id else None
+    if battle is None:
+        return None
+    return battle["players"][0] if battle["players"][1] == player_phone else battle["players"][1]
+
+
+def lock_keys_for(command: str, player_phone: str, game_state: Dict) -> List[str]:
+    """Return the lock keys a command needs: the sender plus any other player it touches"""
+    parts = command.lower().strip().split()
+    keys = [player_phone]
+    if not parts:
+        return keys
+
+    if parts[0] == "register":
+        keys.append(REGISTRATION_LOCK)
+    elif parts[0] == "duel":
+        if len(parts) >= 2:
+            target_phone = find_player_by_username(parts[1], game_state)
+            if target_phone:
+                keys.append(target_phone)
+                # A duel may archive the target's abandoned battle and free its opponent
+                keys.append(find_opponent(target_phone, game_state))
+        keys.append(find_opponent(player_phone, game_state))
+    elif parts[0] == "attack":
+        keys.append(find_opponent(player_phone, game_state))
+    return [key for key in keys if key]
+
+
+def run_read_only_command(command: str, player_phone: str, game_state: Dict) -> str:
+    """Run a command that does not modify the state, without locks or persistence"""
+    refresh_shared_state(game_state)
+    try:
+        return process_game_command(command, player_phone, game_state)
+    finally:
+        # Reading entries marks them as touched, drop them so nothing is written
+        reset_tracking(game_state)
+
+
+def run_game_command(command: str, player_phone: str, game_state: Dict, sync: bool = False,
+                     message_sid: str = None) -> Optional[str]:
+    """Run a game command under the locks of every player it touches, then persist its changes
+
+    Commands for unrelated players run in parallel; commands sharing a player are
+    serialized. The changes are collected and handed to the writer while the locks
+    are still held, so they reflect exactly this command and commands on the same
+    player are persisted in the order they ran. Waiting for durability (and
+    writing snapshots) happens after the locks are released.
+
+    In shared persistence mode other worker processes may change the same entries,
+    so the changes are committed under the locks and the command is run again on
+    fresh data if the commit conflicts.
+
+    A command that raises is rolled back: the entries it touched get their
+    pre-images back, so memory keeps matching what was persisted.
+
+    Events the command raised for other players are published, and the battles it
+    ended archived, once its changes are persisted. The rendered response is
+    remembered by message_sid; a message that was already processed returns None
+    without running the command again (cached_reply has the response sent the first
+    time). Read-only commands skip locking, persistence and the reply cache altogether.
+    """
+    spec = command_spec(command)
+    if spec is None or not spec.mutates_state:
+        return run_read_only_command(command, player_phone, game_state)
+
+    if cached_reply(message_sid) is not None:
+        logger.info(f"Duplicate message {message_sid}, already answered")
+        return None
+
+    conflicts = 0
+    while True:
+        refresh_shared_state(game_state)
+        keys = lock_keys_for(command, player_phone, game_state)
+        with state_lock.shared(), player_locks.hold(keys):
+            # The target or opponent may have changed while we were waiting
+            if set(lock_keys_for(command, player_phone, game_state)) - set(keys):
+                continue
+
+            # A retry of the same message may have been processed while we waited. Only
+            # another worker can have done so without this process remembering it, and
+            # then this command's commit conflicted, so only then is the table read again
+            if cached_reply(message_sid, durable=conflicts > 0) is not None:
+                return None
+
+            reset_tracking(game_state)
+            discard_events()
+            discard_archived()
+            try:
+                response = process_game_command(command, player_phone, game_state)
+            except BaseException:
+                # Undo what the command changed before failing, nothing of it is persisted
+                rollback_changes(game_state)
+                discard_events()
+                discard_archived()
+                raise
+            changes = collect_changes(game_state)
+
+            if shared_state_enabled():
+                # Committed in the command's own transaction, so a conflict forgets the response too
+                replies = [(message_sid, render_twiml(response))] if message_sid else []
+                if commit_shared_changes(game_state, changes, replies):
+                    for sid, rendered in replies:
+                        remember_reply(sid, rendered, durable=False)
+                    write_archived()
+                    publish_events()
+                    return response
+                conflicts += 1
+                if conflicts > MAX_CONFLICT_RETRIES:
+                    raise ConflictError(f"Command kept conflicting with other workers: {command}")
+                continue
+
+            staged = stage_changes(game_state, changes)
+            # Remembered before the sender's lock is released, so a retry waiting on it finds the response
+            if message_sid:
+                remember_reply(message_sid, render_twiml(response))
+
+        # Battles are archived and other players told only once the changes were persisted
+        if complete_save(game_state, staged, sync=sync):
+            write_archived()
+            publish_events()
+        else:
+            discard_events()
+            discard_archived()
+        return response
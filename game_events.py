@@ -0,0 +1,162 @@
+import os
+import queue
+import atexit
+import logging
+import threading
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Notifications waiting to be sent before new ones are dropped
+NOTIFY_QUEUE_SIZE = int(os.environ.get("GAME_NOTIFY_QUEUE_SIZE", "10000"))
+
+# Queue item that tells the notifier to exit
+_STOP = None
+
+# Event kinds pushed to the player
+BATTLE_START = "battle_start"
+TURN = "turn"
+BATTLE_END = "battle_end"
+
+# Event kinds only counted, for the polling metrics: an attack on the player's turn
+# and an attack out of turn, i.e. a poll for the turn
+TURN_TAKEN = "turn_taken"
+WASTED_POLL = "wasted_poll"
+
+
+class GameEvent(NamedTuple):
+    """Something that happened to a player during a command"""
+    kind: str
+    phone: str
+    message: str
+    battle_id: Optional[str] = None
+
+
+# Events raised by the command running on this thread, published once it is persisted
+_pending = threading.local()
+
+
+def emit_event(kind: str, phone: str, message: str, battle_id: str = None) -> None:
+    """Raise an event from a command; it is only sent if the command's changes are saved"""
+    events = getattr(_pending, "events", None)
+    if events is None:
+        events = _pending.events = []
+    events.append(GameEvent(kind, phone, message, battle_id))
+
+
+def discard_events() -> None:
+    """Drop the events of a command that failed or will be retried"""
+    _pending.events = []
+
+
+def publish_events() -> int:
+    """Hand the events of the command that just finished to the notifier"""
+    events = getattr(_pending, "events", None) or []
+    _pending.events = []
+    if _notifier is not None:
+        for event in events:
+            _notifier.submit(event)
+    return len(events)
+
+
+class TurnNotifier:
+    """Background thread pushing game events to players, so commands never wait on sends
+
+    Also counts the attack polls the notifications make unnecessary: a turn
+    notice delivered to a player whose turn it still is spares them asking with
+    'attack' until it is. Notices that fail, are dropped or arrive after the
+    player already moved save nothing and are not counted.
+    """
+
+    def __init__(self, send: Callable[[str, str], Any], queue_size: int = NOTIFY_QUEUE_SIZE):
+        self._send = send
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="turn-notifier", daemon=True)
+        self._lock = threading.Lock()
+        # Phone -> battle in which it is their turn, until they attack or the battle ends
+        self._awaiting: Dict[str, Optional[str]] = {}
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.polls_avoided = 0
+        self.wasted_polls = 0
+
+    def start(self) -> "TurnNotifier":
+        self._thread.start()
+        return self
+
+    def submit(self, event: GameEvent) -> bool:
+        with self._lock:
+            if event.kind == TURN_TAKEN:
+                self._awaiting.pop(event.phone, None)
+                return True
+            if event.kind == WASTED_POLL:
+                self.wasted_polls += 1
+                return True
+            # Before queueing, so the sender never sees the notice ahead of the turn
+            if event.kind == TURN:
+                self._awaiting[event.phone] = event.battle_id
+            elif event.kind == BATTLE_END:
+                self._awaiting.pop(event.phone, None)
+
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.warning(f"Notification queue full, dropping {event.kind} event for {event.phone}")
+            return False
+        return True
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "polls_avoided": self.polls_avoided,
+                "wasted_polls": self.wasted_polls
+            }
+
+    def stop(self, timeout: float = None) -> None:
+        """Send the notifications already queued, then stop"""
+        self._queue.put(_STOP)
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            event = self._queue.get()
+            if event is _STOP:
+                return
+            with self._lock:
+                # Checked before sending: a player answering the notice at once moves before the send returns
+                waiting = event.kind == TURN and self._awaiting.get(event.phone) == event.battle_id
+            try:
+                self._send(event.phone, event.message)
+                with self._lock:
+                    self.sent += 1
+                    if waiting:
+                        self.polls_avoided += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.error(f"Error notifying {event.phone} of {event.kind}: {e}")
+
+
+_notifier: Optional[TurnNotifier] = None
+
+
+def start_turn_notifier(send: Callable[[str, str], Any]) -> TurnNotifier:
+    """Start pushing published events to players with send(phone, message)"""
+    global _notifier
+    _notifier = TurnNotifier(send).start()
+    atexit.register(_notifier.stop)
+    return _notifier
+
+
+def turn_notifier() -> Optional[TurnNotifier]:
+    return _notifier
+
@@ -1,6 +1,15 @@
+import time
 import random
+import inspect
 import logging
-from typing import Dict, List, Tuple, Any
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from battle_archive import archive_battle, archive_log_lines
+from state_tracking import ChangeTracker
+from indexes import find_player_by_username, find_battle_id, player_versions
+from catalog import get_catalog, format_rewards
+from rendering import FIELD, cached_template, player_views
+from game_events import emit_event, BATTLE_START, TURN, BATTLE_END, TURN_TAKEN, WASTED_POLL
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -85,6 +94,12 @@ RANK_BONUSES = {
     "SS": {"max_stats": 500, "karma_gain": 0.20, "divine_raids": True}
 }
 
+# Number of log lines kept in memory per battle; older lines move to the battle archive
+BATTLE_LOG_LIMIT = 20
+
+# Seconds without a move after which a battle is considered abandoned
+STALE_BATTLE_SECONDS = 24 * 60 * 60
+
 # Starting items by class
 CLASS_ITEMS = {
     "Warrior": ["Iron Axe", "Steel Shield"],
@@ -103,53 +118,81 @@ CLASS_ITEMS = {
     "Artisan": ["Portable Anvil", "Blacksmith's Hammer"]
 }
 
+class CommandSpec(NamedTuple):
+    """A registered game command and what the router needs to know about it"""
+    name: str
+    handler: Callable[..., str]
+    # Names of the handler's arguments, out of parts, player, player_phone/phone and game_state
+    arguments: Tuple[str, ...]
+    usage: str
+    description: str
+    section: str
+    needs_registration: bool
+    mutates_state: bool
+    needs_battle: bool
+
+# Dispatch table keyed by the first word of a command
+COMMANDS: Dict[str, CommandSpec] = {}
+
+# Help sections in display order
+HELP_SECTIONS = ["GENERAL COMMANDS", "REGISTRATION", "COMBAT", "EXPLORATION", "ECONOMY", "PROGRESSION"]
+
+def command(name: str, usage: str, description: str, section: str, needs_registration: bool = True,
+            mutates_state: bool = False, needs_battle: bool = False):
+    """Register a function as the handler of a game command"""
+    def register(handler: Callable[..., str]) -> Callable[..., str]:
+        if name in COMMANDS:
+            raise ValueError(f"Command '{name}' is already registered")
+        arguments = tuple(inspect.signature(handler).parameters)
+        COMMANDS[name] = CommandSpec(name, handler, arguments, usage, description, section,
+                                     needs_registration, mutates_state, needs_battle)
+        return handler
+    return register
+
+def command_spec(command: str) -> Optional[CommandSpec]:
+    """Return the registered command a message invokes, or None"""
+    parts = command.lower().split(maxsplit=1)
+    return COMMANDS.get(parts[0]) if parts else None
+
 def process_game_command(command: str, player_phone: str, game_state: Dict) -> str:
     """Process a game command and return the response"""
     command = command.lower().strip()
     parts = command.split()
+    spec = COMMANDS.get(parts[0]) if parts else None
     
     # Check if player exists
-    if player_phone in game_state["players"]:
-        player = game_state["players"][player_phone]
+    players = game_state["players"]
+    if spec is not None and not spec.mutates_state and isinstance(players, ChangeTracker):
+        # Read-only commands skip recording the player's pre-image, which costs more than they do
+        player = players.peek(player_phone)
     else:
+        player = players.get(player_phone)
+    if player is None and (spec is None or spec.needs_registration):
         # If player doesn't exist, only allow registration or help
-        if command.startswith("register"):
-            return register_player(parts, player_phone, game_state)
-        elif command == "help":
-            return get_help_text()
-        else:
-            return "You are not registered. Use 'register [username] [race] [class] [element]' to join the game."
-    
-    # Process command for registered player
-    if command.startswith("help"):
-        return get_help_text()
-    elif command.startswith("status"):
-        return get_player_status(player)
-    elif command.startswith("inventory"):
-        return get_player_inventory(player)
-    elif command.startswith("skills"):
-        return get_player_skills(player)
-    elif command.startswith("duel"):
-        return initiate_duel(parts, player, player_phone, game_state)
-    elif command.startswith("attack"):
-        return process_attack(parts, player, player_phone, game_state)
-    elif command.startswith("use"):
-        return use_item_or_skill(parts, player, player_phone, game_state)
-    elif command.startswith("shop"):
-        return show_shop_items(player)
-    elif command.startswith("buy"):
-        return buy_item(parts, player, game_state)
-    elif command.startswith("explore"):
-        return explore_zone(parts, player, game_state)
-    elif command.startswith("quest"):
-        return manage_quests(parts, player, game_state)
-    elif command.startswith("rank"):
-        return show_rank_info(player)
-    else:
+        return "You are not registered. Use 'register [username] [race] [class] [element]' to join the game."
+    
+    if spec is None:
         return "Unknown command. Type 'help' for available commands."
+    
+    if spec.needs_battle and not player["in_battle"] and find_battle_id(player_phone, game_state) is None:
+        return "You're not in a battle."
+    
+    context = {
+        "parts": parts,
+        "player": player,
+        "player_phone": player_phone,
+        "phone": player_phone,
+        "game_state": game_state
+    }
+    return spec.handler(*[context[argument] for argument in spec.arguments])
 
+@command("register", "register [username] [race] [class] [element]", "Create character", "REGISTRATION",
+         needs_registration=False, mutates_state=True)
 def register_player(parts: List[str], phone: str, game_state: Dict) -> str:
     """Register a new player"""
+    if phone in game_state["players"]:
+        return "You are already registered. Type 'status' to see your character."
+    
     if len(parts) < 5:
         return "Registration format: register [username] [race] [class] [element]"
     
@@ -169,9 +212,8 @@ def register_player(parts: List[str], phone: str, game_state: Dict) -> str:
         return f"Invalid element. Choose from: {', '.join(ELEMENTS)}"
     
     # Check if username is taken
-    for p_phone, p_data in game_state["players"].items():
-        if p_data["username"].lower() == username.lower():
-            return "Username already taken. Please choose another."
+    if find_player_by_username(username, game_state):
+        return "Username already taken. Please choose another."
     
     # Create new player
     new_player = {
@@ -194,64 +236,57 @@ def register_player(parts: List[str], phone: str, game_state: Dict) -> str:
         "inventory": [],
         "equipped": {},
         "is_deity": False,
-        "in_battle": False
+        "in_battle": False,
+        "created_at": time.time()
     }
     
     # Add a starting item based on class
     if char_class in CLASS_ITEMS:
         new_player["inventory"].append(CLASS_ITEMS[char_class][0])
     
-    # Ask for attribute distribution
-    attribute_setup_message = (
+    # Point new players at the commands they can use
+    welcome_message = (
         f"Welcome {username}, the {race} {char_class}!\n"
-        "You have 10 points to distribute among your attributes.\n"
-        "Use 'attributes [str] [agi] [int] [end]' to set them.\n"
-        "Example: attributes 4 2 2 2"
+        "Type 'help' for available commands."
     )
     
     # Add player to game state
     game_state["players"][phone] = new_player
     
-    return attribute_setup_message
+    return welcome_message
 
+@command("help", "help", "Show this help", "GENERAL COMMANDS", needs_registration=False)
 def get_help_text() -> str:
-    """Return the help text with available commands"""
-    return (
-        "🎮 WHATSAPP RPG - COMMAND GUIDE 🎮\n\n"
-        "GENERAL COMMANDS:\n"
-        "- help: Show this help\n"
-        "- status: Check your character status\n"
-        "- inventory: View your items\n"
-        "- skills: List your skills\n\n"
-        
-        "REGISTRATION:\n"
-        "- register [username] [race] [class] [element]: Create character\n"
-        "- attributes [str] [agi] [int] [end]: Set attributes\n\n"
-        
-        "COMBAT:\n"
-        "- duel [player]: Challenge someone to a duel\n"
-        "- attack [skill]: Use a skill in combat\n"
-        "- use [item/skill]: Use an item or skill\n\n"
-        
-        "EXPLORATION:\n"
-        "- explore [zone]: Explore a zone\n"
-        "- quest [id]: Start a quest\n\n"
-        
-        "ECONOMY:\n"
-        "- shop: View available items\n"
-        "- buy [item]: Purchase an item\n\n"
-        
-        "PROGRESSION:\n"
-        "- rank: View rank information\n\n"
-        
-        "Available races: Human, Elf, Dwarf, Orc, Anaon\n"
-        "Available classes: Warrior, Archer, Mage, Paladin, Rogue, Druid, Necromancer, "
-        "Bard, Berserker, Alchemist, Guardian, Scout, Chronomancer, Artisan\n"
-        "Available elements: Fire, Water, Plant, Earth, Wind, Darkness, Light"
+    """Return the help text with available commands, generated from the registered commands"""
+    return cached_template("help", None, _build_help_text).render()
+
+def _build_help_text() -> str:
+    help_text = "🎮 WHATSAPP RPG - COMMAND GUIDE 🎮\n\n"
+    for section in HELP_SECTIONS:
+        help_text += f"{section}:\n"
+        for spec in COMMANDS.values():
+            if spec.section == section:
+                help_text += f"- {spec.usage}: {spec.description}\n"
+        help_text += "\n"
+    help_text += (
+        f"Available races: {', '.join(RACES)}\n"
+        f"Available classes: {', '.join(CLASSES)}\n"
+        f"Available elements: {', '.join(ELEMENTS)}"
     )
+    return help_text
 
-def get_player_status(player: Dict) -> str:
+@command("status", "status", "Check your character status", "GENERAL COMMANDS")
+def get_player_status(player: Dict, player_phone: str, game_state: Dict) -> str:
     """Return player status information"""
+    return _player_view("status", player, player_phone, game_state, _render_status)
+
+def _player_view(view: str, player: Dict, player_phone: str, game_state: Dict,
+                 render: Callable[[Dict], str]) -> str:
+    """Return a rendered view of the player, memoized until the player changes"""
+    version = player_versions(game_state).version(player_phone)
+    return player_views.get((view, player_phone, version), lambda: render(player))
+
+def _render_status(player: Dict) -> str:
     attributes = player["attributes"]
     
     status = (
@@ -272,8 +307,12 @@ def get_player_status(player: Dict) -> str:
     
     return status
 
-def get_player_inventory(player: Dict) -> str:
+@command("inventory", "inventory", "View your items", "GENERAL COMMANDS")
+def get_player_inventory(player: Dict, player_phone: str, game_state: Dict) -> str:
     """Return player inventory"""
+    return _player_view("inventory", player, player_phone, game_state, _render_inventory)
+
+def _render_inventory(player: Dict) -> str:
     if not player["inventory"]:
         return "Your inventory is empty."
     
@@ -283,8 +322,12 @@ def get_player_inventory(player: Dict) -> str:
     
     return inventory_text
 
-def get_player_skills(player: Dict) -> str:
+@command("skills", "skills", "List your skills", "GENERAL COMMANDS")
+def get_player_skills(player: Dict, player_phone: str, game_state: Dict) -> str:
     """Return player skills"""
+    return _player_view("skills", player, player_phone, game_state, _render_skills)
+
+def _render_skills(player: Dict) -> str:
     if not player["skills"]:
         return "You don't have any skills yet."
     
@@ -294,6 +337,7 @@ def get_player_skills(player: Dict) -> str:
     
     return skills_text
 
+@command("duel", "duel [player]", "Challenge someone to a duel", "COMBAT", mutates_state=True)
 def initiate_duel(parts: List[str], player: Dict, player_phone: str, game_state: Dict) -> str:
     """Initiate a duel with another player"""
     if len(parts) < 2:
@@ -302,14 +346,8 @@ def initiate_duel(parts: List[str], player: Dict, player_phone: str, game_state:
     target_username = parts[1]
     
     # Find target player
-    target_phone = None
-    target_player = None
-    
-    for phone, p in game_state["players"].items():
-        if p["username"].lower() == target_username.lower():
-            target_phone = phone
-            target_player = p
-            break
+    target_phone = find_player_by_username(target_username, game_state)
+    target_player = game_state["players"].get(target_phone) if target_phone else None
     
     if not target_player:
         return f"Player '{target_username}' not found."
@@ -318,59 +356,85 @@ def initiate_duel(parts: List[str], player: Dict, player_phone: str, game_state:
         return "You can't duel yourself."
     
     if player["in_battle"] or target_player["in_battle"]:
-        return "Either you or your target is already in a battle."
+        # Abandoned battles should not lock players out of new duels
+        reap_stale_battles(game_state, phones=[player_phone, target_phone])
+        if player["in_battle"] or target_player["in_battle"]:
+            return "Either you or your target is already in a battle."
     
     # Create a new battle
     battle_id = f"{player_phone}_{target_phone}"
+    now = time.time()
     
     game_state["active_battles"][battle_id] = {
         "players": [player_phone, target_phone],
         "current_turn": player_phone,
         "rounds": 0,
         "logs": [f"{player['username']} challenged {target_player['username']} to a duel!"],
-        "zone": random.choice(ZONES)
+        "zone": random.choice(ZONES),
+        "started_at": now,
+        "updated_at": now
     }
     
     # Mark players as in battle
     player["in_battle"] = True
     target_player["in_battle"] = True
     
+    emit_event(BATTLE_START, target_phone,
+               f"⚔️ {player['username']} challenged you to a duel in the {game_state['active_battles'][battle_id]['zone']}!\n"
+               f"They attack first, you will be told when it's your turn.", battle_id)
+    
     return (
         f"You challenged {target_player['username']} to a duel in the {game_state['active_battles'][battle_id]['zone']}!\n"
         f"Use 'attack [skill]' to make your move."
     )
 
+def find_player_battle(player: Dict, player_phone: str, game_state: Dict) -> Tuple[str, Dict]:
+    """Return the id and data of the player's active battle, or (None, None)
+
+    The player's in_battle flag is repaired if it disagrees with the battles.
+    """
+    battle_id = find_battle_id(player_phone, game_state)
+    battle = game_state["active_battles"].get(battle_id) if battle_id else None
+    
+    if battle is None and player["in_battle"]:
+        logger.warning(f"Player {player_phone} was flagged in battle without one, resetting")
+        player["in_battle"] = False
+    elif battle is not None and not player["in_battle"]:
+        logger.warning(f"Player {player_phone} was in battle {battle_id} without the flag, restoring")
+        player["in_battle"] = True
+    
+    return (battle_id, battle) if battle is not None else (None, None)
+
+@command("attack", "attack [skill]", "Use a skill in combat", "COMBAT", mutates_state=True, needs_battle=True)
 def process_attack(parts: List[str], player: Dict, player_phone: str, game_state: Dict) -> str:
     """Process an attack in a duel"""
-    if not player["in_battle"]:
-        return "You're not in a battle."
+    was_in_battle = player["in_battle"]
     
     # Find the active battle
-    battle_id = None
-    battle = None
-    
-    for b_id, b_data in game_state["active_battles"].items():
-        if player_phone in b_data["players"]:
-            battle_id = b_id
-            battle = b_data
-            break
+    battle_id, battle = find_player_battle(player, player_phone, game_state)
     
     if not battle:
-        # Something went wrong, reset battle state
-        player["in_battle"] = False
-        return "You're not in an active battle. Your status has been reset."
+        if was_in_battle:
+            # Something went wrong, the battle state was reset
+            return "You're not in an active battle. Your status has been reset."
+        return "You're not in a battle."
     
     if battle["current_turn"] != player_phone:
+        emit_event(WASTED_POLL, player_phone, "", battle_id)
         return "It's not your turn to attack."
     
+    emit_event(TURN_TAKEN, player_phone, "", battle_id)
+    
     # Get skill to use
     skill = "Punch"  # Default skill
     if len(parts) >= 2:
-        requested_skill = " ".join(parts[1:])
-        for s in player["skills"]:
-            if s.lower() == requested_skill.lower():
-                skill = s
-                break
+        requested = " ".join(parts[1:])
+        requested_skill = get_catalog().skill(requested)
+        if requested_skill and requested_skill.name in player["skills"]:
+            skill = requested_skill.name
+        else:
+            # Skills outside the catalog (older saves, granted by an admin) are matched by name
+            skill = next((s for s in player["skills"] if s.casefold() == requested.casefold()), skill)
     
     # Find opponent
     opponent_phone = battle["players"][0] if battle["players"][1] == player_phone else battle["players"][1]
@@ -380,16 +444,17 @@ def process_attack(parts: List[str], player: Dict, player_phone: str, game_state
     damage = calculate_damage(player, opponent, skill, battle["zone"])
     
     # Apply damage to opponent (this is simplified, would need HP system)
-    battle["logs"].append(f"{player['username']} used {skill} and dealt {damage} damage!")
+    add_battle_log(battle_id, battle, f"{player['username']} used {skill} and dealt {damage} damage!")
     
     # Switch turn
     battle["current_turn"] = opponent_phone
     battle["rounds"] += 1
+    battle["updated_at"] = time.time()
     
     # Check if battle should end (for this example, we'll end after 5 rounds)
     if battle["rounds"] >= 5:
         # Determine winner based on total damage (simplified)
-        battle["logs"].append(f"The duel has ended! {player['username']} wins!")
+        add_battle_log(battle_id, battle, f"The duel has ended! {player['username']} wins!")
         
         # End battle
         player["in_battle"] = False
@@ -402,45 +467,149 @@ def process_attack(parts: List[str], player: Dict, player_phone: str, game_state
         # Check for level up
         check_level_up(player)
         
-        # Remove battle
+        # Move the battle to the archive
+        archive_battle(battle_id, battle, "completed", winner=player_phone)
         del game_state["active_battles"][battle_id]
         
         battle_log = "\n".join(battle["logs"])
+        emit_event(BATTLE_END, opponent_phone, f"{battle_log}\n\nYou lost the duel against {player['username']}.",
+                   battle_id)
         return f"{battle_log}\n\nYou won the duel and gained 50 XP and 10 gold!"
     
+    emit_event(TURN, opponent_phone,
+               f"{player['username']} used {skill} and dealt {damage} damage!\n"
+               f"It's your turn: use 'attack [skill]' to make your move.", battle_id)
     return f"You used {skill}! Waiting for {opponent['username']} to make their move."
 
-def calculate_damage(attacker: Dict, defender: Dict, skill: str, zone: str) -> int:
-    """Calculate damage for an attack (simplified)"""
-    # Base damage based on strength or intelligence depending on skill
-    if skill in ["Punch", "Precision Shot"]:
-        base_damage = 5 + (attacker["attributes"]["strength"] * 2)
+def add_battle_log(battle_id: str, battle: Dict, line: str) -> None:
+    """Append a line to a battle log, moving all but the last BATTLE_LOG_LIMIT lines to the archive"""
+    logs = battle["logs"]
+    logs.append(line)
+    if len(logs) > BATTLE_LOG_LIMIT:
+        # Battles from before start times were recorded need a fixed one to file the lines under
+        battle.setdefault("started_at", battle.get("updated_at") or 0)
+        trimmed = battle.get("trimmed_logs", 0)
+        archive_log_lines(battle_id, battle, trimmed, logs[:-BATTLE_LOG_LIMIT])
+        battle["trimmed_logs"] = trimmed + len(logs) - BATTLE_LOG_LIMIT
+        del logs[:-BATTLE_LOG_LIMIT]
+
+def reap_stale_battles(game_state: Dict, phones: List[str] = None, max_age: float = STALE_BATTLE_SECONDS) -> int:
+    """Archive battles nobody moved in for max_age seconds and free their players
+
+    With phones, only battles involving those players are checked.
+    """
+    now = time.time()
+    battles = game_state["active_battles"]
+    reaped = 0
+    
+    if phones is None:
+        candidates = list(battles.items())
     else:
-        base_damage = 5 + (attacker["attributes"]["intelligence"] * 2)
+        battle_ids = {find_battle_id(phone, game_state) for phone in phones} - {None}
+        candidates = [(battle_id, dict.get(battles, battle_id)) for battle_id in battle_ids]
+    
+    for battle_id, b_data in candidates:
+        if b_data is None:
+            continue
+        
+        if "updated_at" not in b_data:
+            # Battles from before timestamps were recorded start their clock now
+            battles[battle_id]["updated_at"] = now
+            continue
+        
+        if now - b_data["updated_at"] < max_age:
+            continue
+        
+        battle = battles[battle_id]
+        archive_battle(battle_id, battle, "abandoned")
+        for phone in battle["players"]:
+            if phone in game_state["players"]:
+                game_state["players"][phone]["in_battle"] = False
+        del battles[battle_id]
+        reaped += 1
+    
+    if reaped:
+        logger.info(f"Archived {reaped} abandoned battles")
+    return reaped
+
+# How a skill enters the damage formula: (attribute used for base damage, bonus group)
+SKILL_KINDS = {
+    "Punch": ("strength", "melee"),
+    "Precision Shot": ("strength", None),
+    "Mind Shuffle": ("intelligence", "magic"),
+    "Magic Shield": ("intelligence", "magic")
+}
+DEFAULT_SKILL_KIND = ("intelligence", None)
+
+def attacker_factors(race: str, char_class: str, bonus_group: Optional[str]) -> Tuple[float, ...]:
+    """Race and class damage multipliers, in the order they are applied"""
+    factors = []
     
     # Apply racial bonuses
-    if attacker["race"] in RACE_TRAITS:
-        traits = RACE_TRAITS[attacker["race"]]
-        if "melee_damage" in traits and skill == "Punch":
-            base_damage *= (1 + traits["melee_damage"])
+    if race in RACE_TRAITS:
+        traits = RACE_TRAITS[race]
+        if "melee_damage" in traits and bonus_group == "melee":
+            factors.append(1 + traits["melee_damage"])
     
     # Apply class bonuses
-    if attacker["class"] in CLASS_BONUSES:
-        bonuses = CLASS_BONUSES[attacker["class"]]
-        if "melee_damage" in bonuses and skill == "Punch":
-            base_damage *= (1 + bonuses["melee_damage"])
-        elif "magic_power" in bonuses and skill in ["Mind Shuffle", "Magic Shield"]:
-            base_damage *= (1 + bonuses["magic_power"])
+    if char_class in CLASS_BONUSES:
+        bonuses = CLASS_BONUSES[char_class]
+        if "melee_damage" in bonuses and bonus_group == "melee":
+            factors.append(1 + bonuses["melee_damage"])
+        elif "magic_power" in bonuses and bonus_group == "magic":
+            factors.append(1 + bonuses["magic_power"])
+    
+    return tuple(factors)
+
+def matchup_factors(attacker_element: str, defender_element: str, zone: str) -> Tuple[float, ...]:
+    """Element and zone damage multipliers, in the order they are applied"""
+    factors = []
     
     # Apply element advantages
-    if attacker["element"] in ELEMENT_ADVANTAGES and defender["element"] == ELEMENT_ADVANTAGES[attacker["element"]]["advantage"]:
-        base_damage *= 1.1  # 10% more damage
+    if attacker_element in ELEMENT_ADVANTAGES and defender_element == ELEMENT_ADVANTAGES[attacker_element]["advantage"]:
+        factors.append(1.1)  # 10% more damage
     
     # Apply zone effects
-    if zone in ZONE_EFFECTS and attacker["element"] in ZONE_EFFECTS[zone]:
-        element_effects = ZONE_EFFECTS[zone][attacker["element"]]
+    if zone in ZONE_EFFECTS and attacker_element in ZONE_EFFECTS[zone]:
+        element_effects = ZONE_EFFECTS[zone][attacker_element]
         if "damage" in element_effects:
-            base_damage *= (1 + element_effects["damage"])
+            factors.append(1 + element_effects["damage"])
+    
+    return tuple(factors)
+
+# Damage multipliers precomputed from the rules above, by (race, class, bonus group) and
+# by (attacker element, defender element, zone). Two small tables stay in the CPU cache;
+# one flat table over all six keys measured slower than walking the rules.
+ATTACKER_FACTORS = {
+    (race, char_class, bonus_group): attacker_factors(race, char_class, bonus_group)
+    for race in RACES for char_class in CLASSES
+    for bonus_group in {kind[1] for kind in SKILL_KINDS.values()} | {DEFAULT_SKILL_KIND[1]}
+}
+MATCHUP_FACTORS = {
+    (attacker_element, defender_element, zone): matchup_factors(attacker_element, defender_element, zone)
+    for attacker_element in ELEMENTS for defender_element in ELEMENTS for zone in ZONES
+}
+
+def calculate_damage(attacker: Dict, defender: Dict, skill: str, zone: str) -> int:
+    """Calculate damage for an attack (simplified)"""
+    attribute, bonus_group = SKILL_KINDS.get(skill, DEFAULT_SKILL_KIND)
+    
+    # Base damage based on strength or intelligence depending on skill
+    base_damage = 5 + (attacker["attributes"][attribute] * 2)
+    
+    race_class = ATTACKER_FACTORS.get((attacker["race"], attacker["class"], bonus_group))
+    if race_class is None:
+        # Races or classes outside the game data
+        race_class = attacker_factors(attacker["race"], attacker["class"], bonus_group)
+    element_zone = MATCHUP_FACTORS.get((attacker["element"], defender["element"], zone))
+    if element_zone is None:
+        element_zone = matchup_factors(attacker["element"], defender["element"], zone)
+    
+    # Multiplied one by one in rule order, so results match the rules exactly
+    for factor in race_class:
+        base_damage *= factor
+    for factor in element_zone:
+        base_damage *= factor
     
     # Random variance (±10%)
     variance = random.uniform(0.9, 1.1)
@@ -464,6 +633,7 @@ def check_level_up(player: Dict) -> bool:
     
     return False
 
+@command("use", "use [item/skill]", "Use an item or skill", "COMBAT", mutates_state=True)
 def use_item_or_skill(parts: List[str], player: Dict, player_phone: str, game_state: Dict) -> str:
     """Use an item or skill outside of combat"""
     if len(parts) < 2:
@@ -471,6 +641,12 @@ def use_item_or_skill(parts: List[str], player: Dict, player_phone: str, game_st
     
     item_or_skill = " ".join(parts[1:])
     
+    # Commands arrive lower-cased, use the catalog spelling of known items and skills
+    catalog = get_catalog()
+    known = catalog.shop_item(item_or_skill) or catalog.skill(item_or_skill)
+    if known:
+        item_or_skill = known.name
+    
     # Check if it's an item
     if item_or_skill in player["inventory"]:
         # Apply item effect
@@ -491,63 +667,43 @@ def use_item_or_skill(parts: List[str], player: Dict, player_phone: str, game_st
     
     return f"You don't have {item_or_skill}."
 
+@command("shop", "shop", "View available items", "ECONOMY")
 def show_shop_items(player: Dict) -> str:
     """Show items available in the shop"""
-    shop_items = [
-        {"name": "Health Potion", "cost": 50, "description": "Restores health"},
-        {"name": "Mana Potion", "cost": 50, "description": "Restores mana"},
-        {"name": "Basic Sword", "cost": 100, "description": "+5 attack"},
-        {"name": "Wooden Shield", "cost": 80, "description": "+3 defense"},
-        {"name": "Skill Book: Fireball", "cost": 200, "description": "Learn Fireball skill"}
-    ]
-    
-    shop_text = "🛒 SHOP ITEMS 🛒\n\n"
-    for item in shop_items:
-        shop_text += f"- {item['name']} ({item['cost']} gold): {item['description']}\n"
-    
-    shop_text += f"\nYour gold: {player['gold']}\n"
-    shop_text += "To buy an item, type 'buy [item name]'"
-    
-    return shop_text
+    return cached_template("shop", None, _build_shop_text).render(player["gold"])
+
+def _build_shop_text() -> str:
+    return f"{get_catalog().shop_listing}\nYour gold: {FIELD}\nTo buy an item, type 'buy [item name]'"
 
+@command("buy", "buy [item]", "Purchase an item", "ECONOMY", mutates_state=True)
 def buy_item(parts: List[str], player: Dict, game_state: Dict) -> str:
     """Buy an item from the shop"""
     if len(parts) < 2:
         return "Please specify what to buy. Example: buy [item name]"
     
     item_name = " ".join(parts[1:])
+    item = get_catalog().shop_item(item_name)
     
-    # Simple shop items
-    shop_items = {
-        "health potion": {"cost": 50, "name": "Health Potion"},
-        "mana potion": {"cost": 50, "name": "Mana Potion"},
-        "basic sword": {"cost": 100, "name": "Basic Sword"},
-        "wooden shield": {"cost": 80, "name": "Wooden Shield"},
-        "skill book: fireball": {"cost": 200, "name": "Skill Book: Fireball"}
-    }
-    
-    if item_name.lower() not in shop_items:
+    if item is None:
         return f"{item_name} is not available in the shop."
     
-    item = shop_items[item_name.lower()]
-    
-    if player["gold"] < item["cost"]:
-        return f"You don't have enough gold to buy {item['name']}. You need {item['cost']} gold."
+    if player["gold"] < item.cost:
+        return f"You don't have enough gold to buy {item.name}. You need {item.cost} gold."
     
     # Process purchase
-    player["gold"] -= item["cost"]
+    player["gold"] -= item.cost
     
     # Handle special items like skill books
-    if "Skill Book" in item["name"]:
-        skill_name = item["name"].split(": ")[1]
-        if skill_name not in player["skills"]:
-            player["skills"].append(skill_name)
-            return f"You learned a new skill: {skill_name}!"
+    if item.teaches:
+        if item.teaches not in player["skills"]:
+            player["skills"].append(item.teaches)
+            return f"You learned a new skill: {item.teaches}!"
     else:
-        player["inventory"].append(item["name"])
+        player["inventory"].append(item.name)
     
-    return f"You bought {item['name']} for {item['cost']} gold."
+    return f"You bought {item.name} for {item.cost} gold."
 
+@command("explore", "explore [zone]", "Explore a zone", "EXPLORATION", mutates_state=True)
 def explore_zone(parts: List[str], player: Dict, game_state: Dict) -> str:
     """Explore a zone for random encounters and rewards"""
     if len(parts) < 2:
@@ -603,27 +759,14 @@ def explore_zone(parts: List[str], player: Dict, game_state: Dict) -> str:
     else:
         return f"You explored the {zone_name} but found nothing of interest."
 
+@command("quest", "quest [id]", "Start a quest", "EXPLORATION", mutates_state=True)
 def manage_quests(parts: List[str], player: Dict, game_state: Dict) -> str:
     """Manage player quests"""
-    # Simple quest system
-    available_quests = [
-        {"id": 1, "name": "Herb Gathering", "description": "Collect medicinal herbs", "reward_exp": 100, "reward_gold": 50},
-        {"id": 2, "name": "Monster Hunt", "description": "Defeat 5 monsters", "reward_exp": 200, "reward_gold": 100},
-        {"id": 3, "name": "Lost Artifact", "description": "Find the ancient artifact", "reward_exp": 300, "reward_gold": 150}
-    ]
+    catalog = get_catalog()
     
     if len(parts) == 1:
         # List available quests
-        quest_text = "📜 AVAILABLE QUESTS 📜\n\n"
-        for quest in available_quests:
-            quest_text += (
-                f"#{quest['id']}: {quest['name']}\n"
-                f"- {quest['description']}\n"
-                f"- Rewards: {quest['reward_exp']} XP, {quest['reward_gold']} gold\n\n"
-            )
-        
-        quest_text += "To start a quest, type 'quest [id]'"
-        return quest_text
+        return catalog.quest_listing
     
     # Start specific quest
     try:
@@ -631,52 +774,60 @@ def manage_quests(parts: List[str], player: Dict, game_state: Dict) -> str:
     except ValueError:
         return "Invalid quest ID. Please enter a number."
     
-    # Find quest
-    quest = None
-    for q in available_quests:
-        if q["id"] == quest_id:
-            quest = q
-            break
+    quest = catalog.quest(quest_id)
     
     if not quest:
         return f"Quest #{quest_id} not found."
     
+    if player["level"] < quest.level_req:
+        return f"The '{quest.name}' quest requires level {quest.level_req}."
+    
     # For simplicity, immediately complete the quest
-    player["experience"] += quest["reward_exp"]
-    player["gold"] += quest["reward_gold"]
+    player["experience"] += quest.exp
+    player["gold"] += quest.gold
+    player["karma"] += quest.karma
+    player["inventory"].extend(quest.items)
     
     # Check for level up
     leveled_up = check_level_up(player)
     level_message = " You leveled up!" if leveled_up else ""
     
     return (
-        f"You completed the '{quest['name']}' quest!\n"
-        f"You gained {quest['reward_exp']} XP and {quest['reward_gold']} gold.{level_message}"
+        f"You completed the '{quest.name}' quest!\n"
+        f"You gained {format_rewards(quest)}.{level_message}"
     )
 
+@command("rank", "rank", "View rank information", "PROGRESSION")
 def show_rank_info(player: Dict) -> str:
     """Show information about player rank and progression"""
     current_rank = player["rank"]
+    return cached_template("rank", current_rank, lambda: _build_rank_text(current_rank)).render(player["level"])
+
+def _rank_bonus_lines(rank: str) -> str:
+    lines = ""
+    for bonus, value in RANK_BONUSES[rank].items():
+        if isinstance(value, bool):
+            if value:
+                lines += f"- {bonus} unlocked\n"
+        elif isinstance(value, (int, float)):
+            if bonus == "max_stats":
+                lines += f"- Max stats: {value}\n"
+            else:
+                lines += f"- {bonus}: +{int(value * 100)}%\n"
+    return lines
+
+def _build_rank_text(current_rank: str) -> str:
     current_rank_index = RANKS.index(current_rank)
     
     rank_info = (
         f"📊 RANK INFORMATION 📊\n\n"
         f"Your current rank: {current_rank}\n"
-        f"Level: {player['level']}\n\n"
+        f"Level: {FIELD}\n\n"
     )
     
     # Current rank bonuses
-    bonuses = RANK_BONUSES[current_rank]
     rank_info += "Current rank bonuses:\n"
-    for bonus, value in bonuses.items():
-        if isinstance(value, bool):
-            if value:
-                rank_info += f"- {bonus} unlocked\n"
-        elif isinstance(value, (int, float)):
-            if bonus == "max_stats":
-                rank_info += f"- Max stats: {value}\n"
-            else:
-                rank_info += f"- {bonus}: +{int(value * 100)}%\n"
+    rank_info += _rank_bonus_lines(current_rank)
     
     # Next rank information
     if current_rank_index < len(RANKS) - 1:
@@ -687,17 +838,8 @@ def show_rank_info(player: Dict) -> str:
         rank_info += f"- Reach level {next_level_req}\n"
         
         # Next rank bonuses
-        next_bonuses = RANK_BONUSES[next_rank]
         rank_info += "\nNext rank bonuses:\n"
-        for bonus, value in next_bonuses.items():
-            if isinstance(value, bool):
-                if value:
-                    rank_info += f"- {bonus} unlocked\n"
-            elif isinstance(value, (int, float)):
-                if bonus == "max_stats":
-                    rank_info += f"- Max stats: {value}\n"
-                else:
-                    rank_info += f"- {bonus}: +{int(value * 100)}%\n"
+        rank_info += _rank_bonus_lines(next_rank)
     else:
         rank_info += "\nYou have reached the maximum rank!"
     
@@ -0,0 +1,200 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+from twiml import message_twiml
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# SQLite database remembering the response sent for each Twilio MessageSid (in shared
+# persistence mode the table lives in the shared state database instead)
+IDEMPOTENCY_DB = os.environ.get("GAME_IDEMPOTENCY_DB", "processed_messages.db")
+
+# SQLite synchronous level: a response lost on power failure only lets one retry run again
+IDEMPOTENCY_SYNCHRONOUS = os.environ.get("GAME_IDEMPOTENCY_SYNCHRONOUS", "NORMAL")
+
+# Seconds a response is kept for Twilio retries
+IDEMPOTENCY_TTL = float(os.environ.get("GAME_IDEMPOTENCY_TTL", "86400"))
+
+# Maximum number of responses kept in the table, the oldest ones are dropped first
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("GAME_IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+# Recent responses also kept in memory, so retries are answered without reading the table
+IDEMPOTENCY_MEMORY_ENTRIES = int(os.environ.get("GAME_IDEMPOTENCY_MEMORY_ENTRIES", "1000"))
+
+# Expired responses deleted per new response at most, so purging cost stays bounded
+_PURGE_BATCH = 16
+
+# Game state section earlier versions kept the replies in
+LEGACY_SECTION = "processed_messages"
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS processed_messages (
+        message_sid TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS processed_messages_expiry ON processed_messages (expires_at);
+"""
+
+
+def create_schema(connection: sqlite3.Connection) -> None:
+    """Create the responses table, rendering the plain replies an earlier version stored"""
+    connection.executescript(SCHEMA)
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        # Checked inside the transaction, another worker may be converting the table too
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(processed_messages)")}
+        if "reply" in columns:
+            connection.create_function("message_twiml", 1, message_twiml, deterministic=True)
+            connection.execute("ALTER TABLE processed_messages RENAME COLUMN reply TO response")
+            connection.execute("UPDATE processed_messages SET response = message_twiml(response)")
+            logger.info("Converted the processed message replies to rendered responses")
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+
+def write_replies(connection: sqlite3.Connection, replies: Iterable[Tuple[str, str]], now: float = None) -> None:
+    """Store (message_sid, response) pairs in the caller's transaction
+
+    A few expired responses are purged along the way, and the oldest ones beyond
+    IDEMPOTENCY_MAX_ENTRIES are dropped.
+    """
+    now = now or time.time()
+    connection.executemany(
+        "INSERT OR REPLACE INTO processed_messages (message_sid, response, expires_at) VALUES (?, ?, ?)",
+        [(message_sid, response, now + IDEMPOTENCY_TTL) for message_sid, response in replies]
+    )
+    connection.execute(
+        "DELETE FROM processed_messages WHERE rowid IN "
+        "(SELECT rowid FROM processed_messages WHERE expires_at <= ? LIMIT ?)", (now, _PURGE_BATCH)
+    )
+    # Every response lives for IDEMPOTENCY_TTL, so the earliest expiry is the oldest response
+    connection.execute(
+        "DELETE FROM processed_messages WHERE rowid IN "
+        "(SELECT rowid FROM processed_messages ORDER BY expires_at "
+        "LIMIT max(0, (SELECT COUNT(*) FROM processed_messages) - ?))", (IDEMPOTENCY_MAX_ENTRIES,)
+    )
+
+
+class ReplyStore:
+    """Rendered responses of processed messages in a SQLite table with an expiry column
+
+    Kept outside the tracked game state, so the responses are neither exposed with
+    it nor written (and conflicted on) as state entries. The most recent responses
+    are also kept in a bounded in-memory LRU, which answers retries without disk reads.
+    """
+
+    def __init__(self, path: str = None, memory_entries: int = IDEMPOTENCY_MEMORY_ENTRIES):
+        self.path = path or IDEMPOTENCY_DB
+        self.memory_entries = memory_entries
+        self._local = threading.local()
+        # message_sid -> (response, expires_at), least recently used first
+        self._recent: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._recent_lock = threading.Lock()
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        create_schema(connection)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection (sqlite3 connections are not shared between threads)"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute(f"PRAGMA synchronous={IDEMPOTENCY_SYNCHRONOUS}")
+            self._local.connection = connection
+        return connection
+
+    def _recall(self, message_sid: str, now: float) -> Optional[str]:
+        with self._recent_lock:
+            entry = self._recent.get(message_sid)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._recent[message_sid]
+                return None
+            self._recent.move_to_end(message_sid)
+            return entry[0]
+
+    def _keep(self, message_sid: str, response: str, expires_at: float) -> None:
+        with self._recent_lock:
+            self._recent[message_sid] = (response, expires_at)
+            self._recent.move_to_end(message_sid)
+            while len(self._recent) > self.memory_entries:
+                self._recent.popitem(last=False)
+
+    def get(self, message_sid: str, now: float = None, durable: bool = True) -> Optional[str]:
+        """Return the response remembered for message_sid; durable=False only looks in memory"""
+        now = now or time.time()
+        response = self._recall(message_sid, now)
+        if response is not None or not durable:
+            return response
+        row = self._connection().execute(
+            "SELECT response, expires_at FROM processed_messages WHERE message_sid = ? AND expires_at > ?",
+            (message_sid, now)
+        ).fetchone()
+        if row is None:
+            return None
+        self._keep(message_sid, *row)
+        return row[0]
+
+    def remember(self, message_sid: str, response: str, now: float = None, durable: bool = True) -> None:
+        """Remember a response; durable=False when it was already written with the command's changes"""
+        now = now or time.time()
+        if durable:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                write_replies(connection, [(message_sid, response)], now)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        self._keep(message_sid, response, now + IDEMPOTENCY_TTL)
+
+
+_store: Optional[ReplyStore] = None
+_store_lock = threading.Lock()
+
+
+def reply_store() -> ReplyStore:
+    """Return the reply store, opening it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ReplyStore()
+    return _store
+
+
+def use_reply_store(store: ReplyStore) -> None:
+    """Keep replies in the given store, e.g. one in the shared state database"""
+    global _store
+    _store = store
+
+
+def cached_reply(message_sid: str, now: float = None, durable: bool = True) -> Optional[str]:
+    """Return the rendered response already sent for this message, or None
+
+    durable=False only looks at the responses this process remembers in memory.
+    """
+    if not message_sid:
+        return None
+    return reply_store().get(message_sid, now, durable)
+
+
+def remember_reply(message_sid: str, response: str, now: float = None, durable: bool = True) -> None:
+    """Remember the rendered response to a processed message; expired responses are purged along the way"""
+    if not message_sid:
+        return
+    try:
+        reply_store().remember(message_sid, response, now, durable)
+    except Exception as e:
+        logger.error(f"Error remembering the response to {message_sid}: {e}")
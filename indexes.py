@@ -0,0 +1,320 @@
+import sys
+import json
+import base64
+import logging
+import threading
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import game_data
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+_attach_lock = threading.Lock()
+
+
+class SecondaryIndex:
+    """Index from values derived from each entry back to the entry keys
+
+    Kept up to date by the section it is added to whenever an entry is added,
+    changed or deleted, so lookups never scan the section.
+    """
+
+    # Entry fields the index reads, None for whole entries
+    fields: Optional[Tuple[str, ...]] = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Legacy data may map the same value to several entries, hence sets
+        self._entries: Dict[str, Set[str]] = {}
+        self._values: Dict[str, List[str]] = {}
+
+    def _index_values(self, value: Dict[str, Any]) -> List[str]:
+        """Return the indexed values of an entry"""
+        raise NotImplementedError
+
+    def _add(self, key: str, value: Dict[str, Any]) -> None:
+        indexed = self._index_values(value)
+        self._values[key] = indexed
+        for indexed_value in indexed:
+            self._entries.setdefault(indexed_value, set()).add(key)
+
+    def _remove(self, key: str) -> None:
+        for indexed_value in self._values.pop(key, ()):
+            keys = self._entries[indexed_value]
+            keys.discard(key)
+            if not keys:
+                del self._entries[indexed_value]
+
+    def rebuild(self, entries: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        with self._lock:
+            self._entries, self._values = {}, {}
+            for key, value in entries:
+                self._add(key, value)
+        logger.info(f"{type(self).__name__} built for {len(self._values)} entries")
+
+    def update(self, key: str, value: Optional[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._remove(key)
+            if value is not None:
+                self._add(key, value)
+
+    def _lookup(self, indexed_value: str) -> Optional[str]:
+        with self._lock:
+            keys = self._entries.get(indexed_value)
+            return min(keys) if keys else None
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+
+class UsernameIndex(SecondaryIndex):
+    """Case-folded username -> phone"""
+
+    fields = ("username",)
+
+    def _index_values(self, player: Dict[str, Any]) -> List[str]:
+        return [player["username"].casefold()]
+
+    def lookup(self, username: str) -> Optional[str]:
+        """Return the phone of the player with this username (case-insensitive), or None"""
+        return self._lookup(username.casefold())
+
+
+class BattleIndex(SecondaryIndex):
+    """Player phone -> id of the active battle the player is in"""
+
+    def _index_values(self, battle: Dict[str, Any]) -> List[str]:
+        return list(battle.get("players", []))
+
+    def lookup(self, phone: str) -> Optional[str]:
+        """Return the id of the player's active battle, or None"""
+        return self._lookup(phone)
+
+
+class EntryVersions:
+    """Version number of every entry, bumped whenever the section reports the entry changed
+
+    Versions come from one counter, so they only ever increase, also across
+    deleting and re-creating an entry. Entries unchanged since startup are at 0.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {}
+        self._counter = 0
+
+    def update(self, key: str, value: Optional[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._counter += 1
+            self._versions[key] = self._counter
+
+    def version(self, key: str) -> int:
+        return self._versions.get(key, 0)
+
+
+_RANK_ORDER = {rank: index for index, rank in enumerate(game_data.RANKS)}
+
+
+def _number(value: Any) -> float:
+    # Legacy records may hold anything, sort values must stay comparable
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+# Orders of the player listing, by the value each sorts players on (ties go by phone)
+PLAYER_SORTS: Dict[str, Callable[[Dict[str, Any]], float]] = {
+    "level": lambda player: _number(player.get("level")),
+    "rank": lambda player: _RANK_ORDER.get(player.get("rank"), -1),
+    "gold": lambda player: _number(player.get("gold")),
+    "created": lambda player: _number(player.get("created_at"))
+}
+
+# Fields the player listing can be filtered on
+PLAYER_FILTERS = ("race", "class", "element", "rank", "in_battle", "is_deity")
+
+# Filter values matching most players, served by scanning the full order instead
+_UNSELECTIVE = {("in_battle", "false"), ("is_deity", "false")}
+
+_SORT_NAMES = tuple(PLAYER_SORTS)
+
+
+def filter_value(value: Any) -> str:
+    """Normalize a field value or filter argument, so 'elf' matches Elf and 'true' matches True"""
+    if isinstance(value, str):
+        return value.casefold()
+    return str(False if value is None else value).casefold()
+
+
+class PlayerListingIndex:
+    """Players kept sorted by every listing order, overall and per filter value
+
+    A page starts with a binary search for the cursor and then walks the
+    smallest sorted list matching one of the filters, checking the others, so
+    it costs O(log n + page size) unless the remaining filters are rare.
+    Filter values that match nearly everyone (not in battle, not a deity) are
+    checked while walking the full order rather than kept as lists of their own.
+    Per player it keeps one (sort value, phone) tuple per order, shared by all
+    lists, and a tuple of interned filter values.
+    """
+
+    fields = ("level", "rank", "gold", "created_at") + PLAYER_FILTERS
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Filter group -> sort -> sorted (sort value, phone); group None holds every player
+        self._orders: Dict[Optional[Tuple[str, str]], Dict[str, List[Tuple[float, str]]]] = {}
+        # phone -> (sort entries in _SORT_NAMES order, filter values in PLAYER_FILTERS order)
+        self._players: Dict[str, Tuple[Tuple[Tuple[float, str], ...], Tuple[str, ...]]] = {}
+
+    @staticmethod
+    def _keys(phone: str, player: Dict[str, Any]) -> Tuple[Tuple[Tuple[float, str], ...], Tuple[str, ...]]:
+        sort_entries = tuple((key(player), phone) for key in PLAYER_SORTS.values())
+        # A handful of distinct values, interned so players share them
+        filters = tuple(sys.intern(filter_value(player.get(field))) for field in PLAYER_FILTERS)
+        return sort_entries, filters
+
+    @staticmethod
+    def _groups(filters: Tuple[str, ...]) -> List[Optional[Tuple[str, str]]]:
+        return [None] + [group for group in zip(PLAYER_FILTERS, filters) if group not in _UNSELECTIVE]
+
+    def _orders_of(self, group: Optional[Tuple[str, str]]) -> Dict[str, List[Tuple[float, str]]]:
+        orders = self._orders.get(group)
+        if orders is None:
+            orders = self._orders[group] = {name: [] for name in PLAYER_SORTS}
+        return orders
+
+    def rebuild(self, entries: Iterable[Tuple[str, Dict[str, Any]]]) -> None:
+        with self._lock:
+            self._orders, self._players = {}, {}
+            groups = {}
+            for phone, player in entries:
+                self._players[phone] = self._keys(phone, player)
+                groups[phone] = [self._orders_of(group) for group in self._groups(self._players[phone][1])]
+            # Sort each order once, splitting it by group keeps every group's list sorted too
+            for position, name in enumerate(_SORT_NAMES):
+                for entry in sorted(sort_entries[position] for sort_entries, _ in self._players.values()):
+                    for orders in groups[entry[1]]:
+                        orders[name].append(entry)
+        logger.info(f"{type(self).__name__} built for {len(self._players)} entries")
+
+    def update(self, phone: str, player: Optional[Dict[str, Any]]) -> None:
+        with self._lock:
+            old_sorts, old_filters = self._players.pop(phone, ((), ()))
+            new_sorts, new_filters = self._keys(phone, player) if player is not None else ((), ())
+            old_groups = set(self._groups(old_filters)) if old_filters else set()
+            new_groups = set(self._groups(new_filters)) if new_filters else set()
+
+            # Only touch the lists whose entry actually moved, a gold change leaves level and rank alone
+            for group in old_groups | new_groups:
+                orders = self._orders_of(group)
+                for position, name in enumerate(_SORT_NAMES):
+                    old_entry = old_sorts[position] if group in old_groups else None
+                    new_entry = new_sorts[position] if group in new_groups else None
+                    if old_entry == new_entry:
+                        continue
+                    entries = orders[name]
+                    if old_entry is not None:
+                        del entries[bisect_left(entries, old_entry)]
+                    if new_entry is not None:
+                        insort(entries, new_entry)
+                if group is not None and not orders[_SORT_NAMES[0]]:
+                    del self._orders[group]
+
+            if player is not None:
+                self._players[phone] = (new_sorts, new_filters)
+
+    def page(self, sort: str = "created", descending: bool = False, filters: Dict[str, str] = None,
+             after: Tuple[float, str] = None, limit: int = 50) -> Tuple[List[str], Optional[Tuple[float, str]], Optional[int]]:
+        """Return (phones, cursor of the next page or None, total matches if known cheaply)
+
+        after is the cursor returned with the previous page.
+        """
+        filters = {field: filter_value(value) for field, value in (filters or {}).items()}
+        checks = [(PLAYER_FILTERS.index(field), value) for field, value in filters.items()]
+        with self._lock:
+            candidates = [self._orders.get(group, {}).get(sort, []) for group in filters.items()
+                          if group not in _UNSELECTIVE]
+            entries = min(candidates, key=len) if candidates else self._orders_of(None)[sort]
+            total = len(entries) if len(candidates) == len(filters) <= 1 else None
+
+            if descending:
+                position = bisect_left(entries, after) - 1 if after else len(entries) - 1
+                step = -1
+            else:
+                position = bisect_right(entries, after) if after else 0
+                step = 1
+
+            phones = []
+            last = None
+            while 0 <= position < len(entries) and len(phones) < limit:
+                entry = entries[position]
+                position += step
+                values = self._players[entry[1]][1]
+                if all(values[index] == value for index, value in checks):
+                    phones.append(entry[1])
+                    last = entry
+            more = 0 <= position < len(entries)
+            return phones, (last if more and last else None), total
+
+    def __len__(self) -> int:
+        return len(self._players)
+
+
+def encode_cursor(entry: Tuple[float, str]) -> str:
+    """Opaque, URL-safe form of a listing position"""
+    return base64.urlsafe_b64encode(json.dumps(list(entry)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    """Parse a cursor from encode_cursor, raising ValueError if it is malformed"""
+    try:
+        value, phone = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(value, (int, float)) or not isinstance(phone, str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return value, phone
+
+
+def _attached_index(section, attribute: str, factory: Callable[[], Any], rebuild: bool = True) -> Any:
+    index = getattr(section, attribute, None)
+    if index is None:
+        with _attach_lock:
+            index = getattr(section, attribute, None)
+            if index is None:
+                index = factory()
+                section.add_index(index, rebuild=rebuild)
+                setattr(section, attribute, index)
+    return index
+
+
+def username_index(game_state: Dict) -> UsernameIndex:
+    """Return the username index of the players section, building it on first use"""
+    return _attached_index(game_state["players"], "username_index", UsernameIndex)
+
+
+def battle_index(game_state: Dict) -> BattleIndex:
+    """Return the player index of the active battles section, building it on first use"""
+    return _attached_index(game_state["active_battles"], "battle_index", BattleIndex)
+
+
+def player_versions(game_state: Dict) -> EntryVersions:
+    """Return the version numbers of the players section, tracking them from first use"""
+    # Versions only need to differ after a change, so existing entries are never read
+    return _attached_index(game_state["players"], "player_versions", EntryVersions, rebuild=False)
+
+
+def player_listing(game_state: Dict) -> PlayerListingIndex:
+    """Return the sorted player listing index, building it on first use"""
+    return _attached_index(game_state["players"], "player_listing", PlayerListingIndex)
+
+
+def find_player_by_username(username: str, game_state: Dict) -> Optional[str]:
+    """Return the phone of the player with this username (case-insensitive), or None"""
+    return username_index(game_state).lookup(username)
+
+
+def find_battle_id(phone: str, game_state: Dict) -> Optional[str]:
+    """Return the id of the active battle a player is in, or None"""
+    return battle_index(game_state).lookup(phone)
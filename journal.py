@@ -0,0 +1,82 @@
+import os
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, List
+
+from state_tracking import Change, apply_change
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Journal file holding the changes made since the last snapshot
+JOURNAL_FILE = os.environ.get("GAME_JOURNAL_FILE", "game_state.journal")
+
+# Serializes appends and compaction so no record is lost while the journal is truncated
+_journal_lock = threading.Lock()
+
+
+def _encode_change(name: str, key: str, payload) -> str:
+    """Encode a change as one journal line (payloads are already JSON)"""
+    if payload is None:
+        return f'{{"s":{json.dumps(name)},"k":{json.dumps(key)},"d":1}}\n'
+    return f'{{"s":{json.dumps(name)},"k":{json.dumps(key)},"v":{payload}}}\n'
+
+
+def append_changes(changes: List[Change], path: str = JOURNAL_FILE) -> int:
+    """Append change records to the journal and fsync them, returning the record count"""
+    if not changes:
+        return 0
+
+    data = "".join(_encode_change(name, key, payload) for name, key, payload in changes)
+    with _journal_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    return len(changes)
+
+
+def replay_journal(game_state: Dict[str, Any], path: str = JOURNAL_FILE) -> int:
+    """Apply every journal record on top of a loaded snapshot, returning the record count"""
+    if not os.path.exists(path):
+        return 0
+
+    count = 0
+    with open(path, "rb") as f:
+        end = 0
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                end += len(line)
+                continue
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("incomplete line")
+                record = json.loads(line)
+            except ValueError:
+                # A crash during an append can leave a torn last line behind; cut it off
+                # so the next append starts on a line of its own
+                logger.warning(f"Ignoring unreadable journal record at line {line_number}")
+                with _journal_lock:
+                    os.truncate(path, end)
+                break
+            end += len(line)
+            apply_change(game_state, record["s"], record["k"], record.get("v"), deleted="d" in record)
+            count += 1
+
+    logger.info(f"Replayed {count} journal records")
+    return count
+
+
+def compact_journal(write_snapshot: Callable[[], Any], path: str = JOURNAL_FILE) -> None:
+    """Write a fresh snapshot and truncate the journal it supersedes
+
+    Records are full values of the touched entries, so replaying a journal that
+    survived a crash between the two steps on top of the new snapshot is harmless.
+    """
+    with _journal_lock:
+        write_snapshot()
+        with open(path, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+    logger.info("Journal compacted into a new snapshot")
@@ -0,0 +1,101 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+
+class KeyedLocks:
+    """One lock per key, created on demand and dropped when nobody holds or waits for it
+
+    Keys are always acquired in sorted order, so two commands that need
+    overlapping sets of keys can never deadlock.
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        # key -> [lock, number of threads holding or waiting for it]
+        self._locks: Dict[str, list] = {}
+
+    def _checkout(self, key: str) -> threading.Lock:
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _checkin(self, key: str) -> None:
+        with self._guard:
+            entry = self._locks[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    @contextmanager
+    def hold(self, keys: Iterable[str]):
+        """Hold the locks of all keys for the duration of the block"""
+        ordered: List[str] = sorted(set(keys))
+        acquired = []
+        try:
+            for key in ordered:
+                lock = self._checkout(key)
+                try:
+                    lock.acquire()
+                except BaseException:
+                    self._checkin(key)
+                    raise
+                acquired.append((key, lock))
+            yield
+        finally:
+            for key, lock in reversed(acquired):
+                lock.release()
+                self._checkin(key)
+
+
+class SharedExclusiveLock:
+    """Readers-writer lock: many commands share the state, whole-state operations are exclusive
+
+    Writers are preferred so a steady stream of commands cannot starve a snapshot.
+    Not reentrant.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def shared(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+# Held shared by every command and exclusively while the whole state is serialized
+state_lock = SharedExclusiveLock()
+
+# Per-player (and per-resource) locks taken by commands
+player_locks = KeyedLocks()
@@ -0,0 +1,218 @@
+"""
+Offline maintenance for the RPG WhatsApp Bot game state
+Run only while the server is stopped: python manage_state.py <command> [options]
+"""
+import os
+import sys
+import argparse
+from collections.abc import Mapping
+from typing import Any, Dict
+
+import utils
+import record_store
+from journal import JOURNAL_FILE, replay_journal, compact_journal, append_changes
+from snapshot_codecs import CODECS, detect_codec
+from state_tracking import track_sections, collect_changes, encode_record, persist_external
+from shared_store import SharedStore, SHARED_STATE_DB
+from player_store import PlayerStore, PLAYER_STORE_DIR
+
+def load_state(args) -> Dict[str, Any]:
+    """Load the game state from the shared database, a records directory or a snapshot plus its journal"""
+    if args.shared:
+        args.shared_store = SharedStore(args.shared)
+        game_state = utils.new_game_state()
+        game_state.update(args.shared_store.load())
+        # The server ignores player stores in shared mode, players are records like the rest
+        return track_sections(game_state)
+
+    if args.records:
+        game_state = record_store.load_records(args.records)
+    else:
+        if os.path.exists(args.state):
+            game_state = utils.read_snapshot(args.state)
+        else:
+            print(f"No snapshot at {args.state}, starting from an empty state")
+            game_state = utils.new_game_state()
+        if os.path.exists(args.journal):
+            print(f"Replayed {replay_journal(game_state, args.journal)} journal records")
+    return attach_player_store(args, track_sections(game_state))
+
+def attach_player_store(args, game_state: Dict[str, Any]) -> Dict[str, Any]:
+    """Read players from the indexed player store once the server has imported them there"""
+    if args.player_store == "indexed" and os.path.isdir(args.players_dir):
+        store = PlayerStore(directory=args.players_dir)
+        if len(store) or not game_state.get("players"):
+            game_state["players"] = store
+    return game_state
+
+def save_changes(args, game_state: Dict[str, Any]) -> int:
+    """Write the entries modified by a maintenance command back where they came from"""
+    changes = collect_changes(game_state)
+    if not changes:
+        return 0
+    if args.shared:
+        if not args.shared_store.commit(game_state, changes):
+            sys.exit("The shared state changed while it was being repaired, stop every worker and retry")
+        return len(changes)
+
+    # Players in the indexed store are written to it, the rest to the game state files
+    file_changes = persist_external(game_state, changes)
+    if not file_changes:
+        return len(changes)
+    if args.records:
+        record_store.write_changes(file_changes, args.records)
+    elif os.path.exists(args.journal) and os.path.getsize(args.journal) > 0:
+        append_changes(file_changes, args.journal)
+    else:
+        codec = utils.SNAPSHOT_CODEC
+        if os.path.exists(args.state):
+            with open(args.state, "rb") as f:
+                codec = detect_codec(f.read(16)).name
+        utils.write_snapshot(game_state, path=args.state, codec=codec)
+    return len(changes)
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def report(args) -> int:
+    """Print the serialized size of each section and the largest players and battles"""
+    game_state = load_state(args)
+
+    print("\nSECTIONS:")
+    for name, section in game_state.items():
+        count = len(section) if isinstance(section, Mapping) else 1
+        # items() reads a player store without caching every player
+        encoded = encode_record(dict(section.items()) if isinstance(section, Mapping) else section)
+        print(f"- {name}: {count} entries, {format_size(len(encoded))}")
+
+    battle_log_bytes = {}
+    for battle_id, battle in game_state.get("active_battles", {}).items():
+        log_bytes = len(encode_record(battle.get("logs", [])))
+        for phone in battle.get("players", []):
+            battle_log_bytes[phone] = battle_log_bytes.get(phone, 0) + log_bytes
+
+    players = []
+    for phone, player in game_state.get("players", {}).items():
+        players.append((
+            len(encode_record(player)),
+            len(encode_record(player.get("inventory", []))),
+            battle_log_bytes.get(phone, 0),
+            phone,
+            player.get("username", "?")
+        ))
+    players.sort(reverse=True)
+
+    print(f"\nLARGEST PLAYERS (top {args.top}):")
+    for total, inventory, logs, phone, username in players[:args.top]:
+        print(f"- {username} ({phone}): {format_size(total)} total, "
+              f"{format_size(inventory)} inventory, {format_size(logs)} battle logs")
+
+    if args.shared:
+        print(f"\nShared database {args.shared}: {format_size(os.path.getsize(args.shared))}")
+    elif os.path.exists(args.journal):
+        print(f"\nJournal {args.journal}: {format_size(os.path.getsize(args.journal))}")
+    return 0
+
+def compact(args) -> int:
+    """Fold the journal into a fresh snapshot"""
+    if args.records or args.shared:
+        print("Records directories and shared databases have no journal to compact")
+        return 1
+    game_state = load_state(args)
+    codec = args.codec or utils.SNAPSHOT_CODEC
+    compact_journal(lambda: utils.write_snapshot(game_state, path=args.state, codec=codec), args.journal)
+    print(f"Wrote {args.state} ({codec}) and truncated {args.journal}")
+    return 0
+
+def repair(args) -> int:
+    """Drop dead battles and orphaned in_battle flags"""
+    game_state = load_state(args)
+    players = game_state.get("players", {})
+    battles = game_state.get("active_battles", {})
+
+    dead_battles = 0
+    for battle_id, battle in list(battles.items()):
+        battle_players = battle.get("players", [])
+        if len(battle_players) != 2 or any(phone not in players for phone in battle_players):
+            del battles[battle_id]
+            dead_battles += 1
+
+    battling = {phone for battle in battles.values() for phone in battle["players"]}
+    orphaned = 0
+    for phone, player in list(players.items()):
+        if player.get("in_battle") and phone not in battling:
+            players[phone]["in_battle"] = False
+            orphaned += 1
+        elif not player.get("in_battle") and phone in battling:
+            players[phone]["in_battle"] = True
+
+    if args.reap_stale:
+        from game_logic import reap_stale_battles
+        print(f"Archived {reap_stale_battles(game_state)} abandoned battles")
+
+    written = 0 if args.dry_run else save_changes(args, game_state)
+    if args.reap_stale and not args.dry_run:
+        from battle_archive import write_archived
+        write_archived()
+    print(f"Removed {dead_battles} dead battles, cleared {orphaned} orphaned in_battle flags, "
+          f"wrote {written} entries{' (dry run)' if args.dry_run else ''}")
+    return 0
+
+def convert(args) -> int:
+    """Rewrite the state as a snapshot in another codec"""
+    if args.shared and not args.output:
+        print("Shared databases have no snapshot to convert, pass --output to export one")
+        return 1
+    game_state = load_state(args)
+    output = args.output or args.state
+    utils.write_snapshot(game_state, path=output, codec=args.to)
+    if output == args.state and os.path.exists(args.journal) and not args.records:
+        # The new snapshot already contains the journal tail
+        open(args.journal, "w").close()
+    print(f"Wrote {output} ({args.to}, {format_size(os.path.getsize(output))})")
+    return 0
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(description="Offline maintenance for the game state")
+    parser.add_argument("--state", default=utils.GAME_STATE_FILE, help="snapshot file")
+    parser.add_argument("--journal", default=JOURNAL_FILE, help="journal file")
+    parser.add_argument("--records", help="records directory (instead of snapshot + journal)")
+    parser.add_argument("--shared", default=SHARED_STATE_DB if utils.PERSISTENCE_MODE == "shared" else None,
+                        help="shared SQLite database (instead of snapshot + journal)")
+    parser.add_argument("--player-store", choices=["memory", "indexed", "sql"],
+                        default=os.environ.get("GAME_PLAYER_STORE", "memory"), help="where the server keeps players")
+    parser.add_argument("--players-dir", default=PLAYER_STORE_DIR, help="indexed player store directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = subparsers.add_parser("report", help="size per section and per player")
+    report_parser.add_argument("--top", type=int, default=10)
+    report_parser.set_defaults(handler=report)
+
+    compact_parser = subparsers.add_parser("compact", help="fold the journal into a snapshot")
+    compact_parser.add_argument("--codec", choices=list(CODECS))
+    compact_parser.set_defaults(handler=compact)
+
+    repair_parser = subparsers.add_parser("repair", help="drop dead battles and orphaned in_battle flags")
+    repair_parser.add_argument("--reap-stale", action="store_true", help="also archive abandoned battles")
+    repair_parser.add_argument("--dry-run", action="store_true")
+    repair_parser.set_defaults(handler=repair)
+
+    convert_parser = subparsers.add_parser("convert", help="rewrite the snapshot with another codec")
+    convert_parser.add_argument("--to", required=True, choices=list(CODECS))
+    convert_parser.add_argument("--output", help="output file (defaults to --state)")
+    convert_parser.set_defaults(handler=convert)
+
+    args = parser.parse_args(argv)
+    if args.player_store == "sql" and not args.shared:
+        # The Player tables are only reachable through the Flask app, which starts the server
+        print("The SQL player store is not supported: its tables are only reachable through the app, "
+              "so every command would run without the players")
+        return 2
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -39,7 +39,42 @@ class Player(db.Model):
     endurance = db.Column(db.Integer, default=0)
     rank = db.Column(db.String(2), default="G")
     is_deity = db.Column(db.Boolean, default=False)
+    in_battle = db.Column(db.Boolean, default=False)
+    extra = db.Column(db.JSON, default=dict)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    inventory_items = db.relationship("PlayerItem", cascade="all, delete-orphan", order_by="PlayerItem.position")
+    skills = db.relationship("PlayerSkill", cascade="all, delete-orphan", order_by="PlayerSkill.position")
+    equipped_items = db.relationship("PlayerEquipment", cascade="all, delete-orphan")
+    
     def __repr__(self):
         return f"<Player {self.username} (Lvl {self.level} {self.race} {self.character_class})>"
+
+class PlayerItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    player_id = db.Column(db.Integer, db.ForeignKey("player.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(120), nullable=False)
+    
+    def __repr__(self):
+        return f"<PlayerItem {self.name}>"
+
+class PlayerSkill(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    player_id = db.Column(db.Integer, db.ForeignKey("player.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(64), nullable=False)
+    
+    def __repr__(self):
+        return f"<PlayerSkill {self.name}>"
+
+class PlayerEquipment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    player_id = db.Column(db.Integer, db.ForeignKey("player.id", ondelete="CASCADE"), nullable=False, index=True)
+    slot = db.Column(db.String(32), nullable=False)
+    item_name = db.Column(db.String(120), nullable=False)
+    
+    __table_args__ = (db.UniqueConstraint("player_id", "slot"),)
+    
+    def __repr__(self):
+        return f"<PlayerEquipment {self.slot}: {self.item_name}>"
@@ -0,0 +1,266 @@
+import os
+import time
+import atexit
+import random
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# SQLite database holding messages waiting to be delivered
+OUTBOUND_SPOOL_DB = os.environ.get("GAME_OUTBOUND_SPOOL_DB", "outbound_spool.db")
+
+# SQLite synchronous level: FULL survives power loss, NORMAL only process crashes
+OUTBOUND_SYNCHRONOUS = os.environ.get("GAME_OUTBOUND_SYNCHRONOUS", "FULL")
+
+# Messages sent at the same time at most (keep within the pooled Twilio connections)
+OUTBOUND_WORKERS = int(os.environ.get("GAME_OUTBOUND_WORKERS", "16"))
+
+# Messages claimed from the spool per round trip
+OUTBOUND_BATCH = int(os.environ.get("GAME_OUTBOUND_BATCH", "50"))
+
+# Attempts before a message is dead-lettered
+OUTBOUND_MAX_ATTEMPTS = int(os.environ.get("GAME_OUTBOUND_MAX_ATTEMPTS", "8"))
+
+# Retry delay in seconds: base * 2^(attempts - 1), capped, with jitter
+OUTBOUND_BACKOFF_BASE = float(os.environ.get("GAME_OUTBOUND_BACKOFF_BASE", "2"))
+OUTBOUND_BACKOFF_MAX = float(os.environ.get("GAME_OUTBOUND_BACKOFF_MAX", "300"))
+
+# Seconds a claimed message stays reserved, after which another worker may retry it
+OUTBOUND_LEASE = float(os.environ.get("GAME_OUTBOUND_LEASE", "60"))
+
+# Seconds between polls of an idle spool (new messages wake the worker at once)
+OUTBOUND_POLL_INTERVAL = float(os.environ.get("GAME_OUTBOUND_POLL_INTERVAL", "1"))
+
+# Delivery latencies kept for the metrics
+_LATENCY_SAMPLES = 1000
+
+
+def permanent_failure(error: Exception) -> bool:
+    """Client errors other than rate limiting will fail the same way on every retry"""
+    status = getattr(error, "status", None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+
+class OutboundSpool:
+    """Durable queue of outbound messages delivered by a background thread
+
+    enqueue only writes the message to a SQLite database (WAL mode) and returns.
+    The delivery thread claims due messages in batches, sends them on a bounded
+    thread pool and records every outcome in one transaction per batch. Failed
+    sends are retried with exponential backoff; messages that fail permanently
+    or too often are kept as dead letters. Each phone's messages are delivered
+    in the order they were enqueued: only a phone's oldest pending message can
+    be claimed, so a later one never overtakes one in flight or waiting for a
+    retry (a dead letter no longer holds the rest back). Claims are leases, so several
+    processes can share one spool and messages claimed by a crashed process are
+    picked up again once the lease runs out.
+    """
+
+    def __init__(self, deliver: Callable[[str, str], Any], path: str = None, workers: int = OUTBOUND_WORKERS,
+                 batch_size: int = OUTBOUND_BATCH, max_attempts: int = OUTBOUND_MAX_ATTEMPTS):
+        self.path = path or OUTBOUND_SPOOL_DB
+        self._deliver = deliver
+        self._batch_size = batch_size
+        self._max_attempts = max_attempts
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="outbound-spool", daemon=True)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbound")
+
+        self._metrics_lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=_LATENCY_SAMPLES)
+        self.delivered = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                phone TEXT NOT NULL,
+                body TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                claimed_until REAL NOT NULL DEFAULT 0,
+                last_error TEXT,
+                dead_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS outbox_due ON outbox (dead_at, next_attempt_at);
+            CREATE INDEX IF NOT EXISTS outbox_pending_by_phone ON outbox (phone, id) WHERE dead_at IS NULL;
+        """)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection (sqlite3 connections are not shared between threads)"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute(f"PRAGMA synchronous={OUTBOUND_SYNCHRONOUS}")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def start(self) -> "OutboundSpool":
+        self._thread.start()
+        return self
+
+    def install_shutdown_hooks(self) -> None:
+        """Finish the sends in flight on interpreter exit, the rest stays spooled"""
+        atexit.register(self.stop)
+
+    def enqueue(self, phone: str, message: str) -> None:
+        """Spool a message for delivery and return at once"""
+        self.enqueue_many([phone], message)
+
+    def enqueue_many(self, phones: List[str], message: str) -> int:
+        """Spool the same message for several recipients in one transaction"""
+        now = time.time()
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT INTO outbox (phone, body, enqueued_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+                [(phone, message, now, now) for phone in phones]
+            )
+        self._wake.set()
+        return len(phones)
+
+    def _claim(self) -> List[Tuple[int, str, str, float, int]]:
+        """Reserve a batch of due messages for this worker, at most one per phone"""
+        now = time.time()
+        with self._transaction() as connection:
+            # Only the oldest pending message of a phone, so its messages arrive in order
+            rows = connection.execute(
+                "SELECT id, phone, body, enqueued_at, attempts FROM outbox AS message "
+                "WHERE dead_at IS NULL AND next_attempt_at <= ? AND claimed_until <= ? "
+                "AND NOT EXISTS (SELECT 1 FROM outbox AS earlier WHERE earlier.phone = message.phone "
+                "AND earlier.dead_at IS NULL AND earlier.id < message.id) "
+                "ORDER BY id LIMIT ?", (now, now, self._batch_size)
+            ).fetchall()
+            connection.executemany("UPDATE outbox SET claimed_until = ? WHERE id = ?",
+                                   [(now + OUTBOUND_LEASE, row[0]) for row in rows])
+        return rows
+
+    def _send(self, row: Tuple[int, str, str, float, int]) -> Optional[Exception]:
+        try:
+            self._deliver(row[1], row[2])
+            return None
+        except Exception as e:
+            return e
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(OUTBOUND_BACKOFF_MAX, OUTBOUND_BACKOFF_BASE * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def deliver_batch(self) -> int:
+        """Claim and send one batch of due messages, returning how many were claimed"""
+        rows = self._claim()
+        if not rows:
+            return 0
+
+        errors = list(self._pool.map(self._send, rows))
+        now = time.time()
+        delivered, retries, dead = [], [], []
+        for row, error in zip(rows, errors):
+            message_id, phone, _, enqueued_at, attempts = row
+            attempts += 1
+            if error is None:
+                delivered.append((message_id,))
+                with self._metrics_lock:
+                    self._latencies.append(now - enqueued_at)
+            elif attempts >= self._max_attempts or permanent_failure(error):
+                logger.error(f"Dead-lettering message {message_id} to {phone} after {attempts} attempts: {error}")
+                dead.append((attempts, str(error), now, message_id))
+            else:
+                logger.warning(f"Delivery of message {message_id} to {phone} failed (attempt {attempts}): {error}")
+                retries.append((attempts, str(error), now + self._backoff(attempts), message_id))
+
+        with self._transaction() as connection:
+            connection.executemany("DELETE FROM outbox WHERE id = ?", delivered)
+            connection.executemany(
+                "UPDATE outbox SET attempts = ?, last_error = ?, next_attempt_at = ?, claimed_until = 0 WHERE id = ?",
+                retries
+            )
+            connection.executemany(
+                "UPDATE outbox SET attempts = ?, last_error = ?, dead_at = ?, claimed_until = 0 WHERE id = ?", dead
+            )
+        with self._metrics_lock:
+            self.delivered += len(delivered)
+            self.retried += len(retries)
+            self.dead_lettered += len(dead)
+        return len(rows)
+
+    def _run(self) -> None:
+        while not self._stopping:
+            try:
+                if self.deliver_batch():
+                    continue
+            except Exception as e:
+                logger.error(f"Outbound spool error: {e}")
+            self._wake.wait(OUTBOUND_POLL_INTERVAL)
+            self._wake.clear()
+
+    def stop(self, timeout: float = None) -> None:
+        self._stopping = True
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        self._pool.shutdown(wait=True)
+
+    def dead_letters(self, limit: int = 100) -> List[Dict[str, Any]]:
+        rows = self._connection().execute(
+            "SELECT id, phone, body, attempts, last_error, enqueued_at, dead_at FROM outbox "
+            "WHERE dead_at IS NOT NULL ORDER BY dead_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        columns = ("id", "phone", "body", "attempts", "last_error", "enqueued_at", "dead_at")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def requeue_dead_letters(self) -> int:
+        """Give every dead letter a fresh set of attempts"""
+        with self._transaction() as connection:
+            count = connection.execute(
+                "UPDATE outbox SET dead_at = NULL, attempts = 0, next_attempt_at = ? WHERE dead_at IS NOT NULL",
+                (time.time(),)
+            ).rowcount
+        self._wake.set()
+        return count
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue depth, delivery counters and enqueue-to-delivery latency percentiles"""
+        depth, dead, oldest = self._connection().execute(
+            "SELECT COUNT(*) - COUNT(dead_at), COUNT(dead_at), MIN(CASE WHEN dead_at IS NULL THEN enqueued_at END) "
+            "FROM outbox"
+        ).fetchone()
+        with self._metrics_lock:
+            latencies = sorted(self._latencies)
+            counters = {"delivered": self.delivered, "retried": self.retried, "dead_lettered": self.dead_lettered}
+
+        def percentile(fraction: float) -> Optional[float]:
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] if latencies else None
+
+        return {
+            "depth": depth,
+            "dead_letters": dead,
+            "oldest_age": time.time() - oldest if oldest else 0.0,
+            **counters,
+            "latency_p50": percentile(0.50),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else None
+        }
@@ -0,0 +1,374 @@
+import os
+import json
+import mmap
+import logging
+import threading
+from urllib.parse import quote, unquote
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from atomic_file import atomic_write
+from state_tracking import ChangeTracker, MISSING, encode_record
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Directory holding the player data file and its phone -> offset index
+PLAYER_STORE_DIR = os.environ.get("GAME_PLAYER_DIR", "game_players")
+
+# Read player records through a memory map instead of positioned reads
+PLAYER_STORE_MMAP = os.environ.get("GAME_PLAYER_MMAP", "0") == "1"
+
+# Number of decoded players kept in memory before the least recently used ones are dropped
+PLAYER_CACHE_SIZE = int(os.environ.get("GAME_PLAYER_CACHE_SIZE", "10000"))
+
+# Superseded bytes tolerated in the data file before it is compacted
+COMPACT_MIN_DEAD_BYTES = int(os.environ.get("GAME_PLAYER_COMPACT_BYTES", str(64 * 1024 * 1024)))
+
+# Index lines are phone, offset and length, plus the (quoted) username so the username
+# index can be built without reading the data file
+INDEX_FILE = "players.idx"
+
+# The first index line names the data file, so compaction can switch files atomically
+DATA_HEADER = "#data"
+
+
+class PlayerStore(ChangeTracker, MutableMapping):
+    """Mapping of phone -> player backed by an append-only data file and an offset index
+
+    Opening the store only reads the index; a player record is read and decoded
+    the first time it is accessed and kept in an LRU cache. Updates append a new
+    record and a new index entry, so the per-save cost does not depend on the
+    number of players. Entries touched by a command or changed but not yet
+    persisted are never evicted.
+    """
+
+    external_storage = True
+
+    def __init__(self, directory: str = PLAYER_STORE_DIR, use_mmap: bool = PLAYER_STORE_MMAP,
+                 cache_size: int = PLAYER_CACHE_SIZE):
+        self._init_tracking()
+        self._directory = directory
+        self._index_path = os.path.join(directory, INDEX_FILE)
+        self._data_name = "players.0.dat"
+        self._use_mmap = use_mmap
+        self._map: Optional[mmap.mmap] = None
+        # phone -> (offset, length) of the latest record in the data file
+        self._index: Dict[str, Tuple[int, int]] = {}
+        # phone -> username of the latest record, missing for index lines written before usernames
+        self._usernames: Dict[str, str] = {}
+        self._cache_size = cache_size
+        # phone -> decoded player, or MISSING for deletions not yet persisted
+        self._materialized: "OrderedDict[str, Any]" = OrderedDict()
+        self._pins: Dict[str, int] = {}
+        # phone -> payload drained but not yet persisted
+        self._dirty: Dict[str, Optional[str]] = {}
+        self._dead_bytes = 0
+        self._lock = threading.RLock()
+
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self._index_path):
+            atomic_write(self._index_path, f"{DATA_HEADER}\t{self._data_name}\n".encode("utf-8"))
+        self._load_index()
+
+    @classmethod
+    def from_game_state(cls, players: Dict[str, Any], **kwargs) -> "PlayerStore":
+        """Open the store, importing the given players if it is empty"""
+        store = cls(**kwargs)
+        if players and not store._index:
+            store.persist([(phone, encode_record(player)) for phone, player in players.items()])
+            logger.info(f"Imported {len(players)} players into the indexed player store")
+        return store
+
+    def _load_index(self) -> None:
+        entry_count = 0
+        with open(self._index_path, "rb") as f:
+            header = f.readline().decode("utf-8").rstrip("\n").split("\t")
+            if len(header) == 2 and header[0] == DATA_HEADER:
+                self._data_name = header[1]
+            if not os.path.exists(self._data_path):
+                open(self._data_path, "ab").close()
+            self._fd = os.open(self._data_path, os.O_RDONLY)
+            data_size = os.path.getsize(self._data_path)
+
+            end = f.tell()
+            for raw in f:
+                entry_count += 1
+                line = raw.decode("utf-8", "replace")
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) not in (3, 4) or not line.endswith("\n"):
+                    # A crash during an append can leave a torn last line behind; cut it
+                    # off so the next append starts on a line of its own
+                    logger.warning("Ignoring unreadable player index entry")
+                    os.truncate(self._index_path, end)
+                    break
+                end += len(raw)
+                phone, offset, length = fields[0], int(fields[1]), int(fields[2])
+                if offset + length > data_size:
+                    # The record never fully reached the data file, the previous one stays current
+                    logger.warning(f"Ignoring player index entry past the end of {self._data_name}")
+                    continue
+                previous = self._index.pop(phone, None)
+                self._usernames.pop(phone, None)
+                if previous:
+                    self._dead_bytes += previous[1]
+                if length > 0:
+                    self._index[phone] = (offset, length)
+                    if len(fields) == 4:
+                        self._usernames[phone] = unquote(fields[3])
+        logger.info(f"Player index loaded with {len(self._index)} players")
+
+        # Keep the index small enough that opening the store stays cheap
+        if entry_count > 2 * len(self._index) + 1000:
+            self.compact()
+
+    @property
+    def _data_path(self) -> str:
+        return os.path.join(self._directory, self._data_name)
+
+    # Reading
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if not self._use_mmap:
+            return os.pread(self._fd, length, offset)
+        if self._map is None or offset + length > len(self._map):
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+        return self._map[offset:offset + length]
+
+    def _decode(self, phone: str) -> Any:
+        location = self._index.get(phone)
+        if location is None:
+            return MISSING
+        return json.loads(self._read(*location))
+
+    def _fetch(self, phone: str) -> Any:
+        with self._lock:
+            if phone in self._materialized:
+                self._materialized.move_to_end(phone)
+                return self._materialized[phone]
+            value = self._decode(phone)
+            if value is MISSING:
+                return MISSING
+            self._store(phone, value)
+            return value
+
+    def _evict(self) -> None:
+        if len(self._materialized) <= self._cache_size:
+            return
+        for phone in list(self._materialized):
+            if len(self._materialized) <= self._cache_size:
+                break
+            if phone not in self._pins and phone not in self._dirty:
+                del self._materialized[phone]
+
+    def _store(self, phone: str, value: Any) -> None:
+        with self._lock:
+            self._materialized[phone] = value
+            self._materialized.move_to_end(phone)
+            self._evict()
+
+    # Change tracking
+
+    def _peek(self, key) -> Any:
+        return self._fetch(key)
+
+    def _touch(self, key) -> None:
+        touched = self._touched()
+        if key not in touched:
+            with self._lock:
+                self._pins[key] = self._pins.get(key, 0) + 1
+            touched[key] = self._encoded(key)
+
+    def _unpin(self, keys) -> None:
+        with self._lock:
+            for key in keys:
+                remaining = self._pins.get(key, 0) - 1
+                if remaining > 0:
+                    self._pins[key] = remaining
+                else:
+                    self._pins.pop(key, None)
+            self._evict()
+
+    def drain(self) -> List[Tuple[str, Optional[str]]]:
+        keys = list(self._touched())
+        changed = super().drain()
+        with self._lock:
+            for key, payload in changed:
+                self._dirty[key] = payload
+        self._unpin(keys)
+        return changed
+
+    def discard(self) -> None:
+        keys = list(self._touched())
+        super().discard()
+        self._unpin(keys)
+
+    def _restore(self, key, value) -> None:
+        self._store(key, value)
+
+    # Writing
+
+    def persist(self, changes: List[Tuple[str, Optional[str]]]) -> None:
+        """Append changed records to the data file, then their entries to the index"""
+        with self._lock:
+            data_offset = os.path.getsize(self._data_path)
+            records = []
+            entries = []
+            locations = {}
+            usernames = {}
+            for phone, payload in changes:
+                if payload is None:
+                    entries.append(f"{phone}\t0\t0\n")
+                    locations[phone] = None
+                    continue
+                record = payload.encode("utf-8") + b"\n"
+                records.append(record)
+                usernames[phone] = json.loads(payload).get("username", "")
+                entries.append(f"{phone}\t{data_offset}\t{len(record) - 1}\t{quote(usernames[phone], safe='')}\n")
+                locations[phone] = (data_offset, len(record) - 1)
+                data_offset += len(record)
+
+            if records:
+                with open(self._data_path, "ab") as f:
+                    f.write(b"".join(records))
+                    f.flush()
+                    os.fsync(f.fileno())
+            with open(self._index_path, "a", encoding="utf-8") as f:
+                f.write("".join(entries))
+                f.flush()
+                os.fsync(f.fileno())
+
+            for phone, location in locations.items():
+                previous = self._index.pop(phone, None)
+                if previous:
+                    self._dead_bytes += previous[1]
+                if location is None:
+                    self._usernames.pop(phone, None)
+                    if self._materialized.get(phone) is MISSING:
+                        del self._materialized[phone]
+                else:
+                    self._index[phone] = location
+                    self._usernames[phone] = usernames[phone]
+
+            for phone, payload in changes:
+                # Keep the entry protected if it changed again after this batch was taken
+                if phone in self._dirty and self._dirty[phone] == payload:
+                    del self._dirty[phone]
+            self._evict()
+
+            if self._dead_bytes > COMPACT_MIN_DEAD_BYTES and self._dead_bytes > self.live_bytes():
+                self.compact()
+
+    def live_bytes(self) -> int:
+        """Return the number of data file bytes holding current records"""
+        return sum(length for _, length in self._index.values())
+
+    def compact(self) -> None:
+        """Rewrite the current records into a new data file and switch the index to it"""
+        with self._lock:
+            records = []
+            entries = []
+            index = {}
+            offset = 0
+            for phone, (old_offset, length) in self._index.items():
+                record = self._read(old_offset, length)
+                records.append(record + b"\n")
+                # Index lines written before usernames were stored get theirs now
+                if phone not in self._usernames:
+                    self._usernames[phone] = json.loads(record).get("username", "")
+                entries.append(f"{phone}\t{offset}\t{length}\t{quote(self._usernames[phone], safe='')}\n")
+                index[phone] = (offset, length)
+                offset += length + 1
+
+            old_data_path = self._data_path
+            generation = int(self._data_name.split(".")[1]) + 1
+            data_name = f"players.{generation}.dat"
+            atomic_write(os.path.join(self._directory, data_name), b"".join(records))
+            # Replacing the index is the commit point; until then the old files stay valid
+            atomic_write(self._index_path, (f"{DATA_HEADER}\t{data_name}\n" + "".join(entries)).encode("utf-8"))
+
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            os.close(self._fd)
+            os.unlink(old_data_path)
+            self._data_name = data_name
+            self._fd = os.open(self._data_path, os.O_RDONLY)
+            self._index = index
+            self._dead_bytes = 0
+        logger.info(f"Compacted player store to {offset} bytes")
+
+    # Mapping interface
+
+    def __getitem__(self, phone: str) -> Dict[str, Any]:
+        value = self._fetch(phone)
+        if value is MISSING:
+            raise KeyError(phone)
+        self._touch(phone)
+        return value
+
+    def __setitem__(self, phone: str, player: Dict[str, Any]) -> None:
+        self._touch(phone)
+        self._store(phone, player)
+
+    def __delitem__(self, phone: str) -> None:
+        if self._fetch(phone) is MISSING:
+            raise KeyError(phone)
+        self._touch(phone)
+        self._store(phone, MISSING)
+
+    def __contains__(self, phone) -> bool:
+        with self._lock:
+            if phone in self._materialized:
+                return self._materialized[phone] is not MISSING
+            return phone in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            phones = list(self._index)
+            phones.extend(phone for phone, value in self._materialized.items()
+                          if value is not MISSING and phone not in self._index)
+            deleted = {phone for phone, value in self._materialized.items() if value is MISSING}
+        return iter([phone for phone in phones if phone not in deleted])
+
+    def __len__(self) -> int:
+        with self._lock:
+            count = len(self._index)
+            for phone, value in self._materialized.items():
+                if value is MISSING and phone in self._index:
+                    count -= 1
+                elif value is not MISSING and phone not in self._index:
+                    count += 1
+            return count
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Iterate over every player without materializing or touching them"""
+        for phone in self:
+            with self._lock:
+                value = self._materialized.get(phone)
+                if value is None:
+                    value = self._decode(phone)
+            if value is not MISSING:
+                yield phone, value
+
+    def values(self) -> Iterator[Dict[str, Any]]:
+        for _, player in self.items():
+            yield player
+
+    def index_entries(self, fields=None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Stream players for an index build; usernames come from the offset index, not the data file"""
+        if fields is None or set(fields) - {"username"}:
+            yield from self.items()
+            return
+        for phone in self:
+            with self._lock:
+                value = self._materialized.get(phone)
+                username = self._usernames.get(phone)
+                if value is None and username is None:
+                    value = self._decode(phone)
+            if value is MISSING:
+                continue
+            yield phone, value if value is not None else {"username": username}
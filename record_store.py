@@ -0,0 +1,72 @@
+import os
+import json
+import zlib
+import logging
+from urllib.parse import quote, unquote
+from typing import Any, Dict, List
+
+from atomic_file import atomic_write
+from state_tracking import Change
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Directory holding one file per state entry
+GAME_STATE_DIR = os.environ.get("GAME_STATE_DIR", "game_state.d")
+
+# Number of shard directories per section, keeps directory listings small
+SHARD_COUNT = 256
+
+
+def record_path(name: str, key: str, root: str = GAME_STATE_DIR) -> str:
+    """Return the file path of a single state entry"""
+    shard = f"{zlib.crc32(key.encode('utf-8')) % SHARD_COUNT:02x}"
+    return os.path.join(root, quote(name, safe=""), shard, quote(key, safe="") + ".json")
+
+
+def write_changes(changes: List[Change], root: str = GAME_STATE_DIR) -> int:
+    """Write or delete the record file of every changed entry"""
+    for name, key, payload in changes:
+        path = record_path(name, key, root)
+        if payload is None:
+            if os.path.exists(path):
+                os.unlink(path)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, payload.encode("utf-8"))
+    return len(changes)
+
+
+def write_all(game_state: Dict[str, Any], root: str = GAME_STATE_DIR) -> int:
+    """Write every entry of the game state as its own record"""
+    changes = [
+        (name, key, json.dumps(value, separators=(",", ":")))
+        for name, section in game_state.items()
+        if isinstance(section, dict)
+        for key, value in section.items()
+    ]
+    for name in game_state:
+        os.makedirs(os.path.join(root, quote(name, safe="")), exist_ok=True)
+    return write_changes(changes, root)
+
+
+def load_records(root: str = GAME_STATE_DIR) -> Dict[str, Any]:
+    """Rebuild the game state from the per-entry record files"""
+    game_state = {}
+    for section_dir in sorted(os.listdir(root)):
+        section_path = os.path.join(root, section_dir)
+        if not os.path.isdir(section_path):
+            continue
+        section = game_state.setdefault(unquote(section_dir), {})
+        for shard in os.listdir(section_path):
+            shard_path = os.path.join(section_path, shard)
+            if not os.path.isdir(shard_path):
+                continue
+            for filename in os.listdir(shard_path):
+                if not filename.endswith(".json"):
+                    continue
+                with open(os.path.join(shard_path, filename), "r", encoding="utf-8") as f:
+                    section[unquote(filename[:-5])] = json.load(f)
+
+    logger.info(f"Loaded {sum(len(s) for s in game_state.values())} state records")
+    return game_state
@@ -0,0 +1,122 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Tuple
+
+from catalog import get_catalog
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Rendered player views kept by the view cache
+VIEW_CACHE_SIZE = int(os.environ.get("GAME_VIEW_CACHE_SIZE", "10000"))
+
+# Placeholder marking where a dynamic field goes in the text a template is built from
+FIELD = "\x00"
+
+
+class Template(NamedTuple):
+    """Response text split around its dynamic fields"""
+    fragments: Tuple[str, ...]
+
+    @classmethod
+    def compile(cls, text: str) -> "Template":
+        return cls(tuple(text.split(FIELD)))
+
+    def render(self, *values: Any) -> str:
+        """Splice the values in, in the order of the FIELD placeholders"""
+        fragments = self.fragments
+        if len(fragments) == 1:
+            return fragments[0]
+        if len(fragments) == 2:
+            return f"{fragments[0]}{values[0]}{fragments[1]}"
+        parts = [fragments[0]]
+        for value, fragment in zip(values, fragments[1:]):
+            parts.append(str(value))
+            parts.append(fragment)
+        return "".join(parts)
+
+
+_lock = threading.Lock()
+_templates: Dict[Tuple[str, Hashable], Template] = {}
+# Catalog version the cached templates were built from
+_templates_version = None
+
+
+def cached_template(name: str, key: Hashable, build: Callable[[], str]) -> Template:
+    """Return the template of a response, building it on first use
+
+    build returns the response text with FIELD where the dynamic values go; it
+    runs once per name and key until the catalog is reloaded.
+    """
+    global _templates_version
+    version = get_catalog().version
+    template = _templates.get((name, key)) if _templates_version == version else None
+    if template is None:
+        template = Template.compile(build())
+        with _lock:
+            if _templates_version != version:
+                logger.info(f"Catalog version {version}, dropping {len(_templates)} cached templates")
+                _templates.clear()
+                _templates_version = version
+            _templates[(name, key)] = template
+    return template
+
+
+def clear_templates() -> None:
+    """Drop every cached template"""
+    with _lock:
+        _templates.clear()
+
+
+class ViewCache:
+    """Size-bounded LRU of rendered responses
+
+    Keys must identify everything a response depends on, e.g. (view, phone,
+    player version), so entries never need invalidating and simply age out.
+    """
+
+    def __init__(self, max_entries: int = VIEW_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, render: Callable[[], str]) -> str:
+        """Return the cached response for key, rendering and caching it on a miss"""
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return text
+            self.misses += 1
+
+        text = render()
+        with self._lock:
+            self._entries[key] = text
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return text
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the hit and miss counters, for sizing the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+# Status, inventory and skills responses by (view, phone, player version)
+player_views = ViewCache()
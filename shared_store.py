@@ -0,0 +1,270 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+
+from state_tracking import Change, apply_change, encode_record, track_sections
+from locking import state_lock
+from idempotency import create_schema as create_reply_schema, write_replies
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# SQLite database shared by all worker processes in "shared" persistence mode
+SHARED_STATE_DB = os.environ.get("GAME_SHARED_STATE_DB", "game_state.db")
+
+# SQLite synchronous level: FULL makes every commit durable, NORMAL only survives process crashes
+SHARED_SYNCHRONOUS = os.environ.get("GAME_SHARED_SYNCHRONOUS", "FULL")
+
+# Seconds a worker waits for another worker's write transaction before giving up
+SHARED_BUSY_TIMEOUT = float(os.environ.get("GAME_SHARED_BUSY_TIMEOUT", "30"))
+
+
+class ConflictError(Exception):
+    """Raised when entries changed in another worker since this worker last read them"""
+
+
+class SharedStore:
+    """Game state records in a SQLite database (WAL mode) shared by several processes
+
+    Every entry is a row with a version number. A worker commits its changes only
+    if the versions it last saw are still current, otherwise the commit is refused
+    and the entries are reloaded, so the command can be retried on fresh data. Each
+    commit also takes the next value of a global sequence, which lets workers pull
+    exactly the rows changed since their last refresh. Deleted entries are kept as
+    rows without data so the deletion reaches the other workers.
+
+    Usernames are claimed in a table of their own, in the transaction that creates
+    the player, so two workers cannot register the same name under different phones.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or SHARED_STATE_DB
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (section, key) -> version this worker holds in memory
+        self._versions: Dict[Tuple[str, str], int] = {}
+        # Highest sequence number this worker has applied
+        self._seen_seq = 0
+        self.conflicts = 0
+
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS records (
+                section TEXT NOT NULL,
+                key TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                data TEXT,
+                PRIMARY KEY (section, key)
+            );
+            CREATE INDEX IF NOT EXISTS records_seq ON records (seq);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            INSERT OR IGNORE INTO meta (name, value) VALUES ('seq', 0);
+        """)
+        # Responses to processed messages, committed together with the changes of their command
+        create_reply_schema(connection)
+        # Case-folded username -> phone of the player holding it
+        connection.execute("CREATE TABLE IF NOT EXISTS usernames (username TEXT PRIMARY KEY, phone TEXT NOT NULL)")
+        self._claim_existing_usernames()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection (sqlite3 connections are not shared between threads)"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=SHARED_BUSY_TIMEOUT, isolation_level=None)
+            connection.execute(f"PRAGMA synchronous={SHARED_SYNCHRONOUS}")
+            self._local.connection = connection
+        return connection
+
+    def _apply_rows(self, game_state: Dict[str, Any], rows: Iterable[tuple], force: bool = False) -> int:
+        """Apply (section, key, version, data) rows newer than the versions held in memory"""
+        applied = 0
+        for section, key, version, data in rows:
+            if not force and self._versions.get((section, key), 0) >= version:
+                continue
+            apply_change(game_state, section, key, None if data is None else json.loads(data),
+                         deleted=data is None)
+            self._versions[(section, key)] = version
+            applied += 1
+        return applied
+
+    def _claim_existing_usernames(self) -> None:
+        """Fill the usernames table from the player records of a database created before it existed"""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if not connection.execute("SELECT 1 FROM usernames LIMIT 1").fetchone():
+                rows = connection.execute(
+                    "SELECT key, data FROM records WHERE section = 'players' AND data IS NOT NULL"
+                ).fetchall()
+                self._write_usernames(connection, [(key, json.loads(data)) for key, data in rows])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _write_usernames(self, connection: sqlite3.Connection, players: Iterable[Tuple[str, Dict]]) -> None:
+        connection.executemany(
+            "INSERT OR IGNORE INTO usernames (username, phone) VALUES (?, ?)",
+            [(player["username"].casefold(), phone) for phone, player in players if "username" in player]
+        )
+
+    def _new_usernames(self, changes: List[Change]) -> List[Tuple[str, str]]:
+        """Return (username, phone) of the players these changes create
+
+        Usernames never change, so only players without a committed version are
+        decoded.
+        """
+        return [
+            (json.loads(payload)["username"].casefold(), key)
+            for section, key, payload in changes
+            if section == "players" and payload is not None and not self._versions.get((section, key))
+        ]
+
+    def is_empty(self) -> bool:
+        return self._connection().execute("SELECT 1 FROM records LIMIT 1").fetchone() is None
+
+    def seed(self, game_state: Dict[str, Any]) -> bool:
+        """Write every entry of the game state if the database is still empty"""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if connection.execute("SELECT 1 FROM records LIMIT 1").fetchone():
+                connection.execute("ROLLBACK")
+                return False
+            connection.execute("UPDATE meta SET value = value + 1 WHERE name = 'seq'")
+            seq = connection.execute("SELECT value FROM meta WHERE name = 'seq'").fetchone()[0]
+            connection.executemany(
+                "INSERT INTO records (section, key, version, seq, data) VALUES (?, ?, 1, ?, ?)",
+                [
+                    (name, key, seq, encode_record(value))
+                    for name, section in game_state.items() if isinstance(section, dict)
+                    for key, value in section.items()
+                ]
+            )
+            self._write_usernames(connection, game_state.get("players", {}).items())
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        logger.info(f"Seeded shared game state {self.path}")
+        return True
+
+    def load(self) -> Dict[str, Any]:
+        """Read every live entry and remember its version"""
+        rows = self._connection().execute("SELECT section, key, version, seq, data FROM records").fetchall()
+        game_state = {}
+        with self._lock:
+            for section, key, version, seq, data in rows:
+                self._versions[(section, key)] = version
+                self._seen_seq = max(self._seen_seq, seq)
+                if data is not None:
+                    game_state.setdefault(section, {})[key] = json.loads(data)
+        logger.info(f"Loaded {len(rows)} shared state records")
+        return game_state
+
+    def refresh(self, game_state: Dict[str, Any]) -> int:
+        """Apply the entries other workers committed since the last refresh"""
+        connection = self._connection()
+        seq = connection.execute("SELECT value FROM meta WHERE name = 'seq'").fetchone()[0]
+        if seq <= self._seen_seq:
+            return 0
+
+        # Replacing entries must not race with commands reading or modifying them
+        with state_lock.exclusive(), self._lock:
+            rows = connection.execute(
+                "SELECT section, key, version, seq, data FROM records WHERE seq > ?", (self._seen_seq,)
+            ).fetchall()
+            if not rows:
+                return 0
+            self._seen_seq = max(row[3] for row in rows)
+            applied = self._apply_rows(game_state, [(row[0], row[1], row[2], row[4]) for row in rows])
+            track_sections(game_state)
+        return applied
+
+    def _reload(self, game_state: Dict[str, Any], keys: List[Tuple[str, str]]) -> None:
+        """Replace the given entries with their committed values"""
+        connection = self._connection()
+        rows = []
+        for section, key in keys:
+            row = connection.execute(
+                "SELECT version, data FROM records WHERE section = ? AND key = ?", (section, key)
+            ).fetchone()
+            rows.append((section, key) + (row if row else (0, None)))
+        self._apply_rows(game_state, rows, force=True)
+        track_sections(game_state)
+
+    def commit(self, game_state: Dict[str, Any], changes: List[Change],
+               replies: List[Tuple[str, str]] = ()) -> bool:
+        """Write changes if no other worker modified the same entries in the meantime
+
+        On a conflict nothing is written, the changed entries are reset to their
+        committed values and False is returned. (message_sid, response) pairs are
+        stored in the same transaction, so a retried message sees its response exactly
+        when the command's changes were committed.
+        """
+        if not changes and not replies:
+            return True
+
+        connection = self._connection()
+        with self._lock:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                conflicts = []
+                for section, key, payload in changes:
+                    row = connection.execute(
+                        "SELECT version FROM records WHERE section = ? AND key = ?", (section, key)
+                    ).fetchone()
+                    if (row[0] if row else 0) != self._versions.get((section, key), 0):
+                        conflicts.append((section, key))
+
+                usernames = self._new_usernames(changes)
+                for username, phone in usernames:
+                    row = connection.execute("SELECT phone FROM usernames WHERE username = ?", (username,)).fetchone()
+                    if row and row[0] != phone:
+                        # Another worker registered the name; the retry sees its player after refreshing
+                        conflicts.append(("usernames", username))
+
+                if conflicts:
+                    connection.execute("ROLLBACK")
+                    self.conflicts += 1
+                    logger.info(f"Shared state conflict on {conflicts}, reloading")
+                    self._reload(game_state, [(section, key) for section, key, _ in changes])
+                    return False
+
+                connection.execute("UPDATE meta SET value = value + 1 WHERE name = 'seq'")
+                seq = connection.execute("SELECT value FROM meta WHERE name = 'seq'").fetchone()[0]
+                connection.executemany(
+                    "INSERT OR REPLACE INTO records (section, key, version, seq, data) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (section, key, self._versions.get((section, key), 0) + 1, seq, payload)
+                        for section, key, payload in changes
+                    ]
+                )
+                connection.executemany("INSERT OR REPLACE INTO usernames (username, phone) VALUES (?, ?)", usernames)
+                if replies:
+                    write_replies(connection, replies)
+                connection.execute("COMMIT")
+            except BaseException:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                raise
+
+            for section, key, _ in changes:
+                self._versions[(section, key)] = self._versions.get((section, key), 0) + 1
+            # Our own rows are picked up again by the next refresh but skipped by version
+            if seq == self._seen_seq + 1:
+                self._seen_seq = seq
+        return True
+
+    def delete_section(self, name: str) -> None:
+        """Remove a section that moved to its own storage"""
+        connection = self._connection()
+        with self._lock:
+            connection.execute("DELETE FROM records WHERE section = ?", (name,))
+            for section, key in [k for k in self._versions if k[0] == name]:
+                del self._versions[(section, key)]
@@ -0,0 +1,122 @@
+import json
+import zlib
+import struct
+from typing import Any, Dict
+
+try:
+    import msgpack
+except ImportError:  # Optional dependency
+    msgpack = None
+
+
+class JsonCodec:
+    """Pretty-printed JSON, easy to read and hand-edit while debugging"""
+
+    name = "json"
+
+    def encode(self, game_state: Dict[str, Any]) -> bytes:
+        return json.dumps(game_state, indent=2).encode("utf-8")
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        return json.loads(data)
+
+
+class BinaryCodec:
+    """Versioned, pickle-free binary format
+
+    Layout: the 8 byte magic (whose last byte is the format version), then one
+    frame per section: a big-endian u16 name length, the UTF-8 name, a u32
+    payload length and the payload, which is zlib-compressed compact JSON.
+    Decoding stays in C (zlib and the json scanner) so loads are fast.
+    """
+
+    name = "binary"
+    MAGIC = b"ANRNBIN"
+    VERSION = 1
+    COMPRESSION_LEVEL = 3
+
+    def encode(self, game_state: Dict[str, Any]) -> bytes:
+        parts = [self.MAGIC, bytes([self.VERSION])]
+        for section_name, section in game_state.items():
+            name = section_name.encode("utf-8")
+            payload = zlib.compress(
+                json.dumps(section, separators=(",", ":")).encode("utf-8"), self.COMPRESSION_LEVEL
+            )
+            parts.append(struct.pack(">H", len(name)))
+            parts.append(name)
+            parts.append(struct.pack(">I", len(payload)))
+            parts.append(payload)
+        return b"".join(parts)
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        if not data.startswith(self.MAGIC):
+            raise ValueError("Not a binary game state snapshot")
+        version = data[len(self.MAGIC)]
+        if version != self.VERSION:
+            raise ValueError(f"Unsupported binary snapshot version {version}")
+
+        game_state = {}
+        view = memoryview(data)
+        offset = len(self.MAGIC) + 1
+        while offset < len(data):
+            try:
+                (name_length,) = struct.unpack_from(">H", data, offset)
+                offset += 2
+                name = bytes(view[offset:offset + name_length]).decode("utf-8")
+                offset += name_length
+                (payload_length,) = struct.unpack_from(">I", data, offset)
+            except struct.error:
+                raise ValueError("Truncated binary game state snapshot") from None
+            offset += 4
+            if offset + payload_length > len(data):
+                raise ValueError("Truncated binary game state snapshot")
+            game_state[name] = json.loads(zlib.decompress(view[offset:offset + payload_length]))
+            offset += payload_length
+        return game_state
+
+
+class MsgpackCodec:
+    """MessagePack snapshot, available when the msgpack package is installed"""
+
+    name = "msgpack"
+    MAGIC = b"ANRNMPK"
+    VERSION = 1
+
+    def encode(self, game_state: Dict[str, Any]) -> bytes:
+        return self.MAGIC + bytes([self.VERSION]) + msgpack.packb(game_state, use_bin_type=True)
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        if not data.startswith(self.MAGIC):
+            raise ValueError("Not a msgpack game state snapshot")
+        version = data[len(self.MAGIC)]
+        if version != self.VERSION:
+            raise ValueError(f"Unsupported msgpack snapshot version {version}")
+        return msgpack.unpackb(data[len(self.MAGIC) + 1:], raw=False, strict_map_key=False)
+
+
+CODECS = {"json": JsonCodec(), "binary": BinaryCodec()}
+if msgpack is not None:
+    CODECS["msgpack"] = MsgpackCodec()
+
+
+def get_codec(name: str):
+    """Return the snapshot codec registered under name"""
+    if name not in CODECS:
+        raise ValueError(f"Unknown snapshot codec '{name}'. Available: {', '.join(CODECS)}")
+    return CODECS[name]
+
+
+def detect_codec(data: bytes):
+    """Return the codec that wrote a snapshot, based on its magic bytes"""
+    if data.startswith(BinaryCodec.MAGIC):
+        return CODECS["binary"]
+    if data.startswith(MsgpackCodec.MAGIC):
+        if "msgpack" not in CODECS:
+            raise ValueError("Snapshot was written with msgpack, which is not installed")
+        return CODECS["msgpack"]
+    return CODECS["json"]
+
+
+def decode_snapshot(data: bytes) -> Dict[str, Any]:
+    """Decode a snapshot written by any registered codec"""
+    return detect_codec(data).decode(data)
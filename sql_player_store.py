@@ -0,0 +1,441 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, delete, insert, update, func, inspect, text
+
+from state_tracking import ChangeTracker, MISSING, encode_record
+from models import Player, PlayerItem, PlayerSkill, PlayerEquipment
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Number of players kept in memory before the least recently used ones are evicted
+PLAYER_CACHE_SIZE = int(os.environ.get("GAME_PLAYER_CACHE_SIZE", "10000"))
+
+# Rows fetched or written per statement when working on many players at once
+BATCH_SIZE = 500
+
+_players = Player.__table__
+_items = PlayerItem.__table__
+_skills = PlayerSkill.__table__
+_equipment = PlayerEquipment.__table__
+
+# Player columns added after the table was first deployed; db.create_all creates missing
+# tables (the item, skill and equipment tables) but never alters an existing one
+_ADDED_COLUMNS = ("in_battle", "extra")
+
+# Player keys that are stored in dedicated columns or child tables
+_MAPPED_KEYS = {
+    "username", "race", "class", "element", "level", "experience", "gold", "karma",
+    "rank", "attributes", "skills", "inventory", "equipped", "is_deity", "in_battle"
+}
+
+# Player keys read from a Player column of the same meaning, for index builds
+_COLUMN_KEYS = {
+    "username": "username", "race": "race", "class": "character_class", "element": "element",
+    "level": "level", "experience": "experience", "gold": "gold", "karma": "karma", "rank": "rank",
+    "is_deity": "is_deity", "in_battle": "in_battle"
+}
+
+# Player keys stored in child tables or spread over several columns
+_COMPOSITE_KEYS = {"attributes", "skills", "inventory", "equipped"}
+
+ATTRIBUTES = ("strength", "agility", "intelligence", "endurance")
+
+
+def _chunks(values: List[Any], size: int = BATCH_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def player_to_row(phone: str, player: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a player dictionary to a row of the Player table"""
+    attributes = player.get("attributes") or {}
+    row = {
+        "phone_number": phone,
+        "username": player["username"],
+        "race": player["race"],
+        "character_class": player["class"],
+        "element": player["element"],
+        "level": player.get("level", 1),
+        "experience": player.get("experience", 0),
+        "gold": player.get("gold", 0),
+        "karma": player.get("karma", 0),
+        "rank": player.get("rank", "G"),
+        "is_deity": bool(player.get("is_deity", False)),
+        "in_battle": bool(player.get("in_battle", False)),
+        "extra": {key: value for key, value in player.items() if key not in _MAPPED_KEYS},
+    }
+    for attribute in ATTRIBUTES:
+        row[attribute] = attributes.get(attribute, 0)
+    return row
+
+
+def row_to_player(row, items: List[str], skills: List[str], equipped: Dict[str, str]) -> Dict[str, Any]:
+    """Convert a Player row and its child rows back to a player dictionary"""
+    player = {
+        "username": row["username"],
+        "race": row["race"],
+        "class": row["character_class"],
+        "element": row["element"],
+        "level": row["level"],
+        "experience": row["experience"],
+        "gold": row["gold"],
+        "karma": row["karma"],
+        "rank": row["rank"],
+        "attributes": {attribute: row[attribute] for attribute in ATTRIBUTES},
+        "skills": skills,
+        "inventory": items,
+        "equipped": equipped,
+        "is_deity": bool(row["is_deity"]),
+        "in_battle": bool(row["in_battle"]),
+    }
+    player.update(row["extra"] or {})
+    return player
+
+
+def migrate_schema(engine) -> List[str]:
+    """Add the Player columns missing from a database created by an earlier version
+
+    Idempotent, run at startup after db.create_all. Existing rows get NULL, which
+    row_to_player reads as not in battle and no extra keys.
+    """
+    existing = {column["name"] for column in inspect(engine).get_columns(_players.name)}
+    added = [name for name in _ADDED_COLUMNS if name not in existing]
+    if added:
+        with engine.begin() as conn:
+            for name in added:
+                column_type = _players.c[name].type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {_players.name} ADD COLUMN {name} {column_type}"))
+        logger.info(f"Added columns {', '.join(added)} to the {_players.name} table")
+    return added
+
+
+def _upsert_players(conn, rows: List[Dict[str, Any]]) -> None:
+    """Insert or update Player rows keyed by phone number in one statement per batch"""
+    dialect = conn.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(_players)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[_players.c.phone_number],
+            set_={name: stmt.excluded[name] for name in rows[0] if name != "phone_number"}
+        )
+        conn.execute(stmt, rows)
+        return
+
+    # Generic fallback for other databases
+    phones = [row["phone_number"] for row in rows]
+    existing = set(conn.execute(
+        select(_players.c.phone_number).where(_players.c.phone_number.in_(phones))
+    ).scalars())
+    new_rows = [row for row in rows if row["phone_number"] not in existing]
+    if new_rows:
+        conn.execute(insert(_players), new_rows)
+    for row in rows:
+        if row["phone_number"] in existing:
+            conn.execute(update(_players).where(_players.c.phone_number == row["phone_number"]).values(**row))
+
+
+class SqlPlayerStore(ChangeTracker, MutableMapping):
+    """Player roster backed by the Player table with an LRU cache of hot players
+
+    Entries touched by a command stay pinned in the cache until its window is
+    drained, and changed entries stay cached until they have been persisted, so
+    an eviction can never lose an unsaved change.
+    """
+
+    external_storage = True
+
+    def __init__(self, engine, cache_size: int = PLAYER_CACHE_SIZE):
+        self._init_tracking()
+        self._engine = engine
+        self._cache_size = cache_size
+        # phone -> player dict, or MISSING for phones known not to be registered
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        self._pins: Dict[str, int] = {}
+        # phone -> payload drained but not yet persisted
+        self._dirty: Dict[str, Optional[str]] = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_game_state(cls, engine, players: Dict[str, Any], **kwargs) -> "SqlPlayerStore":
+        """Create the store, importing the given players if the Player table is empty"""
+        store = cls(engine, **kwargs)
+        if players and store.count() == 0:
+            store.persist([(phone, encode_record(player)) for phone, player in players.items()])
+            logger.info(f"Imported {len(players)} players into the database")
+        return store
+
+    # Cache management
+
+    def _load(self, conn, where) -> "OrderedDict[str, Dict[str, Any]]":
+        rows = conn.execute(select(_players).where(where).order_by(_players.c.id)).mappings().all()
+        if not rows:
+            return OrderedDict()
+
+        ids = [row["id"] for row in rows]
+        items: Dict[int, List[str]] = {}
+        skills: Dict[int, List[str]] = {}
+        equipped: Dict[int, Dict[str, str]] = {}
+        for player_id, name in conn.execute(
+            select(_items.c.player_id, _items.c.name)
+            .where(_items.c.player_id.in_(ids)).order_by(_items.c.player_id, _items.c.position)
+        ):
+            items.setdefault(player_id, []).append(name)
+        for player_id, name in conn.execute(
+            select(_skills.c.player_id, _skills.c.name)
+            .where(_skills.c.player_id.in_(ids)).order_by(_skills.c.player_id, _skills.c.position)
+        ):
+            skills.setdefault(player_id, []).append(name)
+        for player_id, slot, item_name in conn.execute(
+            select(_equipment.c.player_id, _equipment.c.slot, _equipment.c.item_name)
+            .where(_equipment.c.player_id.in_(ids))
+        ):
+            equipped.setdefault(player_id, {})[slot] = item_name
+
+        return OrderedDict(
+            (row["phone_number"], row_to_player(row, items.get(row["id"], []), skills.get(row["id"], []),
+                                                equipped.get(row["id"], {})))
+            for row in rows
+        )
+
+    def _fetch(self, phone: str) -> Any:
+        """Return the cached player, loading it from the database on a miss"""
+        with self._lock:
+            if phone in self._cache:
+                self._cache.move_to_end(phone)
+                return self._cache[phone]
+
+        with self._engine.connect() as conn:
+            value = self._load(conn, _players.c.phone_number == phone).get(phone, MISSING)
+
+        with self._lock:
+            # Another thread may have cached (and modified) it in the meantime
+            if phone in self._cache:
+                self._cache.move_to_end(phone)
+                return self._cache[phone]
+            self._cache[phone] = value
+            self._evict()
+            return value
+
+    def _evict(self) -> None:
+        if len(self._cache) <= self._cache_size:
+            return
+        for phone in list(self._cache):
+            if len(self._cache) <= self._cache_size:
+                break
+            if phone not in self._pins and phone not in self._dirty:
+                del self._cache[phone]
+
+    def _store(self, phone: str, value: Any) -> None:
+        with self._lock:
+            self._cache[phone] = value
+            self._cache.move_to_end(phone)
+            self._evict()
+
+    # Change tracking
+
+    def _peek(self, key) -> Any:
+        return self._fetch(key)
+
+    def _touch(self, key) -> None:
+        touched = self._touched()
+        if key not in touched:
+            with self._lock:
+                self._pins[key] = self._pins.get(key, 0) + 1
+            touched[key] = self._encoded(key)
+
+    def _unpin(self, keys) -> None:
+        with self._lock:
+            for key in keys:
+                remaining = self._pins.get(key, 0) - 1
+                if remaining > 0:
+                    self._pins[key] = remaining
+                else:
+                    self._pins.pop(key, None)
+
+    def drain(self) -> List[Tuple[str, Optional[str]]]:
+        keys = list(self._touched())
+        changed = super().drain()
+        with self._lock:
+            for key, payload in changed:
+                self._dirty[key] = payload
+        self._unpin(keys)
+        return changed
+
+    def discard(self) -> None:
+        keys = list(self._touched())
+        super().discard()
+        self._unpin(keys)
+
+    def _restore(self, key, value) -> None:
+        self._store(key, value)
+
+    def persist(self, changes: List[Tuple[str, Optional[str]]]) -> None:
+        """Batch-upsert changed players and their child rows in a single transaction"""
+        upserts = [(phone, json.loads(payload)) for phone, payload in changes if payload is not None]
+        deletes = [phone for phone, payload in changes if payload is None]
+
+        with self._engine.begin() as conn:
+            for batch in _chunks(deletes):
+                ids = list(conn.execute(
+                    select(_players.c.id).where(_players.c.phone_number.in_(batch))
+                ).scalars())
+                if ids:
+                    for table in (_items, _skills, _equipment):
+                        conn.execute(delete(table).where(table.c.player_id.in_(ids)))
+                    conn.execute(delete(_players).where(_players.c.id.in_(ids)))
+
+            for batch in _chunks(upserts):
+                _upsert_players(conn, [player_to_row(phone, player) for phone, player in batch])
+                players = dict(batch)
+                ids = dict(conn.execute(
+                    select(_players.c.phone_number, _players.c.id).where(_players.c.phone_number.in_(list(players)))
+                ).all())
+                id_list = list(ids.values())
+                for table in (_items, _skills, _equipment):
+                    conn.execute(delete(table).where(table.c.player_id.in_(id_list)))
+
+                item_rows, skill_rows, equipment_rows = [], [], []
+                for phone, player in batch:
+                    player_id = ids[phone]
+                    item_rows.extend(
+                        {"player_id": player_id, "position": position, "name": name}
+                        for position, name in enumerate(player.get("inventory", []))
+                    )
+                    skill_rows.extend(
+                        {"player_id": player_id, "position": position, "name": name}
+                        for position, name in enumerate(player.get("skills", []))
+                    )
+                    equipment_rows.extend(
+                        {"player_id": player_id, "slot": slot, "item_name": item_name}
+                        for slot, item_name in (player.get("equipped") or {}).items()
+                    )
+                if item_rows:
+                    conn.execute(insert(_items), item_rows)
+                if skill_rows:
+                    conn.execute(insert(_skills), skill_rows)
+                if equipment_rows:
+                    conn.execute(insert(_equipment), equipment_rows)
+
+        with self._lock:
+            for phone, payload in changes:
+                # Keep the entry protected if it changed again after this batch was taken
+                if phone in self._dirty and self._dirty[phone] == payload:
+                    del self._dirty[phone]
+            self._evict()
+
+        logger.info(f"Persisted {len(upserts)} players and deleted {len(deletes)}")
+
+    # Mapping interface
+
+    def __getitem__(self, phone: str) -> Dict[str, Any]:
+        value = self._fetch(phone)
+        if value is MISSING:
+            raise KeyError(phone)
+        self._touch(phone)
+        return value
+
+    def __setitem__(self, phone: str, player: Dict[str, Any]) -> None:
+        self._touch(phone)
+        self._store(phone, player)
+
+    def __delitem__(self, phone: str) -> None:
+        if self._fetch(phone) is MISSING:
+            raise KeyError(phone)
+        self._touch(phone)
+        self._store(phone, MISSING)
+
+    def __contains__(self, phone) -> bool:
+        return self._fetch(phone) is not MISSING
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            pending = {phone for phone in self._dirty if self._cache.get(phone, MISSING) is not MISSING}
+        with self._engine.connect() as conn:
+            phones = list(conn.execute(select(_players.c.phone_number).order_by(_players.c.id)).scalars())
+        for phone in phones:
+            if self._cache.get(phone) is MISSING:
+                continue
+            pending.discard(phone)
+            yield phone
+        yield from pending
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def count(self) -> int:
+        """Return the number of players stored in the database"""
+        with self._engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(_players)).scalar_one()
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Iterate over every player in batches without caching or touching them"""
+        last_id = 0
+        while True:
+            with self._engine.connect() as conn:
+                ids = list(conn.execute(
+                    select(_players.c.id).where(_players.c.id > last_id).order_by(_players.c.id).limit(BATCH_SIZE)
+                ).scalars())
+                if not ids:
+                    return
+                batch = self._load(conn, _players.c.id.in_(ids))
+            last_id = ids[-1]
+            for phone, player in batch.items():
+                cached = self._cache.get(phone)
+                if cached is MISSING:
+                    continue
+                yield phone, cached if cached is not None else player
+
+    def values(self) -> Iterator[Dict[str, Any]]:
+        for _, player in self.items():
+            yield player
+
+    def index_entries(self, fields=None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Stream players for an index build, selecting only the columns holding the fields
+
+        Fields without a column of their own are read from the extra column;
+        cached players are returned whole since they may hold unsaved changes.
+        """
+        if fields is None or _COMPOSITE_KEYS.intersection(fields):
+            yield from self.items()
+            return
+
+        keys = [key for key in fields if key in _COLUMN_KEYS]
+        columns = [_players.c[_COLUMN_KEYS[key]] for key in keys]
+        extra = [key for key in fields if key not in _COLUMN_KEYS]
+        if extra:
+            columns.append(_players.c.extra)
+
+        last_id = 0
+        while True:
+            with self._engine.connect() as conn:
+                rows = conn.execute(
+                    select(_players.c.id, _players.c.phone_number, *columns)
+                    .where(_players.c.id > last_id).order_by(_players.c.id).limit(BATCH_SIZE)
+                ).all()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            for row in rows:
+                phone = row[1]
+                cached = self._cache.get(phone)
+                if cached is MISSING:
+                    continue
+                if cached is not None:
+                    yield phone, cached
+                    continue
+                player = dict(zip(keys, row[2:]))
+                if extra:
+                    stored = row[-1] or {}
+                    player.update((key, stored[key]) for key in extra if key in stored)
+                yield phone, player
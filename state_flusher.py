@@ -0,0 +1,151 @@
+import os
+import time
+import atexit
+import signal
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, List
+
+from state_tracking import Change
+
+# Initialize logging
+logger = logging.getLogger(__name__)
+
+# Maximum seconds a change waits before it is written (0 writes synchronously)
+FLUSH_INTERVAL = float(os.environ.get("GAME_FLUSH_INTERVAL", "0"))
+
+# Number of pending changes that triggers a write before the interval is up
+FLUSH_MAX_PENDING = int(os.environ.get("GAME_FLUSH_MAX_PENDING", "500"))
+
+
+class StateFlusher:
+    """Background thread that coalesces state changes and writes them as a group
+
+    Changes to the same entry that arrive within one window collapse into the
+    latest payload, so a burst of commands costs a single write.
+    """
+
+    def __init__(self, write_changes: Callable[[List[Change]], None],
+                 interval: float = FLUSH_INTERVAL, max_pending: int = FLUSH_MAX_PENDING):
+        self._write_changes = write_changes
+        self._interval = interval
+        self._max_pending = max_pending
+        self._pending: "OrderedDict[tuple, Change]" = OrderedDict()
+        self._first_pending_at = 0.0
+        self._submitted = 0
+        self._flushed = 0
+        self._urgent = False
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="state-flusher", daemon=True)
+
+    def start(self) -> "StateFlusher":
+        self._thread.start()
+        return self
+
+    def submit(self, changes: List[Change], sync: bool = False) -> bool:
+        """Queue changes for the next write; with sync, wait until they are durable"""
+        generation = self.enqueue(changes)
+        return self.wait(generation) if sync else True
+
+    def enqueue(self, changes: List[Change]) -> int:
+        """Queue changes for the next write and return the generation to wait for
+
+        A later payload of an entry replaces the queued one, so callers must
+        enqueue the changes of an entry in the order they were made.
+        """
+        with self._condition:
+            if changes:
+                if not self._pending:
+                    self._first_pending_at = time.monotonic()
+                for name, key, payload in changes:
+                    self._pending.pop((name, key), None)
+                    self._pending[(name, key)] = (name, key, payload)
+                self._submitted += 1
+            if len(self._pending) >= self._max_pending:
+                self._urgent = True
+            self._condition.notify_all()
+            return self._submitted
+
+    def wait(self, generation: int) -> bool:
+        """Write pending changes now and wait until those of the generation are durable"""
+        with self._condition:
+            if self._flushed < generation:
+                self._urgent = True
+                self._condition.notify_all()
+            while self._flushed < generation and self._thread.is_alive():
+                self._condition.wait()
+            return self._flushed >= generation
+
+    def flush(self) -> bool:
+        """Write everything that is pending and wait for it"""
+        return self.submit([], sync=True)
+
+    def stop(self) -> None:
+        """Flush pending changes and stop the background thread"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping and self._flushed >= self._submitted:
+                    self._condition.wait()
+                if self._pending:
+                    deadline = self._first_pending_at + self._interval
+                    while not (self._urgent or self._stopping):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                elif self._stopping:
+                    return
+
+                batch = list(self._pending.values())
+                self._pending = OrderedDict()
+                self._urgent = False
+                generation = self._submitted
+
+            try:
+                if batch:
+                    self._write_changes(batch)
+            except Exception as e:
+                logger.error(f"Error writing game state changes: {e}")
+                with self._condition:
+                    # Put the batch back unless newer payloads superseded it
+                    for name, key, payload in batch:
+                        if (name, key) not in self._pending:
+                            self._pending[(name, key)] = (name, key, payload)
+                    if self._pending:
+                        self._first_pending_at = time.monotonic()
+                    self._condition.notify_all()
+                if self._stopping:
+                    return
+                time.sleep(0.1)
+                continue
+
+            with self._condition:
+                self._flushed = max(self._flushed, generation)
+                self._condition.notify_all()
+
+    def install_shutdown_hooks(self) -> None:
+        """Flush on interpreter exit and on SIGTERM"""
+        atexit.register(self.stop)
+        try:
+            previous = signal.getsignal(signal.SIGTERM)
+
+            def handle_sigterm(signum, frame):
+                self.stop()
+                if callable(previous):
+                    previous(signum, frame)
+                else:
+                    raise SystemExit(0)
+
+            signal.signal(signal.SIGTERM, handle_sigterm)
+        except ValueError:
+            # Signal handlers can only be installed from the main thread
+            logger.warning("Could not install SIGTERM handler for the state flusher")
@@ -0,0 +1,230 @@
+import json
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# A change is (section name, entry key, compact JSON payload); a payload of None means deleted
+Change = Tuple[str, str, Optional[str]]
+
+
+def encode_record(value: Any) -> str:
+    """Serialize a single state entry to compact JSON"""
+    return json.dumps(value, separators=(",", ":"))
+
+
+# Marker for entries that do not exist
+MISSING = object()
+
+
+class ChangeTracker:
+    """Mixin that remembers which entries of a section the current thread touched
+
+    The first touch of an entry records its serialized pre-image, so at commit time
+    only entries whose serialized form actually changed are reported as dirty.
+    Sections that keep their entries in their own storage set ``external_storage``
+    and implement ``persist``.
+    """
+
+    external_storage = False
+
+    def _init_tracking(self) -> None:
+        self._local = threading.local()
+        self._indexes = []
+
+    def add_index(self, index, rebuild: bool = True) -> None:
+        """Keep a secondary index (with rebuild and update methods) in sync with the entries
+
+        Indexes that only follow changes from now on pass rebuild=False and need
+        no rebuild method; the entries are not read at all.
+        """
+        # Registered before the rebuild so no change made meanwhile is missed
+        self._indexes.append(index)
+        if rebuild:
+            index.rebuild(self.index_entries(getattr(index, "fields", None)))
+
+    def index_entries(self, fields: Sequence[str] = None) -> Iterable[Tuple[Any, Any]]:
+        """Return (key, value) pairs to build an index from
+
+        Given the fields an index reads, store-backed sections may stream values
+        holding only those fields from a cheaper source than the full records.
+        """
+        return list(self.items())
+
+    def reindex(self, key) -> None:
+        """Update the secondary indexes after an entry changed"""
+        if self._indexes:
+            value = self._peek(key)
+            for index in self._indexes:
+                index.update(key, None if value is MISSING else value)
+
+    def _peek(self, key) -> Any:
+        """Return the current value of an entry without touching it, or MISSING"""
+        raise NotImplementedError
+
+    def peek(self, key, default=None) -> Any:
+        """Return an entry for reading only, without recording its pre-image"""
+        value = self._peek(key)
+        return default if value is MISSING else value
+
+    def _touched(self) -> Dict[str, Optional[str]]:
+        touched = getattr(self._local, "touched", None)
+        if touched is None:
+            touched = self._local.touched = {}
+        return touched
+
+    def _touch(self, key) -> None:
+        touched = self._touched()
+        if key not in touched:
+            touched[key] = self._encoded(key)
+
+    def _encoded(self, key) -> Optional[str]:
+        value = self._peek(key)
+        if value is MISSING:
+            return None
+        return encode_record(value)
+
+    def drain(self) -> List[Tuple[str, Optional[str]]]:
+        """Return (key, payload) for every entry this thread changed and start a new window"""
+        touched = self._touched()
+        self._local.touched = {}
+        changed = []
+        for key, before in touched.items():
+            after = self._encoded(key)
+            if after != before:
+                changed.append((key, after))
+                self.reindex(key)
+        return changed
+
+    def discard(self) -> None:
+        """Forget what this thread touched without computing changes"""
+        self._local.touched = {}
+
+    def rollback(self) -> None:
+        """Put every entry this thread touched back to its pre-image and start a new window"""
+        touched = self._touched()
+        for key, before in touched.items():
+            if self._encoded(key) != before:
+                self._restore(key, MISSING if before is None else json.loads(before))
+                self.reindex(key)
+        self.discard()
+
+    def _restore(self, key, value) -> None:
+        """Set an entry (MISSING deletes it) without touching it"""
+        raise NotImplementedError
+
+    def persist(self, changes: List[Tuple[str, Optional[str]]]) -> None:
+        """Write changes to the section's own storage (external_storage sections only)"""
+        raise NotImplementedError
+
+
+class TrackedSection(ChangeTracker, dict):
+    """Game state section stored in a plain dictionary"""
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._init_tracking()
+
+    def _peek(self, key) -> Any:
+        return dict.get(self, key, MISSING)
+
+    def _restore(self, key, value) -> None:
+        if value is MISSING:
+            dict.pop(self, key, None)
+        else:
+            dict.__setitem__(self, key, value)
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        self._touch(key)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __setitem__(self, key, value):
+        self._touch(key)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._touch(key)
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *default):
+        if key in self:
+            self._touch(key)
+        return dict.pop(self, key, *default)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+
+def track_sections(game_state: Dict[str, Any]) -> Dict[str, Any]:
+    """Wrap every dictionary section of the game state so changes can be tracked"""
+    for name, section in list(game_state.items()):
+        if isinstance(section, dict) and not isinstance(section, ChangeTracker):
+            game_state[name] = TrackedSection(section)
+    return game_state
+
+
+def reset_tracking(game_state: Dict[str, Any]) -> None:
+    """Forget everything this thread touched so far"""
+    for section in game_state.values():
+        if isinstance(section, ChangeTracker):
+            section.discard()
+
+
+def rollback_changes(game_state: Dict[str, Any]) -> None:
+    """Undo what this thread modified since tracking was last reset, e.g. by a command that failed"""
+    for section in game_state.values():
+        if isinstance(section, ChangeTracker):
+            section.rollback()
+
+
+def collect_changes(game_state: Dict[str, Any]) -> List[Change]:
+    """Collect the entries this thread actually modified as serialized change records"""
+    changes = []
+    for name, section in game_state.items():
+        if isinstance(section, ChangeTracker):
+            changes.extend((name, key, payload) for key, payload in section.drain())
+    return changes
+
+
+def apply_change(game_state: Dict[str, Any], name: str, key: str, value: Any, deleted: bool = False) -> None:
+    """Apply a single change record to the game state without marking it as touched"""
+    section = game_state.setdefault(name, {})
+    if deleted:
+        dict.pop(section, key, None)
+    else:
+        dict.__setitem__(section, key, value)
+    if isinstance(section, ChangeTracker):
+        section.reindex(key)
+
+
+def file_sections(game_state: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the sections that are persisted by the game state files"""
+    return {
+        name: section for name, section in game_state.items()
+        if not getattr(section, "external_storage", False)
+    }
+
+
+def persist_external(game_state: Dict[str, Any], changes: List[Change]) -> List[Change]:
+    """Hand changes of sections with their own storage to them and return the rest"""
+    remaining = []
+    external = {}
+    for name, key, payload in changes:
+        section = game_state.get(name)
+        if getattr(section, "external_storage", False):
+            external.setdefault(name, []).append((key, payload))
+        else:
+            remaining.append((name, key, payload))
+    for name, section_changes in external.items():
+        game_state[name].persist(section_changes)
+    return remaining
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# The game modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import idempotency
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    """Run every test in its own directory; the modules keep their files relative to it"""
+    monkeypatch.chdir(tmp_path)
+    # The reply store is opened once per process, open a fresh one in this directory
+    monkeypatch.setattr(idempotency, "_store", None)
+    return tmp_path
+
+
+@pytest.fixture(scope="session")
+def flask_app(tmp_path_factory):
+    """Import app.py once; it loads the game state and opens its database on import"""
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(tmp_path_factory.mktemp("app"))
+        patch.setenv("DATABASE_URL", "sqlite://")
+        patch.setenv("GAME_OUTBOUND_SPOOL", "0")
+        patch.setenv("GAME_TURN_NOTIFICATIONS", "0")
+        import app
+    return app
@@ -0,0 +1,130 @@
+import pytest
+
+import utils
+from command_runner import run_game_command
+from state_tracking import collect_changes, track_sections
+
+ALICE, BOB, CAROL = "+15550000001", "+15550000002", "+15550000003"
+
+
+@pytest.fixture
+def game_state(flask_app, monkeypatch):
+    game_state = track_sections(utils.new_game_state())
+    monkeypatch.setattr(flask_app, "game_state", game_state)
+    return game_state
+
+
+@pytest.fixture
+def client(flask_app, monkeypatch):
+    monkeypatch.setattr(flask_app.app, "secret_key", "test")
+    return flask_app.app.test_client()
+
+
+@pytest.fixture
+def admin(client):
+    with client.session_transaction() as session:
+        session["admin_logged_in"] = True
+    return client
+
+
+@pytest.fixture
+def dueling(game_state):
+    run_game_command("register alice human warrior fire", ALICE, game_state)
+    run_game_command("register bob elf mage water", BOB, game_state)
+    run_game_command("register carol dwarf warrior earth", CAROL, game_state)
+    run_game_command("duel bob", ALICE, game_state)
+    return game_state
+
+
+def test_game_state_without_players_names_only_players_in_battles_and_deities(admin, dueling):
+    assert admin.post("/api/create_deity", json={"name": "Storm", "phone": CAROL}).get_json() == {"success": True}
+    run_game_command("register dave human mage wind", "+15550000004", dueling)
+    assert len(dueling["players"]) == 4
+
+    state = admin.get("/api/game_state?players=0").get_json()
+    assert "players" not in state
+    assert state["player_names"] == {ALICE: "alice", BOB: "bob", CAROL: "carol"}
+    assert list(state["active_battles"]) == [f"{ALICE}_{BOB}"]
+
+
+def test_game_state_includes_players_by_default(admin, dueling):
+    state = admin.get("/api/game_state").get_json()
+    assert set(state["players"]) == {ALICE, BOB, CAROL}
+    assert "player_names" not in state
+
+
+def test_player_lookup_ignores_case(admin, dueling):
+    response = admin.get("/api/player_lookup?username=CaRoL")
+    assert response.status_code == 200
+    assert response.get_json()["phone"] == CAROL
+    assert response.get_json()["player"]["username"] == "carol"
+
+
+def test_player_lookup_errors(admin, dueling):
+    assert admin.get("/api/player_lookup?username=nobody").status_code == 404
+    assert admin.get("/api/player_lookup?username=%20").status_code == 400
+
+
+@pytest.mark.parametrize("url", ["/api/game_state?players=0", "/api/player_lookup?username=alice"])
+def test_admin_endpoints_need_a_login(client, dueling, url):
+    assert client.get(url).status_code == 401
+
+
+@pytest.fixture
+def roster(game_state):
+    races = ["human", "elf", "dwarf"]
+    phones = [f"+1555100{index:04d}" for index in range(12)]
+    for index, phone in enumerate(phones):
+        run_game_command(f"register player{index} {races[index % 3]} warrior fire", phone, game_state)
+    for index, phone in enumerate(phones):
+        game_state["players"][phone]["gold"] = index * 5 % 7
+    collect_changes(game_state)
+    return game_state
+
+
+def fetch_all(admin, **params):
+    players, cursor = [], None
+    while True:
+        query = dict(params, **({"cursor": cursor} if cursor else {}))
+        page = admin.get("/api/players", query_string=query).get_json()
+        players.append([player["phone"] for player in page["players"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return players, page["total"]
+
+
+def test_players_are_paged_in_registration_order(admin, roster, flask_app):
+    pages, total = fetch_all(admin, limit=5)
+    assert pages == [[f"+1555100{index:04d}" for index in range(start, min(start + 5, 12))] for start in (0, 5, 10)]
+    assert total == 12
+
+    player = admin.get("/api/players?limit=1").get_json()["players"][0]
+    assert set(player) == set(flask_app.PLAYER_SUMMARY_FIELDS) | {"phone"}
+    assert player["username"] == "player0"
+
+
+def test_players_are_sorted_and_filtered(admin, roster):
+    players = roster["players"]
+    by_gold = sorted(players, key=lambda phone: (players[phone]["gold"], phone), reverse=True)
+    assert sum(fetch_all(admin, sort="gold", order="desc", limit=4)[0], []) == by_gold
+
+    elves = [phone for phone in by_gold if players[phone]["race"] == "Elf"]
+    pages, total = fetch_all(admin, sort="gold", order="desc", race="Elf", limit=3)
+    assert sum(pages, []) == elves and total == len(elves)
+
+
+def test_limit_is_clamped(admin, roster, flask_app, monkeypatch):
+    monkeypatch.setattr(flask_app, "PLAYER_PAGE_MAX", 3)
+    assert len(admin.get("/api/players?limit=50").get_json()["players"]) == 3
+    assert len(admin.get("/api/players?limit=0").get_json()["players"]) == 1
+
+
+@pytest.mark.parametrize("query", ["sort=name", "order=up", "cursor=garbage"])
+def test_invalid_listing_arguments_are_refused(admin, roster, query):
+    response = admin.get(f"/api/players?{query}")
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_listing_needs_a_login(client, roster):
+    assert client.get("/api/players").status_code == 401
@@ -0,0 +1,120 @@
+import random
+import threading
+import time
+
+import async_webhook
+import utils
+from async_webhook import CommandQueue, ERROR_REPLY
+from command_runner import run_game_command
+from state_tracking import track_sections
+
+
+class Outbox:
+    """Stands in for send_whatsapp_message, recording the replies per phone"""
+
+    def __init__(self):
+        self.replies = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, phone, message):
+        with self.lock:
+            self.replies.setdefault(phone, []).append(message)
+
+
+def test_replies_keep_each_senders_order(monkeypatch):
+    def run(command, phone, game_state, message_sid=None):
+        # Uneven command times, so parallel workers would overtake each other
+        time.sleep(random.random() / 1000)
+        return f"{phone} {command}"
+
+    monkeypatch.setattr(async_webhook, "run_game_command", run)
+    outbox = Outbox()
+    commands = CommandQueue({}, send=outbox, workers=4).start()
+    phones = [f"+1555000000{index}" for index in range(6)]
+    for number in range(30):
+        for phone in phones:
+            assert commands.submit(f"quest {number}", f"whatsapp:{phone}")
+    commands.stop(10)
+
+    for phone in phones:
+        assert outbox.replies[phone] == [f"{phone} quest {number}" for number in range(30)]
+
+
+def test_duplicate_of_a_queued_message_is_dropped(monkeypatch):
+    release = threading.Event()
+    runs = []
+
+    def run(command, phone, game_state, message_sid=None):
+        runs.append(message_sid)
+        release.wait(5)
+        return "done"
+
+    monkeypatch.setattr(async_webhook, "run_game_command", run)
+    outbox = Outbox()
+    commands = CommandQueue({}, send=outbox, workers=1).start()
+    assert commands.submit("quest 1", "+15550000001", message_sid="SM1")
+    assert commands.submit("quest 1", "+15550000001", message_sid="SM1")
+    release.set()
+    commands.stop(5)
+
+    assert runs == ["SM1"]
+    assert outbox.replies == {"+15550000001": ["done"]}
+
+
+def test_duplicate_of_an_answered_message_is_dropped():
+    game_state = track_sections(utils.new_game_state())
+    reply = run_game_command("register player1 human warrior fire", "+15550000001", game_state, message_sid="SM1")
+    assert reply.startswith("Welcome")
+
+    outbox = Outbox()
+    commands = CommandQueue(game_state, send=outbox, workers=1).start()
+    assert commands.submit("register player1 human warrior fire", "+15550000001", message_sid="SM1")
+    commands.stop(5)
+    assert outbox.replies == {}
+
+
+def test_commands_run_and_reply_through_the_queue():
+    game_state = track_sections(utils.new_game_state())
+    outbox = Outbox()
+    commands = CommandQueue(game_state, send=outbox, workers=2).start()
+    commands.submit("register player1 human warrior fire", "whatsapp:+15550000001", message_sid="SM1")
+    commands.submit("quest 1", "whatsapp:+15550000001", message_sid="SM2")
+    commands.stop(5)
+
+    replies = outbox.replies["+15550000001"]
+    assert len(replies) == 2
+    assert replies[0].startswith("Welcome player1")
+    assert "completed" in replies[1]
+
+
+def test_failing_command_gets_the_error_reply(monkeypatch):
+    def run(command, phone, game_state, message_sid=None):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(async_webhook, "run_game_command", run)
+    outbox = Outbox()
+    commands = CommandQueue({}, send=outbox, workers=1).start()
+    commands.submit("quest 1", "+15550000001", message_sid="SM1")
+    commands.stop(5)
+    assert outbox.replies == {"+15550000001": [ERROR_REPLY]}
+
+
+def test_full_queue_refuses_messages(monkeypatch):
+    release = threading.Event()
+    started = threading.Event()
+
+    def run(command, phone, game_state, message_sid=None):
+        started.set()
+        release.wait(5)
+        return "done"
+
+    monkeypatch.setattr(async_webhook, "run_game_command", run)
+    commands = CommandQueue({}, send=Outbox(), workers=1, queue_size=1).start()
+    assert commands.submit("quest 1", "+15550000001", message_sid="SM1")
+    started.wait(5)
+    assert commands.submit("quest 2", "+15550000001", message_sid="SM2")
+    assert not commands.submit("quest 3", "+15550000001", message_sid="SM3")
+    # A refused message is not remembered as pending, so Twilio's retry is not dropped as a duplicate
+    assert "SM3" not in commands._pending_sids
+    release.set()
+    commands.stop(5)
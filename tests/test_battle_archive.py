@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+import battle_archive
+import command_runner
+import game_logic
+import utils
+from battle_archive import BattleArchive, archive_battle, find_battles, write_archived
+from command_runner import run_game_command
+from state_tracking import track_sections
+
+ALICE, BOB = "+15550000001", "+15550000002"
+
+
+@pytest.fixture(autouse=True)
+def fresh_archives(monkeypatch):
+    # Archives are cached by absolute path, every test starts in a new directory
+    monkeypatch.setattr(battle_archive, "_archives", {})
+
+
+def duel(game_state):
+    """Register two players and fight a whole duel, returning the winner's final reply"""
+    run_game_command("register alice human warrior fire", ALICE, game_state)
+    run_game_command("register bob elf mage water", BOB, game_state)
+    run_game_command("duel bob", ALICE, game_state)
+    for round_number in range(5):
+        reply = run_game_command("attack punch", ALICE if round_number % 2 == 0 else BOB, game_state)
+    return reply
+
+
+def test_finished_duel_is_archived_with_its_whole_log(monkeypatch):
+    monkeypatch.setattr(game_logic, "BATTLE_LOG_LIMIT", 2)
+    game_state = track_sections(utils.new_game_state())
+    duel(game_state)
+
+    assert dict(game_state["active_battles"]) == {}
+    [record] = find_battles(player=BOB)
+    assert record["outcome"] == "completed" and record["winner"] == ALICE
+    assert len(record["logs"]) == 7
+    assert record["logs"][0] == "alice challenged bob to a duel!"
+    assert [line.split()[0] for line in record["logs"][1:6]] == ["alice", "bob", "alice", "bob", "alice"]
+    assert record["logs"][6] == "The duel has ended! alice wins!"
+    assert find_battles(battle_id=f"{ALICE}_{BOB}") == [record]
+
+
+def test_running_battle_keeps_only_the_last_lines(monkeypatch):
+    monkeypatch.setattr(game_logic, "BATTLE_LOG_LIMIT", 2)
+    game_state = track_sections(utils.new_game_state())
+    run_game_command("register alice human warrior fire", ALICE, game_state)
+    run_game_command("register bob elf mage water", BOB, game_state)
+    run_game_command("duel bob", ALICE, game_state)
+    run_game_command("attack punch", ALICE, game_state)
+    run_game_command("attack punch", BOB, game_state)
+
+    battle = game_state["active_battles"][f"{ALICE}_{BOB}"]
+    assert [line.split()[0] for line in battle["logs"]] == ["alice", "bob"]
+    assert battle["trimmed_logs"] == 1
+    # Nothing is archived as a battle until it ends
+    assert find_battles(player=ALICE) == []
+
+
+def test_lines_trimmed_by_a_failing_command_are_not_archived(monkeypatch):
+    monkeypatch.setattr(game_logic, "BATTLE_LOG_LIMIT", 1)
+    battle = {"players": [ALICE, BOB], "logs": ["first"], "started_at": 100.0}
+
+    def fail(command, player_phone, game_state):
+        game_logic.add_battle_log("battle", battle, "second")
+        raise RuntimeError("failed after trimming")
+
+    monkeypatch.setattr(command_runner, "process_game_command", fail)
+    game_state = track_sections(utils.new_game_state())
+    with pytest.raises(RuntimeError):
+        run_game_command("quest 1", ALICE, game_state)
+    write_archived()
+    archive_battle("battle", battle, "completed")
+    write_archived()
+    assert find_battles(battle_id="battle")[0]["logs"] == ["second"]
+
+
+def test_battles_from_before_start_times_file_their_lines_under_a_fixed_time(monkeypatch):
+    monkeypatch.setattr(game_logic, "BATTLE_LOG_LIMIT", 1)
+    battle = {"players": [ALICE, BOB], "logs": ["first"], "updated_at": 100.0}
+    game_logic.add_battle_log("battle", battle, "second")
+    battle["updated_at"] = 200.0
+    game_logic.add_battle_log("battle", battle, "third")
+    archive_battle("battle", battle, "abandoned")
+    write_archived()
+    assert find_battles(battle_id="battle")[0]["logs"] == ["first", "second", "third"]
+
+
+def test_workers_share_the_archive_and_writes_are_idempotent():
+    record = {"battle_id": "b1", "players": [ALICE, BOB], "started_at": 1.0, "ended_at": 2.0, "logs": ["hit"]}
+    first, second = BattleArchive("archive.db"), BattleArchive("archive.db")
+    assert first.write([record]) == 1
+    assert second.write([record]) == 0
+    assert second.find(player=ALICE) == [record]
+    # The same players dueling again is a different battle
+    rematch = dict(record, started_at=3.0, ended_at=4.0)
+    assert first.write([rematch]) == 1
+    assert [found["started_at"] for found in second.find(battle_id="b1")] == [3.0, 1.0]
+
+
+def test_legacy_jsonl_archive_is_imported():
+    record = {"battle_id": "b1", "players": [ALICE, BOB], "ended_at": 2.0, "logs": []}
+    with open(battle_archive.BATTLE_ARCHIVE_FILE, "w", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    assert find_battles(player=BOB) == [dict(record, started_at=2.0)]
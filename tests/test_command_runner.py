@@ -0,0 +1,219 @@
+import os
+import json
+import random
+import threading
+import time
+
+import pytest
+
+import utils
+import journal
+import command_runner
+from catalog import get_catalog
+from command_runner import run_game_command
+from indexes import find_player_by_username
+from idempotency import cached_reply
+from locking import KeyedLocks, SharedExclusiveLock
+from player_store import PlayerStore
+from state_tracking import track_sections
+from twiml import message_twiml
+
+PHONES = ["+15550000001", "+15550000002", "+15550000003"]
+
+
+def run_threads(target, count):
+    threads = [threading.Thread(target=target, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert not any(thread.is_alive() for thread in threads), "threads did not finish (deadlock?)"
+
+
+def lifetime_experience(player):
+    """Total XP earned, including the XP spent on level ups"""
+    return sum(100 * level for level in range(1, player["level"])) + player["experience"]
+
+
+@pytest.fixture(params=[10 ** 9, 10], ids=["appends only", "frequent compactions"])
+def journal_mode(request, monkeypatch):
+    """Journal persistence; without compactions every change must be replayed in order"""
+    monkeypatch.setattr(utils, "PERSISTENCE_MODE", "journal")
+    monkeypatch.setattr(utils, "JOURNAL_COMPACT_EVERY", request.param)
+    monkeypatch.setattr(utils, "_journal_records", 0)
+
+
+def registered_state():
+    game_state = track_sections(utils.new_game_state())
+    for index, phone in enumerate(PHONES):
+        assert run_game_command(f"register player{index} human warrior fire", phone, game_state).startswith("Welcome")
+    return game_state
+
+
+def test_keyed_locks_serialize_the_same_key():
+    locks = KeyedLocks()
+    counter = {"value": 0}
+
+    def increment(index):
+        for _ in range(200):
+            with locks.hold(["player"]):
+                value = counter["value"]
+                time.sleep(0)
+                counter["value"] = value + 1
+
+    run_threads(increment, 8)
+    assert counter["value"] == 8 * 200
+    assert locks._locks == {}
+
+
+def test_keyed_locks_take_overlapping_keys_in_sorted_order():
+    locks = KeyedLocks()
+    order = []
+
+    def hold(index):
+        keys = ["a", "b"] if index % 2 else ["b", "a"]
+        for _ in range(200):
+            with locks.hold(keys):
+                order.append(index)
+
+    # Acquired in caller order, opposite key orders would deadlock within a few rounds
+    run_threads(hold, 4)
+    assert len(order) == 4 * 200
+    assert locks._locks == {}
+
+
+def test_exclusive_waits_for_shared_holders():
+    lock = SharedExclusiveLock()
+    events = []
+    inside = threading.Event()
+    release = threading.Event()
+
+    def reader():
+        with lock.shared():
+            events.append("shared")
+            inside.set()
+            release.wait(5)
+            events.append("shared done")
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    inside.wait(5)
+    timer = threading.Timer(0.05, release.set)
+    timer.start()
+    with lock.exclusive():
+        events.append("exclusive")
+    thread.join(5)
+    assert events == ["shared", "shared done", "exclusive"]
+
+
+def test_concurrent_commands_lose_no_updates():
+    game_state = registered_state()
+    quest = get_catalog().quest(1)
+    completed = {phone: 0 for phone in PHONES}
+    completed_lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(index)
+        for _ in range(50):
+            phone = rng.choice(PHONES)
+            if "completed" in run_game_command("quest 1", phone, game_state):
+                with completed_lock:
+                    completed[phone] += 1
+
+    run_threads(worker, 8)
+    assert sum(completed.values()) == 8 * 50
+    for phone in PHONES:
+        player = game_state["players"][phone]
+        assert player["gold"] == 100 + completed[phone] * quest.gold
+        assert lifetime_experience(player) == completed[phone] * quest.exp
+
+
+def test_journal_replay_matches_memory(journal_mode, monkeypatch):
+    """The journal must hold every command's changes in the order they were applied"""
+    append_changes = utils.append_changes
+
+    def slow_append(changes, *args, **kwargs):
+        # A slow disk: a command writing after its locks are released gets overtaken
+        time.sleep(random.random() / 500)
+        return append_changes(changes, *args, **kwargs)
+
+    monkeypatch.setattr(utils, "append_changes", slow_append)
+    game_state = registered_state()
+
+    def worker(index):
+        # Mostly one hot player, so commands on the same entries keep queuing on its lock
+        rng = random.Random(index)
+        for _ in range(60):
+            run_game_command("quest 1", PHONES[0] if rng.random() < 0.8 else rng.choice(PHONES), game_state)
+
+    run_threads(worker, 12)
+    utils.save_game_state(game_state, sync=True)
+
+    # Every quest adds gold, so a player's journaled values must keep increasing
+    with open(journal.JOURNAL_FILE, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    for phone in PHONES:
+        golds = [record["v"]["gold"] for record in records if record["s"] == "players" and record["k"] == phone]
+        assert golds == sorted(set(golds)), f"changes of {phone} were journaled out of order"
+
+    on_disk = utils.read_snapshot() if os.path.exists(utils.GAME_STATE_FILE) else utils.new_game_state()
+    journal.replay_journal(on_disk)
+    for phone in PHONES:
+        in_memory = game_state["players"][phone]
+        replayed = on_disk["players"][phone]
+        assert (replayed["gold"], replayed["level"], replayed["experience"]) == \
+            (in_memory["gold"], in_memory["level"], in_memory["experience"])
+
+
+def test_duplicate_message_sid_runs_once():
+    game_state = registered_state()
+    first = run_game_command("quest 1", PHONES[0], game_state, message_sid="SM1")
+    gold = game_state["players"][PHONES[0]]["gold"]
+    assert run_game_command("quest 1", PHONES[0], game_state, message_sid="SM1") is None
+    assert cached_reply("SM1") == message_twiml(first)
+    assert game_state["players"][PHONES[0]]["gold"] == gold
+    assert "processed_messages" not in game_state
+
+
+def fail_halfway(command, player_phone, game_state):
+    """A command that modifies, adds and deletes entries, then raises"""
+    players = game_state["players"]
+    players[player_phone]["gold"] += 1000
+    players[player_phone]["inventory"].append("Stolen Sword")
+    players["+15559999999"] = dict(players[PHONES[1]], username="intruder")
+    del players[PHONES[2]]
+    raise RuntimeError("command failed halfway")
+
+
+def snapshot_players(players):
+    return {phone: json.loads(json.dumps(players.peek(phone))) for phone in sorted(players)}
+
+
+@pytest.mark.parametrize("store", ["memory", "indexed"])
+def test_failing_command_is_rolled_back(store, journal_mode, monkeypatch, tmp_path):
+    game_state = registered_state()
+    if store == "indexed":
+        players = dict(game_state["players"])
+        game_state["players"] = PlayerStore.from_game_state(players, directory=str(tmp_path / "players"))
+    before = snapshot_players(game_state["players"])
+
+    with monkeypatch.context() as patch, pytest.raises(RuntimeError):
+        patch.setattr(command_runner, "process_game_command", fail_halfway)
+        run_game_command("quest 1", PHONES[0], game_state)
+
+    assert snapshot_players(game_state["players"]) == before
+    assert find_player_by_username("intruder", game_state) is None
+    assert find_player_by_username("player2", game_state) == PHONES[2]
+
+    # The next command persists its own changes only
+    assert "completed" in run_game_command("quest 1", PHONES[0], game_state)
+    utils.save_game_state(game_state, sync=True)
+    expected = snapshot_players(game_state["players"])
+    assert expected[PHONES[0]]["gold"] == before[PHONES[0]]["gold"] + get_catalog().quest(1).gold
+    if store == "indexed":
+        on_disk = snapshot_players(PlayerStore(directory=str(tmp_path / "players")))
+    else:
+        on_disk = utils.read_snapshot() if os.path.exists(utils.GAME_STATE_FILE) else utils.new_game_state()
+        journal.replay_journal(on_disk)
+        on_disk = {phone: on_disk["players"][phone] for phone in sorted(on_disk["players"])}
+    assert on_disk == expected
@@ -0,0 +1,58 @@
+import itertools
+import random
+
+import benchmarks
+import game_logic
+from benchmarks import reference_damage
+from game_logic import RACES, CLASSES, ELEMENTS, ZONES, SKILLS, calculate_damage
+
+# Every skill a player can use, plus one the damage rules know nothing about
+ALL_SKILLS = SKILLS + ["Fireball", "Unknown Skill"]
+
+# Attribute sets covering the strength and intelligence terms
+ATTRIBUTES = [{"strength": 3, "intelligence": 11}, {"strength": 17, "intelligence": 2}]
+
+
+def attacker(race, char_class, element, attributes):
+    return {"race": race, "class": char_class, "element": element, "attributes": attributes}
+
+
+def seeded(function, cases, seed=7):
+    random.seed(seed)
+    return [function(*case) for case in cases]
+
+
+def test_damage_matches_the_rules_for_every_combination():
+    cases = [
+        (attacker(race, char_class, element, attributes), {"element": defender_element}, skill, zone)
+        for race, char_class, element, defender_element, zone, skill, attributes in itertools.product(
+            RACES, CLASSES, ELEMENTS, ELEMENTS, ZONES, ALL_SKILLS, ATTRIBUTES
+        )
+    ]
+    assert seeded(calculate_damage, cases) == seeded(reference_damage, cases)
+
+
+def test_damage_matches_the_rules_outside_the_game_data():
+    cases = [
+        (attacker(race, char_class, element, ATTRIBUTES[0]), {"element": defender_element}, skill, zone)
+        for race, char_class, element, defender_element, zone, skill in itertools.product(
+            [RACES[0], "Giant"], [CLASSES[0], "Bard"], [ELEMENTS[0], "Void"], [ELEMENTS[1], "Void"],
+            [ZONES[0], "Nowhere"], ALL_SKILLS
+        )
+    ]
+    assert seeded(calculate_damage, cases) == seeded(reference_damage, cases)
+
+
+def test_unrounded_damage_is_bit_identical(monkeypatch):
+    # Rounding can hide a last-bit difference, so compare the raw products
+    monkeypatch.setattr(game_logic, "round", lambda value: value, raising=False)
+    monkeypatch.setattr(benchmarks, "round", lambda value: value, raising=False)
+    cases = [
+        (attacker(race, char_class, element, ATTRIBUTES[0]), {"element": defender_element}, skill, zone)
+        for race, char_class, element, defender_element, zone, skill in itertools.product(
+            RACES, CLASSES, ELEMENTS, ELEMENTS, ZONES, ALL_SKILLS
+        )
+    ]
+    compiled = seeded(calculate_damage, cases)
+    assert all(isinstance(damage, float) for damage in compiled)
+    assert [damage.hex() for damage in compiled] == [damage.hex() for damage in seeded(reference_damage, cases)]
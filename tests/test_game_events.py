@@ -0,0 +1,126 @@
+import pytest
+
+import command_runner
+import game_events
+import utils
+from command_runner import run_game_command
+from game_events import BATTLE_END, BATTLE_START, TURN, TURN_TAKEN, WASTED_POLL, GameEvent, TurnNotifier, emit_event
+from game_logic import process_game_command
+from state_tracking import track_sections
+from test_shared_store import commit_gold, open_worker
+
+ALICE, BOB = "+15550000001", "+15550000002"
+
+
+def test_only_notices_delivered_to_waiting_players_avoid_polls():
+    sent = []
+
+    def send(phone, message):
+        if phone == "+3":
+            raise ConnectionError("unreachable")
+        sent.append(phone)
+
+    notifier = TurnNotifier(send)
+    for phone in ("+1", "+2", "+3", "+4"):
+        notifier.submit(GameEvent(TURN, phone, "It's your turn", f"battle{phone}"))
+    # +2 moved before its notice went out, +4's battle ended
+    notifier.submit(GameEvent(TURN_TAKEN, "+2", "", "battle+2"))
+    notifier.submit(GameEvent(BATTLE_END, "+4", "You lost", "battle+4"))
+    notifier.submit(GameEvent(WASTED_POLL, "+5", "", "battle+5"))
+    notifier.start().stop(timeout=5)
+    notifier.submit(GameEvent(TURN_TAKEN, "+1", "", "battle+1"))
+
+    assert sent == ["+1", "+2", "+4", "+4"]
+    metrics = notifier.metrics()
+    assert (metrics["sent"], metrics["failed"], metrics["wasted_polls"]) == (4, 1, 1)
+    assert metrics["polls_avoided"] == 1
+
+
+def test_dropped_notices_avoid_no_polls():
+    notifier = TurnNotifier(lambda phone, message: None, queue_size=1)
+    assert notifier.submit(GameEvent(BATTLE_START, "+1", "Duel!", "b1"))
+    assert not notifier.submit(GameEvent(TURN, "+2", "It's your turn", "b2"))
+    notifier.start().stop(timeout=5)
+    assert notifier.metrics()["dropped"] == 1 and notifier.metrics()["polls_avoided"] == 0
+
+
+class Recorder:
+    """Stands in for the notifier, recording what was published"""
+
+    def __init__(self, log):
+        self.log = log
+
+    def submit(self, event):
+        self.log.append((event.kind, event.phone))
+        return True
+
+
+@pytest.fixture
+def published(monkeypatch):
+    log = []
+    monkeypatch.setattr(game_events, "_notifier", Recorder(log))
+    return log
+
+
+@pytest.fixture
+def game_state(published):
+    game_state = track_sections(utils.new_game_state())
+    run_game_command("register alice human warrior fire", ALICE, game_state)
+    run_game_command("register bob elf mage water", BOB, game_state)
+    return game_state
+
+
+def test_events_are_published_after_the_changes_are_saved(game_state, published, monkeypatch):
+    def complete_save(*args, **kwargs):
+        published.append("saved")
+        return utils.complete_save(*args, **kwargs)
+
+    monkeypatch.setattr(command_runner, "complete_save", complete_save)
+    run_game_command("duel bob", ALICE, game_state)
+    assert published == ["saved", (BATTLE_START, BOB)]
+
+
+def test_events_of_a_command_that_was_not_saved_are_discarded(game_state, published, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(utils, "write_changes", fail)
+        run_game_command("duel bob", ALICE, game_state)
+    assert published == []
+    # Nothing is left over for the next command to publish
+    run_game_command("quest 1", ALICE, game_state)
+    assert published == []
+
+
+def test_events_of_a_failing_command_are_discarded(game_state, published, monkeypatch):
+    def fail(command, player_phone, game_state):
+        emit_event(TURN, BOB, "It's your turn", "b1")
+        raise RuntimeError("failed after raising an event")
+
+    with monkeypatch.context() as patch, pytest.raises(RuntimeError):
+        patch.setattr(command_runner, "process_game_command", fail)
+        run_game_command("duel bob", ALICE, game_state)
+    run_game_command("quest 1", ALICE, game_state)
+    assert published == []
+
+
+def test_events_of_a_conflicting_attempt_are_discarded(published, monkeypatch):
+    monkeypatch.setattr(utils, "PERSISTENCE_MODE", "shared")
+    monkeypatch.setattr(utils, "_shared_store", None)
+    game_state = utils.load_game_state()
+    run_game_command("register alice human warrior fire", ALICE, game_state)
+    other, other_state = open_worker(utils._shared_store.path)
+    runs = []
+
+    def quest_racing_another_worker(command, player_phone, game_state):
+        runs.append(command)
+        emit_event(TURN, f"+{len(runs)}", "It's your turn", "b1")
+        if len(runs) == 1:
+            assert commit_gold(other, other_state, ALICE, 1000)
+        return process_game_command(command, player_phone, game_state)
+
+    monkeypatch.setattr(command_runner, "process_game_command", quest_racing_another_worker)
+    run_game_command("quest 1", ALICE, game_state)
+    assert len(runs) == 2
+    assert published == [(TURN, "+2")]
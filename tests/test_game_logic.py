@@ -0,0 +1,57 @@
+import re
+
+import utils
+from command_runner import run_game_command
+from game_logic import COMMANDS, get_help_text, process_game_command
+from state_tracking import track_sections
+
+ALICE, BOB = "+15550000001", "+15550000002"
+
+
+def quoted_commands(text):
+    """Return the command words of the 'command ...' examples quoted in a reply"""
+    return {example.split()[0] for example in re.findall(r"'([^']+)'", text)}
+
+
+def test_welcome_only_mentions_registered_commands():
+    game_state = track_sections(utils.new_game_state())
+    welcome = process_game_command("register alice human warrior fire", ALICE, game_state)
+    assert welcome.startswith("Welcome alice, the Human Warrior!")
+    assert quoted_commands(welcome) <= set(COMMANDS)
+
+
+def test_help_lists_every_registered_command():
+    help_text = get_help_text()
+    for spec in COMMANDS.values():
+        assert f"- {spec.usage}: {spec.description}" in help_text
+
+
+def dueling_state(alice_skills):
+    game_state = track_sections(utils.new_game_state())
+    run_game_command("register alice human warrior fire", ALICE, game_state)
+    run_game_command("register bob elf mage water", BOB, game_state)
+    game_state["players"][ALICE]["skills"] = alice_skills
+    run_game_command("duel bob", ALICE, game_state)
+    return game_state
+
+
+def last_log(game_state):
+    return game_state["active_battles"][f"{ALICE}_{BOB}"]["logs"][-1]
+
+
+def test_attack_uses_an_owned_catalog_skill():
+    game_state = dueling_state(["Punch", "Precision Shot"])
+    run_game_command("attack PRECISION shot", ALICE, game_state)
+    assert last_log(game_state).startswith("alice used Precision Shot")
+
+
+def test_attack_uses_an_owned_skill_missing_from_the_catalog():
+    game_state = dueling_state(["Punch", "Shadow Strike"])
+    run_game_command("attack shadow STRIKE", ALICE, game_state)
+    assert last_log(game_state).startswith("alice used Shadow Strike")
+
+
+def test_attack_falls_back_to_punch_for_skills_not_owned():
+    game_state = dueling_state(["Punch"])
+    run_game_command("attack precision shot", ALICE, game_state)
+    assert last_log(game_state).startswith("alice used Punch")
@@ -0,0 +1,105 @@
+import sqlite3
+
+import pytest
+
+import idempotency
+import twilio_integration
+import utils
+from idempotency import ReplyStore, cached_reply, remember_reply, reply_store
+from state_tracking import track_sections
+from twiml import message_twiml
+
+
+def rows(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT message_sid, response FROM processed_messages ORDER BY expires_at").fetchall()
+
+
+def test_retry_gets_the_same_response_without_running_again():
+    game_state = track_sections(utils.new_game_state())
+    phone = "whatsapp:+15550000001"
+    twilio_integration.process_incoming_message("register player1 human warrior fire", phone, game_state, "SM1")
+    first = twilio_integration.process_incoming_message("quest 1", phone, game_state, "SM2")
+    gold = game_state["players"]["+15550000001"]["gold"]
+
+    assert twilio_integration.process_incoming_message("quest 1", phone, game_state, "SM2") == first
+    assert game_state["players"]["+15550000001"]["gold"] == gold
+
+
+def test_retry_is_answered_from_memory(monkeypatch):
+    remember_reply("SM1", message_twiml("Done"))
+
+    def no_disk():
+        raise AssertionError("the table was read")
+
+    monkeypatch.setattr(reply_store(), "_connection", no_disk)
+    assert cached_reply("SM1") == message_twiml("Done")
+
+
+def test_responses_survive_a_restart():
+    remember_reply("SM1", message_twiml("Done"))
+    idempotency.use_reply_store(ReplyStore())
+    assert cached_reply("SM1", durable=False) is None
+    assert cached_reply("SM1") == message_twiml("Done")
+    # Read once, then kept in memory
+    assert cached_reply("SM1", durable=False) == message_twiml("Done")
+
+
+def test_responses_expire():
+    remember_reply("SM1", "<Response />", now=1000)
+    assert cached_reply("SM1", now=1000 + idempotency.IDEMPOTENCY_TTL - 1) == "<Response />"
+    assert cached_reply("SM1", now=1000 + idempotency.IDEMPOTENCY_TTL) is None
+    idempotency.use_reply_store(ReplyStore())
+    assert cached_reply("SM1", now=1000 + idempotency.IDEMPOTENCY_TTL) is None
+
+
+def test_expired_responses_are_purged():
+    for index in range(10):
+        remember_reply(f"SM{index}", "old", now=1000)
+    remember_reply("SM-new", "new", now=1000 + idempotency.IDEMPOTENCY_TTL + 1)
+    assert len(rows(idempotency.IDEMPOTENCY_DB)) == 1
+
+
+def test_memory_is_bounded():
+    store = ReplyStore(memory_entries=3)
+    for index in range(5):
+        store.remember(f"SM{index}", f"response {index}")
+    assert list(store._recent) == ["SM2", "SM3", "SM4"]
+    # Evicted from memory, still answered from the table
+    assert store.get("SM0", durable=False) is None
+    assert store.get("SM0") == "response 0"
+
+
+def test_table_is_bounded(monkeypatch):
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_MAX_ENTRIES", 5)
+    for index in range(20):
+        remember_reply(f"SM{index}", f"response {index}", now=1000 + index)
+    assert rows(idempotency.IDEMPOTENCY_DB) == [(f"SM{index}", f"response {index}") for index in range(15, 20)]
+
+
+@pytest.mark.parametrize("reply", ["Welcome & good luck <player1>", ""])
+def test_plain_replies_of_earlier_versions_are_rendered(reply):
+    with sqlite3.connect(idempotency.IDEMPOTENCY_DB) as connection:
+        connection.executescript("""
+            CREATE TABLE processed_messages (message_sid TEXT PRIMARY KEY, reply TEXT NOT NULL, expires_at REAL NOT NULL);
+            CREATE INDEX processed_messages_expiry ON processed_messages (expires_at);
+        """)
+        connection.execute("INSERT INTO processed_messages VALUES ('SM1', ?, 9e18)", (reply,))
+    assert cached_reply("SM1") == message_twiml(reply)
+    # Opening the converted table again leaves it alone
+    idempotency.use_reply_store(ReplyStore())
+    assert cached_reply("SM1") == message_twiml(reply)
+
+
+def test_shared_mode_commits_the_response_with_the_command(monkeypatch):
+    monkeypatch.setattr(utils, "PERSISTENCE_MODE", "shared")
+    monkeypatch.setattr(utils, "_shared_store", None)
+    game_state = utils.load_game_state()
+    phone = "whatsapp:+15550000001"
+    twilio_integration.process_incoming_message("register player1 human warrior fire", phone, game_state, "SM1")
+    first = twilio_integration.process_incoming_message("quest 1", phone, game_state, "SM2")
+
+    assert ("SM2", first) in rows(utils._shared_store.path)
+    # Another worker starting on the same database answers the retry from the table
+    idempotency.use_reply_store(ReplyStore(utils._shared_store.path))
+    assert twilio_integration.process_incoming_message("quest 1", phone, game_state, "SM2") == first
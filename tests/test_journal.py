@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+import utils
+from command_runner import run_game_command
+from journal import JOURNAL_FILE, append_changes, compact_journal, replay_journal
+from state_tracking import encode_record
+
+ALICE, BOB = "+15550000001", "+15550000002"
+
+
+def change(phone, gold):
+    return ("players", phone, encode_record({"username": phone, "gold": gold}))
+
+
+def replayed():
+    game_state = utils.new_game_state()
+    count = replay_journal(game_state)
+    return count, game_state["players"]
+
+
+def test_replay_applies_records_in_order():
+    append_changes([change(ALICE, 1), change(BOB, 1)])
+    append_changes([change(ALICE, 2), ("players", BOB, None)])
+    assert replayed() == (4, {ALICE: {"username": ALICE, "gold": 2}})
+
+
+@pytest.mark.parametrize("torn", ['{"s":"players","k":"+15550000002","v":{"gold"', '{"s":"players","k":"x","d":1}'],
+                         ids=["partial record", "missing line end"])
+def test_torn_last_line_is_cut_off(torn):
+    append_changes([change(ALICE, 1)])
+    size = os.path.getsize(JOURNAL_FILE)
+    with open(JOURNAL_FILE, "a", encoding="utf-8") as f:
+        f.write(torn)
+
+    assert replayed() == (1, {ALICE: {"username": ALICE, "gold": 1}})
+    assert os.path.getsize(JOURNAL_FILE) == size
+    # Appends after the crash are replayed too
+    append_changes([change(BOB, 5)])
+    assert replayed()[0] == 2
+
+
+def test_replaying_a_journal_that_survived_compaction_is_harmless():
+    append_changes([change(ALICE, 1), change(BOB, 1), ("players", BOB, None)])
+    _, players = replayed()
+    with open(JOURNAL_FILE, encoding="utf-8") as f:
+        survivor = f.read()
+
+    compact_journal(lambda: utils.write_snapshot({"players": players}))
+    assert os.path.getsize(JOURNAL_FILE) == 0
+    # A crash after the snapshot was written but before the journal was truncated
+    with open(JOURNAL_FILE, "w", encoding="utf-8") as f:
+        f.write(survivor)
+    game_state = utils.read_snapshot()
+    replay_journal(game_state)
+    assert game_state["players"] == players
+
+
+def test_state_is_rebuilt_from_the_compacted_snapshot_and_the_journal(monkeypatch):
+    monkeypatch.setattr(utils, "PERSISTENCE_MODE", "journal")
+    monkeypatch.setattr(utils, "JOURNAL_COMPACT_EVERY", 3)
+    monkeypatch.setattr(utils, "_journal_records", 0)
+    game_state = utils.load_game_state()
+    run_game_command("register alice human warrior fire", ALICE, game_state)
+    run_game_command("register bob elf mage water", BOB, game_state)
+    for _ in range(3):
+        run_game_command("quest 1", ALICE, game_state)
+
+    with open(JOURNAL_FILE, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    # Compacted at least once, so the journal only holds the latest records
+    assert 0 < len(records) < 3
+    assert utils.state_as_dict(utils.load_game_state()) == utils.state_as_dict(game_state)
@@ -0,0 +1,169 @@
+import pytest
+
+import outbound_spool
+from outbound_spool import OutboundSpool
+
+ALICE, BOB = "+15550000001", "+15550000002"
+
+
+class Clock:
+    """Stands in for the time module, so leases and backoff can be stepped through"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class Recipient:
+    """Delivery function recording what was sent; a message fails while listed in failures"""
+
+    def __init__(self):
+        self.sent = []
+        self.failures = {}
+
+    def __call__(self, phone, body):
+        error = self.failures.get(body)
+        if error is not None:
+            raise error
+        self.sent.append((phone, body))
+
+
+class ApiError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(outbound_spool, "time", clock)
+    # No jitter: every retry waits the longest delay
+    monkeypatch.setattr(outbound_spool.random, "uniform", lambda low, high: high)
+    return clock
+
+
+@pytest.fixture
+def recipient():
+    return Recipient()
+
+
+@pytest.fixture
+def spool(clock, recipient):
+    spool = OutboundSpool(recipient, path="spool.db", workers=4, max_attempts=3)
+    yield spool
+    spool.stop()
+
+
+def drain(spool):
+    while spool.deliver_batch():
+        pass
+
+
+def test_each_phone_gets_its_messages_in_order(spool, recipient):
+    for number in range(5):
+        spool.enqueue(ALICE, f"alice {number}")
+        spool.enqueue(BOB, f"bob {number}")
+
+    # One message per phone per batch, the oldest one
+    assert spool.deliver_batch() == 2
+    assert sorted(recipient.sent) == [(ALICE, "alice 0"), (BOB, "bob 0")]
+    drain(spool)
+    for phone, name in ((ALICE, "alice"), (BOB, "bob")):
+        assert [body for to, body in recipient.sent if to == phone] == [f"{name} {number}" for number in range(5)]
+    assert spool.metrics()["depth"] == 0
+
+
+def test_a_retried_message_holds_back_the_next_one(spool, recipient, clock):
+    recipient.failures["first"] = ConnectionError("timeout")
+    spool.enqueue(ALICE, "first")
+    spool.enqueue(ALICE, "second")
+    spool.enqueue(BOB, "other phone")
+
+    assert spool.deliver_batch() == 2
+    assert recipient.sent == [(BOB, "other phone")]
+    # "second" waits until "first" went out
+    assert spool.deliver_batch() == 0
+
+    del recipient.failures["first"]
+    clock.now += outbound_spool.OUTBOUND_BACKOFF_BASE
+    drain(spool)
+    assert recipient.sent[1:] == [(ALICE, "first"), (ALICE, "second")]
+
+
+def test_expired_lease_is_claimed_again(spool, recipient, clock):
+    spool.enqueue(ALICE, "hello")
+    # A worker that claimed the message and crashed before sending it
+    crashed = OutboundSpool(recipient, path="spool.db", workers=1)
+    assert len(crashed._claim()) == 1
+    crashed.stop()
+
+    assert spool.deliver_batch() == 0
+    clock.now += outbound_spool.OUTBOUND_LEASE
+    assert spool.deliver_batch() == 1
+    assert recipient.sent == [(ALICE, "hello")]
+
+
+def next_attempt(spool):
+    attempts, next_attempt_at = spool._connection().execute(
+        "SELECT attempts, next_attempt_at FROM outbox WHERE dead_at IS NULL"
+    ).fetchone()
+    return attempts, next_attempt_at
+
+
+def test_retries_back_off_exponentially(clock, recipient, monkeypatch):
+    monkeypatch.setattr(outbound_spool, "OUTBOUND_BACKOFF_MAX", 20)
+    spool = OutboundSpool(recipient, path="spool.db", workers=1, max_attempts=10)
+    recipient.failures["hello"] = ConnectionError("timeout")
+    spool.enqueue(ALICE, "hello")
+
+    delays = []
+    for _ in range(5):
+        assert spool.deliver_batch() == 1
+        attempts, next_attempt_at = next_attempt(spool)
+        delays.append(next_attempt_at - clock.now)
+        # Not retried before its time
+        clock.now = next_attempt_at - 0.01
+        assert spool.deliver_batch() == 0
+        clock.now = next_attempt_at
+    spool.stop()
+
+    base = outbound_spool.OUTBOUND_BACKOFF_BASE
+    assert attempts == 5
+    assert delays == [min(20, base * 2 ** attempt) for attempt in range(5)]
+    assert spool.metrics()["retried"] == 5
+
+
+def test_message_is_dead_lettered_after_max_attempts(spool, recipient, clock):
+    recipient.failures["doomed"] = ConnectionError("timeout")
+    spool.enqueue(ALICE, "doomed")
+    spool.enqueue(ALICE, "after")
+
+    for _ in range(3):
+        assert spool.deliver_batch() == 1
+        clock.now += outbound_spool.OUTBOUND_BACKOFF_MAX
+
+    [dead] = spool.dead_letters()
+    assert (dead["body"], dead["attempts"], dead["last_error"]) == ("doomed", 3, "timeout")
+    # A dead letter no longer holds back the phone's later messages
+    drain(spool)
+    assert recipient.sent == [(ALICE, "after")]
+    assert spool.metrics()["dead_letters"] == 1
+
+    del recipient.failures["doomed"]
+    assert spool.requeue_dead_letters() == 1
+    drain(spool)
+    assert recipient.sent == [(ALICE, "after"), (ALICE, "doomed")]
+
+
+def test_permanent_failure_is_dead_lettered_at_once(spool, recipient):
+    recipient.failures["bad number"] = ApiError(400)
+    recipient.failures["rate limited"] = ApiError(429)
+    spool.enqueue(ALICE, "bad number")
+    spool.enqueue(BOB, "rate limited")
+
+    assert spool.deliver_batch() == 2
+    assert [dead["body"] for dead in spool.dead_letters()] == ["bad number"]
+    assert next_attempt(spool)[0] == 1
@@ -0,0 +1,115 @@
+import pytest
+
+import utils
+from indexes import PLAYER_SORTS, decode_cursor, encode_cursor, player_listing
+from state_tracking import collect_changes, reset_tracking, track_sections
+
+RACES = ["Human", "Elf", "Dwarf"]
+
+
+def new_player(index, **changes):
+    player = {"username": f"player{index}", "race": RACES[index % 3], "class": "Warrior", "element": "Fire",
+              "level": index % 5 + 1, "rank": "G", "gold": index * 7 % 11, "created_at": 1000.0 + index,
+              "in_battle": index % 4 == 0, "is_deity": False}
+    player.update(changes)
+    return player
+
+
+def phone(index):
+    return f"+1555{index:07d}"
+
+
+@pytest.fixture
+def game_state():
+    game_state = track_sections(utils.new_game_state())
+    game_state["players"].update({phone(index): new_player(index) for index in range(25)})
+    # Changes reach the indexes when they are collected, as after a command
+    collect_changes(game_state)
+    return game_state
+
+
+def change(game_state, edit):
+    """Apply edit to the players section the way a command would"""
+    reset_tracking(game_state)
+    edit(game_state["players"])
+    collect_changes(game_state)
+
+
+def all_pages(listing, limit, **kwargs):
+    pages, cursor = [], None
+    while True:
+        phones, cursor, _ = listing.page(after=cursor, limit=limit, **kwargs)
+        pages.append(phones)
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize("sort", PLAYER_SORTS)
+@pytest.mark.parametrize("descending", [False, True])
+def test_pages_list_every_player_once_in_order(game_state, sort, descending):
+    players = game_state["players"]
+    expected = sorted(players, key=lambda phone: (PLAYER_SORTS[sort](players[phone]), phone), reverse=descending)
+    pages = all_pages(player_listing(game_state), 7, sort=sort, descending=descending)
+    assert [len(page) for page in pages] == [7, 7, 7, 4]
+    assert sum(pages, []) == expected
+
+
+def test_filters_are_combined(game_state):
+    listing = player_listing(game_state)
+    players = game_state["players"]
+    elves = sorted((phone for phone, player in players.items() if player["race"] == "Elf"),
+                   key=lambda phone: players[phone]["created_at"])
+    assert listing.page(filters={"race": "elf"}) == (elves, None, len(elves))
+
+    resting_elves = [phone for phone in elves if not players[phone]["in_battle"]]
+    assert sum(all_pages(listing, 2, filters={"race": "ELF", "in_battle": "false"}), []) == resting_elves
+    # The total is only reported when it is known without walking the list
+    assert listing.page(filters={"race": "elf", "in_battle": "false"})[2] is None
+    assert listing.page(filters={"race": "orc"}) == ([], None, 0)
+
+
+def test_cursor_is_stable_across_inserts(game_state):
+    listing = player_listing(game_state)
+    first, cursor, _ = listing.page(limit=10)
+
+    def register(players):
+        players[phone(100)] = new_player(100, created_at=0.0)
+        players[phone(101)] = new_player(101, created_at=1010.5)
+
+    change(game_state, register)
+    second, cursor, _ = listing.page(after=cursor, limit=10)
+    # Players sorted before the cursor are not repeated, players after it are listed in place
+    assert not set(first) & set(second)
+    assert second == [phone(10), phone(101)] + [phone(index) for index in range(11, 19)]
+
+
+def test_cursor_is_stable_across_renames_and_deletions(game_state):
+    listing = player_listing(game_state)
+    first, cursor, _ = listing.page(sort="created", limit=10)
+    assert first[-1] == phone(9)
+
+    def rename_and_delete(players):
+        players[phone(12)]["username"] = "renamed"
+        del players[phone(9)]
+
+    change(game_state, rename_and_delete)
+    second, _, _ = listing.page(sort="created", after=cursor, limit=10)
+    assert second == [phone(index) for index in range(10, 20)]
+
+
+def test_changed_sort_value_moves_the_player(game_state):
+    listing = player_listing(game_state)
+
+    def level_up(players):
+        players[phone(3)]["level"] = 50
+
+    change(game_state, level_up)
+    assert listing.page(sort="level", descending=True, limit=1)[0] == [phone(3)]
+    assert phone(3) not in listing.page(sort="level", limit=24)[0]
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor((12.5, "+15550000001"))) == (12.5, "+15550000001")
+    for cursor in ("not base64!", encode_cursor(("12", "+1")), "W10="):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
@@ -0,0 +1,136 @@
+import os
+
+import pytest
+
+from player_store import INDEX_FILE, PlayerStore
+from state_tracking import encode_record
+
+PHONES = [f"+1555000{index:04d}" for index in range(10)]
+
+
+def player(index, gold=100):
+    return {"username": f"player{index}", "gold": gold}
+
+
+@pytest.fixture
+def players():
+    return {phone: player(index) for index, phone in enumerate(PHONES)}
+
+
+def open_store(**kwargs):
+    return PlayerStore(directory="players", **kwargs)
+
+
+def contents(store):
+    return {phone: store.peek(phone) for phone in store}
+
+
+def test_decoded_players_are_bounded(players):
+    store = PlayerStore.from_game_state(players, directory="players", cache_size=3)
+    for phone in PHONES:
+        assert store[phone] == players[phone]
+    store.discard()
+    assert list(store._materialized) == PHONES[-3:]
+    # Evicted players are read again from disk
+    assert store.peek(PHONES[0]) == players[PHONES[0]]
+
+
+def test_unsaved_changes_are_never_evicted(players):
+    store = PlayerStore.from_game_state(players, directory="players", cache_size=1)
+    store[PHONES[0]]["gold"] = 500
+    del store[PHONES[1]]
+    store["+15559999999"] = player(99)
+    for phone in PHONES[2:]:
+        store.peek(phone)
+    assert store.peek(PHONES[0])["gold"] == 500
+
+    changes = store.drain()
+    assert len(changes) == 3
+    for phone in PHONES[2:]:
+        store.peek(phone)
+    # Drained but not persisted yet
+    assert store.peek(PHONES[0])["gold"] == 500
+    assert PHONES[1] not in store and "+15559999999" in store
+    assert len(store) == len(PHONES)
+
+    store.persist(changes)
+    assert len(store._materialized) == 1
+    reopened = open_store()
+    assert reopened.peek(PHONES[0])["gold"] == 500
+    assert PHONES[1] not in reopened and reopened.peek("+15559999999") == player(99)
+
+
+def test_rolled_back_players_are_read_again(players):
+    store = PlayerStore.from_game_state(players, directory="players", cache_size=1)
+    store[PHONES[0]]["gold"] = 500
+    store.rollback()
+    for phone in PHONES[1:]:
+        store.peek(phone)
+    assert store.peek(PHONES[0]) == players[PHONES[0]]
+    assert store._pins == {} and store._dirty == {}
+
+
+def test_reopened_store_has_the_latest_records(players):
+    store = PlayerStore.from_game_state(players, directory="players")
+    store.persist([(PHONES[0], encode_record(player(0, gold=1))), (PHONES[1], None)])
+    store.persist([(PHONES[0], encode_record(player(0, gold=2)))])
+
+    expected = dict(players, **{PHONES[0]: player(0, gold=2)})
+    del expected[PHONES[1]]
+    assert contents(open_store()) == expected
+    # Usernames come from the index alone
+    assert dict(open_store().index_entries(["username"])) == {phone: {"username": value["username"]}
+                                                              for phone, value in expected.items()}
+
+
+def test_compaction_keeps_only_current_records(players):
+    store = PlayerStore.from_game_state(players, directory="players")
+    for gold in range(5):
+        store.persist([(phone, encode_record(player(index, gold))) for index, phone in enumerate(PHONES)])
+    store.persist([(PHONES[0], None)])
+    old_data_path = store._data_path
+    expected = contents(store)
+
+    store.compact()
+    assert not os.path.exists(old_data_path)
+    assert sorted(os.listdir("players")) == ["players.1.dat", INDEX_FILE]
+    # One newline-terminated record per player
+    assert os.path.getsize(store._data_path) == store.live_bytes() + len(expected)
+    assert contents(store) == expected
+    assert contents(open_store()) == expected
+
+    # Appends after compaction go to the new data file
+    store.persist([(PHONES[1], encode_record(player(1, gold=42)))])
+    assert open_store().peek(PHONES[1])["gold"] == 42
+
+
+def test_torn_index_line_is_cut_off(players):
+    store = PlayerStore.from_game_state(players, directory="players")
+    with open(os.path.join("players", INDEX_FILE), "a", encoding="utf-8") as f:
+        f.write(f"{PHONES[0]}\t12")
+
+    reopened = open_store()
+    assert contents(reopened) == players
+    # The next append starts on a line of its own
+    reopened.persist([(PHONES[0], encode_record(player(0, gold=7)))])
+    assert open_store().peek(PHONES[0])["gold"] == 7
+
+
+def test_trailing_partial_record_is_ignored(players):
+    store = PlayerStore.from_game_state(players, directory="players")
+    # A crash after part of a record reached the data file, before its index entry was written
+    with open(store._data_path, "ab") as f:
+        f.write(b'{"username": "player0", "go')
+
+    reopened = open_store()
+    assert contents(reopened) == players
+    reopened.persist([(PHONES[0], encode_record(player(0, gold=7)))])
+    assert open_store().peek(PHONES[0])["gold"] == 7
+
+
+def test_index_entry_past_the_end_of_the_data_keeps_the_previous_record(players):
+    store = PlayerStore.from_game_state(players, directory="players")
+    size = os.path.getsize(store._data_path)
+    with open(os.path.join("players", INDEX_FILE), "a", encoding="utf-8") as f:
+        f.write(f"{PHONES[0]}\t{size}\t20\tplayer0\n")
+    assert open_store().peek(PHONES[0]) == players[PHONES[0]]
@@ -0,0 +1,47 @@
+import os
+
+import utils
+from command_runner import run_game_command
+from record_store import GAME_STATE_DIR, load_records, record_path, write_all, write_changes
+from state_tracking import encode_record
+
+# Keys that need quoting in file names
+KEYS = ["+15550000001", "player/with/slashes", "Ünïcode name", "..", "a b?c%"]
+
+
+def test_written_state_loads_back_unchanged():
+    game_state = utils.new_game_state()
+    game_state["players"] = {key: {"username": key, "gold": index} for index, key in enumerate(KEYS)}
+    game_state["odd/section"] = {"key": [1, 2, {"nested": None}]}
+    write_all(game_state)
+    # Empty sections survive too
+    assert load_records() == game_state
+
+
+def test_changes_and_deletions_are_written():
+    write_all(utils.new_game_state())
+    write_changes([("players", key, encode_record({"gold": 1})) for key in KEYS])
+    write_changes([("players", KEYS[0], encode_record({"gold": 2})), ("players", KEYS[1], None),
+                   ("players", "never written", None), ("active_battles", "b1", encode_record({"turn": 0}))])
+
+    loaded = load_records()
+    assert loaded["players"] == dict({key: {"gold": 1} for key in KEYS[2:]}, **{KEYS[0]: {"gold": 2}})
+    assert loaded["active_battles"] == {"b1": {"turn": 0}}
+    assert not os.path.exists(record_path("players", KEYS[1]))
+
+
+def test_leftover_temp_files_are_ignored():
+    write_all({"players": {KEYS[0]: {"gold": 1}}})
+    with open(os.path.join(os.path.dirname(record_path("players", KEYS[0])), ".tmp-crashed"), "w") as f:
+        f.write('{"gold":')
+    assert load_records() == {"players": {KEYS[0]: {"gold": 1}}}
+
+
+def test_records_mode_restores_commands(monkeypatch):
+    monkeypatch.setattr(utils, "PERSISTENCE_MODE", "records")
+    game_state = utils.load_game_state()
+    assert os.path.isdir(GAME_STATE_DIR)
+    run_game_command("register alice human warrior fire", "+15550000001", game_state)
+    run_game_command("register bob elf mage water", "+15550000002", game_state)
+    run_game_command("duel bob", "+15550000001", game_state)
+    assert utils.state_as_dict(utils.load_game_state()) == utils.state_as_dict(game_state)
@@ -0,0 +1,143 @@
+import threading
+
+import pytest
+
+import command_runner
+import utils
+from command_runner import run_game_command
+from game_logic import process_game_command
+from shared_store import SharedStore
+from state_tracking import collect_changes, reset_tracking, track_sections
+
+ALICE, BOB = "+15550000001", "+15550000002"
+
+
+def new_player(username):
+    return {"username": username, "gold": 100, "in_battle": False}
+
+
+def open_worker(path="shared.db"):
+    """Open the shared database the way a worker process does, returning (store, game state)"""
+    store = SharedStore(path)
+    store.seed({"players": {ALICE: new_player("alice")}})
+    game_state = utils.new_game_state()
+    game_state.update(store.load())
+    return store, track_sections(game_state)
+
+
+def commit_gold(store, game_state, phone, amount):
+    reset_tracking(game_state)
+    game_state["players"][phone]["gold"] += amount
+    return store.commit(game_state, collect_changes(game_state))
+
+
+def test_stale_commit_is_refused_and_reloaded():
+    first, first_state = open_worker()
+    second, second_state = open_worker()
+
+    assert commit_gold(first, first_state, ALICE, 10)
+    assert not commit_gold(second, second_state, ALICE, 5)
+    assert second.conflicts == 1
+    # The losing worker holds the committed value again and its retry succeeds
+    assert second_state["players"][ALICE]["gold"] == 110
+    assert commit_gold(second, second_state, ALICE, 5)
+
+    first.refresh(first_state)
+    assert first_state["players"][ALICE]["gold"] == 115
+    assert open_worker()[1]["players"][ALICE]["gold"] == 115
+
+
+def test_exactly_one_of_two_racing_commits_wins():
+    workers = [open_worker() for _ in range(2)]
+    barrier = threading.Barrier(len(workers))
+    results = []
+
+    def race(store, game_state):
+        # Each worker uses its own connection, as separate processes would
+        reset_tracking(game_state)
+        game_state["players"][ALICE]["gold"] += 10
+        changes = collect_changes(game_state)
+        barrier.wait()
+        results.append(store.commit(game_state, changes))
+
+    threads = [threading.Thread(target=race, args=worker) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert sorted(results) == [False, True]
+    assert open_worker()[1]["players"][ALICE]["gold"] == 110
+    for _, game_state in workers:
+        assert game_state["players"][ALICE]["gold"] == 110
+
+
+def test_refresh_applies_changes_and_deletions_of_other_workers():
+    first, first_state = open_worker()
+    second, second_state = open_worker()
+
+    reset_tracking(first_state)
+    first_state["players"][BOB] = new_player("bob")
+    del first_state["players"][ALICE]
+    assert first.commit(first_state, collect_changes(first_state))
+
+    assert second.refresh(second_state) == 2
+    assert dict(second_state["players"]) == {BOB: new_player("bob")}
+    # Nothing new to apply
+    assert second.refresh(second_state) == 0
+
+
+def test_a_username_is_claimed_by_one_phone_only():
+    first, first_state = open_worker()
+    second, second_state = open_worker()
+
+    reset_tracking(first_state)
+    first_state["players"][BOB] = new_player("bob")
+    assert first.commit(first_state, collect_changes(first_state))
+
+    reset_tracking(second_state)
+    second_state["players"]["+15550000003"] = new_player("BOB")
+    assert not second.commit(second_state, collect_changes(second_state))
+    assert "+15550000003" not in second_state["players"]
+
+    # The existing holder can still save its player
+    assert commit_gold(first, first_state, BOB, 1)
+
+
+def test_usernames_of_an_older_database_are_claimed_on_open():
+    store, _ = open_worker()
+    store._connection().execute("DELETE FROM usernames")
+    other, other_state = open_worker()
+    reset_tracking(other_state)
+    other_state["players"][BOB] = new_player("Alice")
+    assert not other.commit(other_state, collect_changes(other_state))
+
+
+@pytest.fixture
+def shared_mode(monkeypatch):
+    monkeypatch.setattr(utils, "PERSISTENCE_MODE", "shared")
+    monkeypatch.setattr(utils, "_shared_store", None)
+
+
+def test_conflicting_command_is_run_again_on_fresh_data(shared_mode, monkeypatch):
+    game_state = utils.load_game_state()
+    run_game_command("register alice human warrior fire", ALICE, game_state)
+    other, other_state = open_worker(utils._shared_store.path)
+    runs = []
+
+    def quest_racing_another_worker(command, player_phone, game_state):
+        runs.append(command)
+        if len(runs) == 1:
+            # Another worker saves the same player while this command runs
+            assert commit_gold(other, other_state, ALICE, 1000)
+        return process_game_command(command, player_phone, game_state)
+
+    monkeypatch.setattr(command_runner, "process_game_command", quest_racing_another_worker)
+    assert "completed" in run_game_command("quest 1", ALICE, game_state)
+
+    assert len(runs) == 2
+    assert utils._shared_store.conflicts == 1
+    gold = game_state["players"][ALICE]["gold"]
+    assert gold > 100 + 1000
+    other.refresh(other_state)
+    assert other_state["players"][ALICE]["gold"] == gold
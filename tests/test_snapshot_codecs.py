@@ -0,0 +1,62 @@
+import pytest
+
+import utils
+from snapshot_codecs import CODECS, BinaryCodec, MsgpackCodec, decode_snapshot, detect_codec, get_codec
+
+
+@pytest.fixture(params=["json", "binary", "msgpack"])
+def codec(request):
+    if request.param not in CODECS:
+        pytest.skip(f"{request.param} is not installed")
+    return get_codec(request.param)
+
+
+def sample_state():
+    game_state = utils.new_game_state()
+    game_state["players"]["+15550000001"] = {
+        "username": "Ünïcode", "gold": 2 ** 40, "karma": -3, "ratio": 0.1, "in_battle": False,
+        "skills": ["Punch"], "equipped": {}, "title": None,
+    }
+    game_state["empty section"] = {}
+    return game_state
+
+
+def test_round_trip(codec):
+    game_state = sample_state()
+    assert codec.decode(codec.encode(game_state)) == game_state
+
+
+def test_codec_is_detected_from_the_header(codec):
+    data = codec.encode(sample_state())
+    assert detect_codec(data) is codec
+    assert decode_snapshot(data) == sample_state()
+
+
+def test_snapshot_files_are_read_whichever_codec_wrote_them(codec):
+    utils.write_snapshot(sample_state(), codec=codec.name)
+    assert utils.read_snapshot() == sample_state()
+
+
+def test_msgpack_snapshot_without_msgpack_is_refused(monkeypatch):
+    monkeypatch.delitem(CODECS, "msgpack", raising=False)
+    with pytest.raises(ValueError, match="msgpack"):
+        detect_codec(MsgpackCodec.MAGIC + b"\x01\x80")
+
+
+def test_damaged_binary_snapshots_are_refused():
+    data = BinaryCodec().encode({"players": {}, "active_battles": {}})
+    header = len(BinaryCodec.MAGIC) + 1
+    second_frame = data.index(b"active_battles") - 2
+    for length in range(header + 1, len(data)):
+        if length == second_frame:
+            # A cut between frames reads as a snapshot with fewer sections
+            continue
+        with pytest.raises(ValueError, match="Truncated"):
+            decode_snapshot(data[:length])
+    with pytest.raises(ValueError, match="version 2"):
+        decode_snapshot(BinaryCodec.MAGIC + b"\x02" + data[len(BinaryCodec.MAGIC) + 1:])
+
+
+def test_unknown_codec_is_refused():
+    with pytest.raises(ValueError, match="Unknown snapshot codec"):
+        get_codec("pickle")
@@ -0,0 +1,120 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+PHONES = [f"+1555{index:07d}" for index in range(1200)]
+
+
+def new_player(index, **changes):
+    player = {
+        "username": f"player{index}", "race": "Human", "class": "Warrior", "element": "Fire",
+        "level": 1, "experience": 0, "gold": 100, "karma": 0, "rank": "G",
+        "attributes": {"strength": 5, "agility": 4, "intelligence": 3, "endurance": 6},
+        "skills": ["Punch", "Precision Shot"], "inventory": ["Potion", "Potion", "Sword"],
+        "equipped": {"weapon": "Sword"}, "is_deity": False, "in_battle": False,
+        "created_at": 1000.0 + index,
+    }
+    player.update(changes)
+    return player
+
+
+@pytest.fixture
+def sql(flask_app):
+    """The sql_player_store module; its models can only be imported once the app is"""
+    import sql_player_store
+    return sql_player_store
+
+
+@pytest.fixture
+def engine(flask_app):
+    # One connection shared by every checkout, so the in-memory database outlives each statement
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    flask_app.db.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_players_are_imported_once(sql, engine):
+    players = {phone: new_player(index) for index, phone in enumerate(PHONES[:3])}
+    store = sql.SqlPlayerStore.from_game_state(engine, players)
+    assert store.count() == 3
+    # Read back through a new store, so nothing comes from the cache
+    assert dict(sql.SqlPlayerStore(engine).items()) == players
+
+    sql.SqlPlayerStore.from_game_state(engine, {PHONES[3]: new_player(3)})
+    assert sql.SqlPlayerStore(engine).count() == 3
+
+
+def test_batched_upserts_and_deletes(sql, engine):
+    players = {phone: new_player(index) for index, phone in enumerate(PHONES)}
+    store = sql.SqlPlayerStore.from_game_state(engine, players)
+    assert store.count() == len(PHONES)
+
+    changed = {phone: new_player(index, gold=index, skills=["Punch"], equipped={}, title="Hero")
+               for index, phone in enumerate(PHONES) if index % 2 == 0}
+    deleted = PHONES[1:600:2]
+    store.persist([(phone, sql.encode_record(player)) for phone, player in changed.items()]
+                  + [(phone, None) for phone in deleted])
+
+    expected = dict(players, **changed)
+    for phone in deleted:
+        del expected[phone]
+    reopened = sql.SqlPlayerStore(engine)
+    assert reopened.count() == len(expected)
+    assert dict(reopened.items()) == expected
+    with engine.connect() as conn:
+        # Child rows of deleted players went with them
+        assert conn.execute(text("SELECT COUNT(*) FROM player_skill")).scalar_one() == 600 + 300 * 2
+
+
+def test_least_recently_used_players_are_evicted(sql, engine):
+    players = {phone: new_player(index) for index, phone in enumerate(PHONES[:5])}
+    store = sql.SqlPlayerStore.from_game_state(engine, players, cache_size=2)
+    for phone in PHONES[:5]:
+        store.peek(phone)
+    assert list(store._cache) == PHONES[3:5]
+
+    # Touched and unsaved players stay cached however many others are read
+    store[PHONES[0]]["gold"] = 500
+    del store[PHONES[1]]
+    for phone in PHONES[2:5]:
+        store.peek(phone)
+    changes = store.drain()
+    for phone in PHONES[2:5]:
+        store.peek(phone)
+    assert store.peek(PHONES[0])["gold"] == 500 and PHONES[1] not in store
+
+    store.persist(changes)
+    store.peek(PHONES[4])
+    assert len(store._cache) == 2
+    assert store.peek(PHONES[0])["gold"] == 500
+    assert PHONES[1] not in sql.SqlPlayerStore(engine)
+
+
+def test_index_entries_read_only_the_requested_columns(sql, engine):
+    players = {phone: new_player(index, title=f"title{index}") for index, phone in enumerate(PHONES[:3])}
+    store = sql.SqlPlayerStore.from_game_state(engine, players)
+    store[PHONES[0]]["username"] = "renamed"
+
+    entries = dict(store.index_entries(["username", "title"]))
+    # A cached player may hold unsaved changes and is returned whole
+    assert entries[PHONES[0]]["username"] == "renamed"
+    assert entries[PHONES[1]] == {"username": "player1", "title": "title1"}
+    store.discard()
+
+
+def test_columns_added_later_are_migrated(sql, engine):
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE player DROP COLUMN in_battle"))
+        conn.execute(text("ALTER TABLE player DROP COLUMN extra"))
+        conn.execute(text(
+            "INSERT INTO player (phone_number, username, race, character_class, element, level, experience,"
+            " gold, karma, strength, agility, intelligence, endurance, rank, is_deity)"
+            " VALUES ('+15550000001', 'old', 'Elf', 'Mage', 'Water', 3, 10, 50, 0, 1, 2, 3, 4, 'F', 0)"
+        ))
+
+    assert sql.migrate_schema(engine) == ["in_battle", "extra"]
+    assert sql.migrate_schema(engine) == []
+    player = sql.SqlPlayerStore(engine)["+15550000001"]
+    assert player["username"] == "old" and player["in_battle"] is False
+    assert set(player) == set(new_player(0)) - {"created_at"}
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+import twilio_integration
+from twilio_integration import TokenBucket, broadcast, get_twilio_client, send_whatsapp_message
+
+
+class MessagesApi(ThreadingHTTPServer):
+    """Local stand-in for Twilio's Messages API; recipients starting with +1999 are rejected"""
+    daemon_threads = True
+
+    def __init__(self):
+        self.connections = 0
+        self.received = []
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), MessagesApiHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class MessagesApiHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so pooled connections are reused
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+        to, body = form["To"][0], form["Body"][0]
+        # Enough latency for the broadcast threads to overlap
+        time.sleep(0.005)
+        if to.startswith("whatsapp:+1999"):
+            status, payload = 400, {"code": 21211, "message": "Invalid 'To' Phone Number", "status": 400}
+        else:
+            with self.server.lock:
+                self.server.received.append((to, body))
+                sid = f"SM{len(self.server.received):032x}"
+            status, payload = 201, {"sid": sid, "status": "queued", "to": to, "body": body}
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def messages_api(monkeypatch):
+    server = MessagesApi()
+    monkeypatch.setattr(twilio_integration, "TWILIO_ACCOUNT_SID", "AC" + "0" * 32)
+    monkeypatch.setattr(twilio_integration, "TWILIO_AUTH_TOKEN", "token")
+    monkeypatch.setattr(twilio_integration, "TWILIO_PHONE_NUMBER", "+15550000000")
+    monkeypatch.setattr(twilio_integration, "TWILIO_API_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(twilio_integration, "TWILIO_SEND_RATE", 10 ** 6)
+    monkeypatch.setattr(twilio_integration, "TWILIO_SEND_BURST", 10 ** 6)
+    monkeypatch.setattr(twilio_integration, "_client", None)
+    monkeypatch.setattr(twilio_integration, "_send_limits", {})
+    monkeypatch.setattr(twilio_integration, "_spool", None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_client_is_created_once(messages_api):
+    client = get_twilio_client()
+    assert get_twilio_client() is client
+    assert isinstance(client.http_client, twilio_integration.PooledHttpClient)
+
+
+def test_broadcast_returns_one_result_per_phone_in_order(messages_api):
+    phones = [f"+1555{index:07d}" for index in range(60)]
+    phones[7] = "+19990000007"
+    phones[42] = "+19990000042"
+
+    results = broadcast(phones, "Server announcement", workers=8)
+
+    assert [result.phone for result in results] == phones
+    for result in results:
+        if result.phone.startswith("+1999"):
+            assert result.sid is None and result.error
+        else:
+            assert result.sid.startswith("SM") and result.error is None
+    assert sorted(messages_api.received) == sorted(
+        (f"whatsapp:{phone}", "Server announcement") for phone in phones if not phone.startswith("+1999")
+    )
+
+
+def test_broadcast_reuses_pooled_connections(messages_api):
+    phones = [f"+1555{index:07d}" for index in range(200)]
+    get_twilio_client()
+    results = broadcast(phones, "Server announcement", workers=8)
+
+    assert not any(result.error for result in results)
+    # One connection per broadcast thread at most, not one per message
+    assert messages_api.connections <= 8
+
+
+def test_send_whatsapp_message_delivers_directly_without_a_spool(messages_api):
+    send_whatsapp_message("whatsapp:+15550000001", "Hello")
+    assert messages_api.received == [("whatsapp:+15550000001", "Hello")]
+
+
+def test_send_whatsapp_message_enqueues_with_a_spool(messages_api, monkeypatch):
+    class Spool:
+        def __init__(self):
+            self.messages = []
+
+        def enqueue(self, phone, message):
+            self.messages.append((phone, message))
+
+    spool = Spool()
+    monkeypatch.setattr(twilio_integration, "_spool", spool)
+    send_whatsapp_message("+15550000001", "Hello")
+    assert spool.messages == [("+15550000001", "Hello")]
+    assert messages_api.received == []
+
+
+def test_nothing_is_sent_without_credentials(messages_api, monkeypatch):
+    monkeypatch.setattr(twilio_integration, "TWILIO_AUTH_TOKEN", None)
+    send_whatsapp_message("+15550000001", "Hello")
+    results = broadcast(["+15550000001"], "Hello")
+    assert messages_api.received == []
+    assert results[0].sid is None and results[0].error
+
+
+def test_token_bucket_limits_the_rate():
+    bucket = TokenBucket(rate=200, burst=5)
+    start = time.monotonic()
+    for _ in range(25):
+        bucket.acquire()
+    # The burst is free, the 20 other tokens take 20 / 200 seconds
+    assert time.monotonic() - start >= 0.09
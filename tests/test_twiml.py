@@ -0,0 +1,61 @@
+import pytest
+from twilio.twiml.messaging_response import MessagingResponse
+
+import twilio_integration
+import utils
+from idempotency import cached_reply
+from state_tracking import track_sections
+from twiml import EMPTY_RESPONSE, message_twiml, render_twiml
+
+BODIES = [
+    "Welcome player1!",
+    "Gold & glory",
+    "a < b > c",
+    "<Message>not a tag</Message>",
+    "&amp; is already escaped",
+    "He said \"hi\" and 'bye'",
+    "Épée forgée à Zürich",
+    "⚔️ Battle won! 🏆💰",
+    "Line one\nLine two\r\nLine three\ttabbed",
+    "  leading and trailing spaces  ",
+    "]]> <![CDATA[",
+    "",
+    None,
+]
+
+
+def library_twiml(body):
+    response = MessagingResponse()
+    response.message(body)
+    return str(response)
+
+
+@pytest.mark.parametrize("body", BODIES)
+def test_message_twiml_matches_messaging_response(body):
+    assert message_twiml(body) == library_twiml(body)
+
+
+@pytest.mark.parametrize("body", [body for body in BODIES if body is not None])
+def test_render_twiml_of_text_matches_messaging_response(body):
+    assert render_twiml(body) == library_twiml(body)
+
+
+def test_empty_response_matches_messaging_response():
+    assert EMPTY_RESPONSE == str(MessagingResponse())
+    assert render_twiml(None) == str(MessagingResponse())
+
+
+def test_render_twiml_serializes_a_messaging_response():
+    response = MessagingResponse()
+    response.message("First & <second>")
+    response.message("Third")
+    assert render_twiml(response) == str(response)
+
+
+def test_incoming_message_reply_matches_messaging_response():
+    game_state = track_sections(utils.new_game_state())
+    reply = twilio_integration.process_incoming_message(
+        "register player1 human warrior fire", "whatsapp:+15550000001", game_state, message_sid="SM1"
+    )
+    assert reply.startswith('<?xml version="1.0" encoding="UTF-8"?><Response><Message>Welcome player1')
+    assert cached_reply("SM1") == reply
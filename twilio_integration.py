@@ -1,9 +1,19 @@
 import os
+import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from requests.adapters import HTTPAdapter
 from twilio.rest import Client
-from twilio.twiml.messaging_response import MessagingResponse
+from twilio.http.http_client import TwilioHttpClient
 
-from game_logic import process_game_command
+from command_runner import run_game_command
+from outbound_spool import OutboundSpool
+from twiml import EMPTY_RESPONSE, message_twiml, render_twiml
+from idempotency import cached_reply
 
 # Initialize logging
 logger = logging.getLogger(__name__)
@@ -13,57 +23,184 @@ TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.environ.get("TWILIO_PHONE_NUMBER")
 
+# Send API requests to this scheme://host[:port] instead of Twilio's, e.g. a local stand-in
+TWILIO_API_BASE_URL = os.environ.get("TWILIO_API_BASE_URL")
+
+# Seconds before an API request is abandoned
+TWILIO_TIMEOUT = float(os.environ.get("TWILIO_TIMEOUT", "10"))
+
+# Messages per second and burst size allowed per sender number
+TWILIO_SEND_RATE = float(os.environ.get("TWILIO_SEND_RATE", "80"))
+TWILIO_SEND_BURST = int(os.environ.get("TWILIO_SEND_BURST", "80"))
+
+# Threads sending a broadcast, also the number of pooled HTTP connections
+BROADCAST_WORKERS = int(os.environ.get("GAME_BROADCAST_WORKERS", "16"))
+
+class SendResult(NamedTuple):
+    """Outcome of sending one message: the Twilio message sid, or the error"""
+    phone: str
+    sid: Optional[str]
+    error: Optional[str]
+
+class TokenBucket:
+    """Blocking rate limiter: rate tokens per second, at most burst saved up"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class PooledHttpClient(TwilioHttpClient):
+    """Twilio HTTP client keeping a pool of connections, optionally aimed at another host"""
+
+    def __init__(self, base_url: str = None, pool_size: int = BROADCAST_WORKERS, timeout: float = TWILIO_TIMEOUT):
+        super().__init__(pool_connections=True, timeout=timeout)
+        # Enough connections for every broadcast thread, so none is opened per message
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.base_url = urlsplit(base_url) if base_url else None
+
+    def request(self, method, url, *args, **kwargs):
+        if self.base_url:
+            url = urlunsplit(urlsplit(url)._replace(scheme=self.base_url.scheme, netloc=self.base_url.netloc))
+        return super().request(method, url, *args, **kwargs)
+
+_client = None
+_client_lock = threading.Lock()
+_send_limits: Dict[str, TokenBucket] = {}
+# Outbound spool send_whatsapp_message enqueues to, once started
+_spool = None
+
+def get_twilio_client() -> Client:
+    """Return the process-wide Twilio client, created on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                http_client = PooledHttpClient(TWILIO_API_BASE_URL)
+                _client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=http_client)
+    return _client
+
+def _send_limit(from_phone: str) -> TokenBucket:
+    with _client_lock:
+        bucket = _send_limits.get(from_phone)
+        if bucket is None:
+            bucket = _send_limits[from_phone] = TokenBucket(TWILIO_SEND_RATE, TWILIO_SEND_BURST)
+        return bucket
+
+def twilio_configured() -> bool:
+    return bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_PHONE_NUMBER)
+
+def strip_whatsapp_prefix(phone: str) -> str:
+    """Return the bare phone number of a WhatsApp address"""
+    if phone.startswith("whatsapp:"):
+        return phone[9:]
+    return phone
+
+def _whatsapp_address(phone: str) -> str:
+    return phone if phone.startswith("whatsapp:") else f"whatsapp:{phone}"
+
+def deliver_whatsapp_message(to_phone: str, message: str) -> str:
+    """Send one message through the shared client and return its sid; raises on failure"""
+    from_phone = _whatsapp_address(TWILIO_PHONE_NUMBER)
+    _send_limit(from_phone).acquire()
+    sent = get_twilio_client().messages.create(
+        body=message,
+        from_=from_phone,
+        to=_whatsapp_address(to_phone)
+    )
+    return sent.sid
+
+def start_outbound_spool(path: str = None) -> OutboundSpool:
+    """Deliver messages sent with send_whatsapp_message from a durable spool from now on"""
+    global _spool
+    _spool = OutboundSpool(deliver_whatsapp_message, path).start()
+    _spool.install_shutdown_hooks()
+    return _spool
+
+def outbound_spool() -> Optional[OutboundSpool]:
+    return _spool
+
 def send_whatsapp_message(to_phone: str, message: str) -> None:
-    """Send a WhatsApp message using Twilio"""
-    if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_PHONE_NUMBER:
+    """Send a WhatsApp message using Twilio
+
+    With the outbound spool started, the message is only spooled and sent in the background.
+    """
+    if not twilio_configured():
         logger.error("Twilio credentials not properly configured")
         return
     
+    if _spool is not None:
+        _spool.enqueue(to_phone, message)
+        return
+    
     try:
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        
-        # Format to WhatsApp format if needed
-        if not to_phone.startswith("whatsapp:"):
-            to_phone = f"whatsapp:{to_phone}"
-        
-        if not TWILIO_PHONE_NUMBER.startswith("whatsapp:"):
-            from_phone = f"whatsapp:{TWILIO_PHONE_NUMBER}"
-        else:
-            from_phone = TWILIO_PHONE_NUMBER
-        
-        # Send message
-        message = client.messages.create(
-            body=message,
-            from_=from_phone,
-            to=to_phone
-        )
-        
-        logger.info(f"Message sent with SID: {message.sid}")
+        sid = deliver_whatsapp_message(to_phone, message)
+        logger.info(f"Message sent with SID: {sid}")
     
     except Exception as e:
         logger.error(f"Error sending WhatsApp message: {e}")
 
-def process_incoming_message(message_body: str, sender_phone: str, game_state: dict) -> MessagingResponse:
-    """Process an incoming WhatsApp message and return a TwiML response"""
+def broadcast(phones: List[str], message: str, workers: int = BROADCAST_WORKERS) -> List[SendResult]:
+    """Send the same message to many players in parallel, one result per phone in order
+
+    Sends share the pooled client and the sender number's rate limit.
+    """
+    if not twilio_configured():
+        logger.error("Twilio credentials not properly configured")
+        return [SendResult(phone, None, "Twilio credentials not properly configured") for phone in phones]
+    
+    def send_one(phone: str) -> SendResult:
+        try:
+            return SendResult(phone, deliver_whatsapp_message(phone, message), None)
+        except Exception as e:
+            return SendResult(phone, None, str(e))
+    
+    if not phones:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(phones)), thread_name_prefix="broadcast") as pool:
+        results = list(pool.map(send_one, phones))
+    
+    failed = sum(1 for result in results if result.error)
+    logger.info(f"Broadcast to {len(results)} players, {failed} failed")
+    return results
+
+def process_incoming_message(message_body: str, sender_phone: str, game_state: dict,
+                             message_sid: str = None) -> str:
+    """Process an incoming WhatsApp message and return the TwiML response
+
+    Retries of an already processed MessageSid get the original response back, byte for byte.
+    """
     try:
         # Clean up phone format if needed
-        if sender_phone.startswith("whatsapp:"):
-            sender_phone = sender_phone[9:]  # Remove "whatsapp:" prefix
+        sender_phone = strip_whatsapp_prefix(sender_phone)
         
-        # Process the game command
-        response_text = process_game_command(message_body, sender_phone, game_state)
+        # Process the game command (locks the players involved and persists the changes)
+        response_text = run_game_command(message_body, sender_phone, game_state, message_sid=message_sid)
+        if response_text is None:
+            # A Twilio retry, answered from the reply cache without running the command
+            return cached_reply(message_sid) or EMPTY_RESPONSE
         
-        # Create TwiML response
-        resp = MessagingResponse()
-        resp.message(response_text)
-        
-        return resp
+        # Single-message TwiML, without building a MessagingResponse
+        return render_twiml(response_text)
     
     except Exception as e:
         logger.error(f"Error processing incoming message: {e}")
         
         # Create error response
-        resp = MessagingResponse()
-        resp.message("Sorry, an error occurred. Please try again later.")
-        
-        return resp
+        return message_twiml("Sorry, an error occurred. Please try again later.")
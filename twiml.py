@@ -0,0 +1,39 @@
+from typing import Optional, Union
+
+from twilio.twiml.messaging_response import MessagingResponse
+
+# What the twilio library puts before every TwiML document
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+
+# TwiML acknowledging a message without replying
+EMPTY_RESPONSE = f"{XML_DECLARATION}<Response />"
+
+
+def escape_text(text: str) -> str:
+    """Escape element text the way ElementTree (and so the twilio library) does"""
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def message_twiml(body: Optional[str]) -> str:
+    """Return the TwiML for a single reply message, byte-identical to MessagingResponse
+
+    Same as building a MessagingResponse, calling message(body) and str() on it.
+    """
+    if not body:
+        return f"{XML_DECLARATION}<Response><Message /></Response>"
+    return f"{XML_DECLARATION}<Response><Message>{escape_text(body)}</Message></Response>"
+
+
+def render_twiml(reply: Union[str, MessagingResponse, None]) -> str:
+    """Serialize a reply: plain text takes the fast path, richer responses the twilio library"""
+    if reply is None:
+        return EMPTY_RESPONSE
+    if isinstance(reply, str):
+        return message_twiml(reply)
+    return str(reply)
@@ -1,63 +1,282 @@
 import os
-import json
 import logging
-from typing import Dict, Any
+import shutil
+import threading
+from typing import Dict, Any, Iterable, List, Optional
+
+from state_tracking import Change, track_sections, collect_changes, file_sections, persist_external
+from journal import append_changes, replay_journal, compact_journal
+import record_store
+from atomic_file import atomic_write
+from snapshot_codecs import get_codec, decode_snapshot
+from state_flusher import StateFlusher, FLUSH_INTERVAL
+from locking import state_lock
+from shared_store import SharedStore, ConflictError
+from idempotency import ReplyStore, use_reply_store
 
 # Initialize logging
 logger = logging.getLogger(__name__)
 
 # Game state file
-GAME_STATE_FILE = "game_state.json"
+GAME_STATE_FILE = os.environ.get("GAME_STATE_FILE", "game_state.json")
 
-def save_game_state(game_state: Dict[str, Any]) -> bool:
-    """Save the game state to a JSON file"""
-    try:
-        with open(GAME_STATE_FILE, 'w') as f:
-            json.dump(game_state, f, indent=2)
+# Snapshot codec: "json" for debugging, "binary" (or "msgpack" if installed) for speed
+SNAPSHOT_CODEC = os.environ.get("GAME_SNAPSHOT_CODEC", "json")
+
+# Persistence mode: "snapshot" rewrites the whole file, "journal" appends changed entries,
+# "records" keeps one file per entry and rewrites only the changed ones, "shared" keeps
+# versioned entries in a SQLite database that several worker processes can use at once
+PERSISTENCE_MODE = os.environ.get("GAME_PERSISTENCE_MODE", "snapshot")
+
+# Number of journal records after which the journal is compacted into a snapshot
+JOURNAL_COMPACT_EVERY = int(os.environ.get("GAME_JOURNAL_COMPACT_EVERY", "1000"))
+
+# Journal records written since the last snapshot
+_journal_records = 0
+_journal_records_lock = threading.Lock()
+
+# Background flusher, if started
+_flusher = None
+
+# Shared SQLite store, in "shared" persistence mode
+_shared_store = None
+
+# Serializes snapshot writes, so they reach the disk in the order they were encoded
+_snapshot_lock = threading.RLock()
+
+# Set when changes were written while the state lock was held shared and a snapshot
+# (or journal compaction) still has to follow
+_snapshot_due = threading.Event()
+
+def new_game_state() -> Dict[str, Any]:
+    """Create an empty game state"""
+    return {
+        "players": {},
+        "active_battles": {},
+        "zones": {
+            "Forest": {"element_bonus": "Plant", "element_penalty": "Fire"},
+            "Volcano": {"element_bonus": "Fire", "element_penalty": "Water"},
+            "Ocean": {"element_bonus": "Water", "element_penalty": "Plant"},
+            "Mountain": {"element_bonus": "Earth", "element_penalty": "Wind"},
+            "Sky": {"element_bonus": "Wind", "element_penalty": "Earth"}
+        },
+        "items": {},
+        "deities": {}
+    }
+
+def write_snapshot(game_state: Dict[str, Any], path: str = None, codec: str = None) -> None:
+    """Atomically write the full game state (minus sections with their own storage) as a snapshot"""
+    encoder = get_codec(codec or SNAPSHOT_CODEC)
+    # An older snapshot finishing last would otherwise replace a newer one
+    with _snapshot_lock:
+        # Commands must not modify the state while it is being serialized
+        with state_lock.exclusive():
+            data = encoder.encode(file_sections(game_state))
+        atomic_write(path or GAME_STATE_FILE, data)
+
+def compact_game_journal(game_state: Dict[str, Any]) -> None:
+    """Fold the journal into a fresh snapshot while no command can append to it
+
+    The state lock is taken before the journal lock, the order commands appending
+    under the shared state lock take them in.
+    """
+    encoder = get_codec(SNAPSHOT_CODEC)
+    with _snapshot_lock, state_lock.exclusive():
+        compact_journal(lambda: atomic_write(GAME_STATE_FILE, encoder.encode(file_sections(game_state))))
+
+def read_snapshot(path: str = None) -> Dict[str, Any]:
+    """Read a snapshot written with any codec"""
+    with open(path or GAME_STATE_FILE, 'rb') as f:
+        return decode_snapshot(f.read())
+
+def state_as_dict(game_state: Dict[str, Any], exclude: Iterable[str] = ()) -> Dict[str, Any]:
+    """Return a JSON-serializable view of the game state, including store-backed sections
+
+    Excluded sections are skipped without being read, so no store-backed entries are loaded for them.
+    """
+    exclude = set(exclude)
+    return {
+        name: section if isinstance(section, dict) else dict(section.items())
+        for name, section in game_state.items() if name not in exclude
+    }
+
+def write_changes(game_state: Dict[str, Any], changes: List[Change], defer_snapshot: bool = False) -> None:
+    """Write collected changes to the configured persistence backend
+
+    With defer_snapshot (the caller holds the state lock shared) a snapshot or
+    journal compaction is only marked as due, for write_due_snapshot.
+    """
+    global _journal_records
+    changes = persist_external(game_state, changes)
+    if not changes:
+        return
+
+    if PERSISTENCE_MODE == "journal":
+        written = append_changes(changes)
+        with _journal_records_lock:
+            _journal_records += written
+            compact = _journal_records >= JOURNAL_COMPACT_EVERY
+            if compact:
+                _journal_records = 0
+        if compact and defer_snapshot:
+            _snapshot_due.set()
+        elif compact:
+            compact_game_journal(game_state)
+        logger.info(f"Journaled {written} game state changes")
+    elif PERSISTENCE_MODE == "records":
+        written = record_store.write_changes(changes)
+        logger.info(f"Wrote {written} game state records")
+    elif PERSISTENCE_MODE == "shared":
+        if not _shared_store.commit(game_state, changes):
+            raise ConflictError("Game state entries were changed by another worker")
+    elif defer_snapshot:
+        _snapshot_due.set()
+    else:
+        write_snapshot(game_state)
         logger.info("Game state saved successfully")
+
+def write_due_snapshot(game_state: Dict[str, Any]) -> None:
+    """Write the snapshot or journal compaction deferred by write_changes, if any"""
+    with _snapshot_lock:
+        if not _snapshot_due.is_set():
+            return
+        # Cleared before encoding: changes staged from now on mark it due again
+        _snapshot_due.clear()
+        if PERSISTENCE_MODE == "journal":
+            compact_game_journal(game_state)
+        else:
+            write_snapshot(game_state)
+            logger.info("Game state saved successfully")
+
+def start_background_flusher(game_state: Dict[str, Any], interval: float = FLUSH_INTERVAL) -> StateFlusher:
+    """Write changes from a background thread, at most once per interval"""
+    global _flusher
+    if PERSISTENCE_MODE == "shared":
+        # Conflicts with other workers must be detected before a command replies
+        logger.warning("The background flusher is not used in shared persistence mode")
+        return None
+    if _flusher is None:
+        _flusher = StateFlusher(lambda changes: write_changes(game_state, changes), interval=interval).start()
+        _flusher.install_shutdown_hooks()
+        logger.info(f"Background state flusher started ({interval}s window)")
+    return _flusher
+
+def save_game_state(game_state: Dict[str, Any], sync: bool = False, changes: List[Change] = None) -> bool:
+    """Persist the entries modified by this thread (or the given changes); no I/O if nothing changed
+
+    With the background flusher running the changes are only queued, unless sync
+    is set, in which case this waits until they are durable. Callers that collected
+    the changes under entry locks should use stage_changes and complete_save instead.
+    """
+    try:
+        if changes is None:
+            changes = collect_changes(game_state)
+    except Exception as e:
+        logger.error(f"Error saving game state: {e}")
+        return False
+    return complete_save(game_state, stage_changes(game_state, changes), sync=sync)
+
+def stage_changes(game_state: Dict[str, Any], changes: List[Change]) -> Optional[int]:
+    """Hand changes to the writer; call it while still holding the locks of the changed entries
+
+    The flusher queue, journal, record files and player stores then receive the
+    payloads of an entry in the order the commands changed it, so an older
+    payload can never overwrite a newer one. Snapshots need the state lock
+    exclusively and are left to complete_save. Returns what complete_save waits
+    for (the flusher generation, or 0), None if writing failed.
+    """
+    try:
+        if _flusher is not None:
+            return _flusher.enqueue(changes)
+        write_changes(game_state, changes, defer_snapshot=True)
+        return 0
+    except Exception as e:
+        logger.error(f"Error saving game state: {e}")
+        return None
+
+def complete_save(game_state: Dict[str, Any], staged: Optional[int], sync: bool = False) -> bool:
+    """Finish a save begun by stage_changes, after the caller released its locks"""
+    if staged is None:
+        return False
+    try:
+        if _flusher is not None:
+            return _flusher.wait(staged) if sync else True
+        write_due_snapshot(game_state)
         return True
     except Exception as e:
         logger.error(f"Error saving game state: {e}")
         return False
 
+def refresh_shared_state(game_state: Dict[str, Any]) -> int:
+    """Pull the entries other workers changed (shared persistence mode only)"""
+    if _shared_store is None:
+        return 0
+    return _shared_store.refresh(game_state)
+
+def commit_shared_changes(game_state: Dict[str, Any], changes: List[Change], replies: List[tuple] = ()) -> bool:
+    """Commit a command's changes (and the replies to remember) to the shared store
+
+    False means they conflicted and were undone.
+    """
+    changes = persist_external(game_state, changes)
+    return _shared_store.commit(game_state, changes, replies)
+
+def shared_state_enabled() -> bool:
+    return _shared_store is not None
+
+def detach_section(game_state: Dict[str, Any], name: str) -> None:
+    """Drop a section that moved to its own storage from the game state files"""
+    if PERSISTENCE_MODE == "shared":
+        _shared_store.delete_section(name)
+    elif PERSISTENCE_MODE == "journal":
+        compact_game_journal(game_state)
+    elif PERSISTENCE_MODE == "records":
+        section_dir = os.path.join(record_store.GAME_STATE_DIR, name)
+        if os.path.isdir(section_dir):
+            shutil.rmtree(section_dir)
+    else:
+        write_snapshot(game_state)
+
 def load_game_state() -> Dict[str, Any]:
-    """Load game state from JSON file or create a new one"""
+    """Load game state from JSON file (plus the journal tail) or create a new one"""
+    global _journal_records, _shared_store
     try:
+        if PERSISTENCE_MODE == "shared":
+            _shared_store = SharedStore()
+            # Replies are committed with the changes, so they live in the shared database too
+            use_reply_store(ReplyStore(_shared_store.path))
+            # The first worker to start migrates the existing snapshot, if any
+            if _shared_store.is_empty():
+                _shared_store.seed(read_snapshot() if os.path.exists(GAME_STATE_FILE) else new_game_state())
+            game_state = new_game_state()
+            game_state.update(_shared_store.load())
+            return track_sections(game_state)
+
+        if PERSISTENCE_MODE == "records":
+            if os.path.isdir(record_store.GAME_STATE_DIR):
+                return track_sections(record_store.load_records())
+            # First start in records mode: migrate the existing snapshot, if any
+            game_state = new_game_state()
+            if os.path.exists(GAME_STATE_FILE):
+                game_state = read_snapshot()
+            record_store.write_all(game_state)
+            logger.info("Game state records created")
+            return track_sections(game_state)
+
         if os.path.exists(GAME_STATE_FILE):
-            with open(GAME_STATE_FILE, 'r') as f:
-                game_state = json.load(f)
+            game_state = read_snapshot()
             logger.info("Game state loaded successfully")
-            return game_state
         else:
             logger.info("No game state file found, creating new")
-            game_state = {
-                "players": {},
-                "active_battles": {},
-                "zones": {
-                    "Forest": {"element_bonus": "Plant", "element_penalty": "Fire"},
-                    "Volcano": {"element_bonus": "Fire", "element_penalty": "Water"},
-                    "Ocean": {"element_bonus": "Water", "element_penalty": "Plant"},
-                    "Mountain": {"element_bonus": "Earth", "element_penalty": "Wind"},
-                    "Sky": {"element_bonus": "Wind", "element_penalty": "Earth"}
-                },
-                "items": {},
-                "deities": {}
-            }
-            save_game_state(game_state)
-            return game_state
+            game_state = new_game_state()
+            if PERSISTENCE_MODE == "snapshot":
+                write_snapshot(game_state)
+
+        if PERSISTENCE_MODE == "journal":
+            _journal_records = replay_journal(game_state)
+
+        return track_sections(game_state)
     except Exception as e:
         logger.error(f"Error loading game state: {e}")
         # Return a new game state
-        return {
-            "players": {},
-            "active_battles": {},
-            "zones": {
-                "Forest": {"element_bonus": "Plant", "element_penalty": "Fire"},
-                "Volcano": {"element_bonus": "Fire", "element_penalty": "Water"},
-                "Ocean": {"element_bonus": "Water", "element_penalty": "Plant"},
-                "Mountain": {"element_bonus": "Earth", "element_penalty": "Wind"},
-                "Sky": {"element_bonus": "Wind", "element_penalty": "Earth"}
-            },
-            "items": {},
-            "deities": {}
-        }
+        return track_sections(new_game_state())